@@ -2,60 +2,53 @@
 # visit http://127.0.0.1:8050/ in your web browser.
 
 import os
-import glob
+import sys
 import json
+import base64
+import importlib
+import threading
+import flask
+from urllib.parse import urlencode
 import warnings
 import numpy as np
 import pandas as pd
-import plotly.express as px
 from collections import OrderedDict
-from dash import Dash, dcc, html, Input, Output, dash_table, State, callback_context
+from dash import Dash, dcc, html, Input, Output, dash_table, State, callback_context, no_update, Patch, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
+import plotly.io as pio
 from dash_bootstrap_templates import ThemeChangerAIO, template_from_url, load_figure_template
+from covid_data import LiveDataset, SharedDataset, REPORT_ROOT, COVID_SCHEMA
+from covid_index import FilterEngine, CountCube, PF_LABELS, normalize_filter, box_stats
+from figure_cache import FigureCache
+from covid_export import csv_chunks, full_csv
+from covid_jobs import JobQueue, excel_job, figure_job, parallel_coordinates_figure, progress_text
+from covid_lineage import LineageIndex, ROOT as LINEAGE_ROOT, share_cut
+from covid_store import SampleStore, STORE_ENABLED, start_sync
+import covid_metrics
+from covid_metrics import stage
 
 warnings.filterwarnings(action='ignore')
 
 
-#22_용역23차(PAC)_87 -> 23_87
-#23_023_PAC_03 -> 23_023_03
+class LazyModule:
+	# 처음 속성을 쓸 때 import (plotly.express 는 import 만 0.1 초 걸려서 첫 그래프를 그릴 때까지 미룸)
+	def __init__(self, name):
+		self._name = name
 
-def input_file_list(folder_path):
-	# 해당 폴더 경로 내의 모든 xlsx 파일을 리스트로 반환하는 함수
-	# folder_path: 파일 리스트를 가져올 폴더 경로
-	# glob.glob() 함수를 사용하여 폴더 내의 모든 xlsx 파일을 가져옴
-	file_list = glob.glob(folder_path + "/./*xlsx")
-	return file_list
+	def __getattr__(self, attr):
+		return getattr(importlib.import_module(self._name), attr)
 
-def covid_table(file_list):
-	# data merge
-	merged_data = pd.DataFrame()
-	for i in file_list:
-		merged_data = pd.concat([merged_data, pd.read_excel(i, header=None).iloc[2:,:]], ignore_index=True)
+px = LazyModule('plotly.express')
 
-	# convert column name
-	merged_data.columns = 'batch', 'date', 'sample', 'QC', 'result', 'day', 'totalreads', 'mappedreads', 'coverage', 'badbases', 'depth', 'length', 'clade', 'pango'
 
-	# [batch] column rename
-	#print(merged_data['batch'].astype('str').str.replace("\(PAC3\)","").str.replace("\(PAC\)","").str.replace("용역","").str.replace("차","").str.split("_", expand = True))
-	merged_data['batch'] = merged_data['batch'].astype('str').str.replace("\(PAC3\)","").str.replace("\(PAC\)","").str.replace("용역","").str.replace("차","").str.split("_", expand = True)[1]
-	
-	# [clade] column rename
-	merged_data['clade'] = merged_data['clade'].astype('str').str.replace(" \(Omicron\)", "")
-
-	# dataframe pivot
-	merged_data = merged_data[['batch', 'sample', 'QC', 'totalreads', 'mappedreads', 'coverage', 'badbases', 'depth', 'length', 'clade', 'pango']]
-
-	# fill nan value
-	merged_data = merged_data.fillna("NA")
-
-	# add pass/fail column
-	#merged_data['pf'] = merged_data['coverage'].apply(lambda x: "PASS" if x >= 0.9 else "FAIL")
-	merged_data.insert(3, 'P/F', merged_data['coverage'].apply(lambda x: "Pass" if x >= 0.9 else "Fail"))
-
-	# dataframe sort by batch
-	merged_data = merged_data.astype({'batch': int}).sort_values(by='batch')
-	return merged_data
+# etc 로 묶어서 보여줄 clade
+# COVID_ETC_MIN_SHARE (예: 0.01) 를 주면 목록 대신 전체 샘플 중 그 비율보다 적은 clade 를 etc 로 묶음 (데이터가 바뀌면 다시 계산)
+DEFAULT_ETC_MAP = {'20C':'etc', '20I (Alpha, V1)':'etc', '21C (Epsilon)':'etc', '21I (Delta)':'etc',
+				   '21K':'etc', '22A':'etc', '22C':'etc', 'recombinant':'etc', '20A':'etc', '19A':'etc', '23A':'etc'}
+ETC_MIN_SHARE = float(os.environ.get("COVID_ETC_MIN_SHARE", "0"))
+clade_etc_map = DEFAULT_ETC_MAP
 
 def QC_table(full_table, qcstate):
 	qc_table = full_table[full_table['QC'] == str(qcstate)]
@@ -64,8 +57,7 @@ def QC_table(full_table, qcstate):
 def groupby_clade(df):
 	#df = df.replace({'clade' : {'20C':'etc', '20I (Alpha, V1)':'etc', '21C (Epsilon)':'etc', '21I (Delta)':'etc',
 	#							'21K (Omicron)':'etc', '22A (Omicron)':'etc', '22C (Omicron)':'etc', 'recombinant':'etc'}})
-	df = df.replace({'clade' : {'20C':'etc', '20I (Alpha, V1)':'etc', '21C (Epsilon)':'etc', '21I (Delta)':'etc',
-								'21K':'etc', '22A':'etc', '22C':'etc', 'recombinant':'etc', '20A':'etc', '19A':'etc', '23A':'etc'}})
+	df = df.replace({'clade' : clade_etc_map})
 	df = df.groupby(['batch','clade'], sort=False)['clade'].count().unstack(fill_value=0).stack().to_frame()
 	df.reset_index(inplace=True)
 	df.columns = 'batch', 'clade', 'count'
@@ -90,14 +82,183 @@ def clade_count(df):
 
 
 
+def require_dataset():
+	# 데이터셋을 다 읽기 전 (백그라운드 로딩 중) 에는 콜백 결과를 보내지 않음
+	if not dataset_ready.is_set():
+		raise PreventUpdate
+
+def batch_marks(batch_min, batch_max):
+	return {str(batch): str(batch) for batch in range(batch_min, batch_max+1, 30)}
+
+def figure_key(year, clade, cov, qc, batch, extra=()):
+	key = normalize_filter(year, clade, cov, qc, batch)
+	if extra:
+		key += (json.dumps(list(extra)),)
+	return key
+
+def cached_figure(figure_id, build, year, clade, cov, qc, batch, extra=()):
+	# 같은 필터 + 같은 데이터 버전이면 직렬화해 둔 figure 를 그대로 반환
+	# extra: 필터 외에 figure 에 영향을 주는 입력 값 (build 에 필터 다음 인자로 전달)
+	def figure():
+		with stage('figure'):
+			return build(year, clade, cov, qc, batch, *extra)
+	return figure_cache.get(figure_id, figure_key(year, clade, cov, qc, batch, extra), dataset.version, figure)
+
+def job_placeholder(text):
+	# 작업 큐에서 figure 를 만드는 동안 보여줄 빈 figure
+	fig = go.Figure()
+	fig.update_layout(title=text, xaxis={'visible': False}, yaxis={'visible': False})
+	return fig
+
+def background_figure(graph_id, build, job, year, clade, cov, qc, batch, extra, rendered):
+	# job(...) 이 작업 (fn, args) 을 주면 (샘플이 많으면) figure 를 작업 큐에서 만들고, 끝날 때까지 진행률만 보여줌
+	# rendered: {'key': 마지막으로 보낸 키, 'job': 기다리는 작업 id}. 기다리는 동안 <graph_id>-job-poll 이 1 초마다 다시 부름
+	# 필터가 바뀌면 기다리던 작업은 취소 (다른 화면도 기다리면 계속), 같은 필터의 작업은 여러 화면이 같이 씀
+	key = json.loads(json.dumps([dataset.version, normalize_filter(year, clade, cov, qc, batch)] + list(extra)))
+	rendered = rendered or {}
+	waiting = rendered.get('job')
+	if rendered.get('key') == key and not waiting:
+		raise PreventUpdate
+	cache_key = figure_key(year, clade, cov, qc, batch, extra)
+	fig = figure_cache.lookup(graph_id, cache_key, dataset.version)
+	if fig is not None:
+		if waiting:
+			job_queue.cancel(waiting)
+		return fig, {'key': key}, True
+
+	# 작업 key 는 프로세스마다 다시 세는 version 대신 데이터셋 fingerprint 로
+	job_key = [graph_id, dataset.fingerprint] + key[1:]
+	job_id = job_queue.job_id(job_key)
+	status = job_queue.status(job_id, '.json')
+	if status['state'] != 'done' and (waiting != job_id or status['state'] in ('cancelled', 'unknown')):
+		work = job(year, clade, cov, qc, batch, *extra)
+		if work is None:
+			if waiting:
+				job_queue.cancel(waiting)
+			return cached_figure(graph_id, build, year, clade, cov, qc, batch, extra), {'key': key}, True
+		job_queue.submit(job_key, '.json', *work, replaces=waiting if waiting != job_id else None)
+		status = job_queue.status(job_id, '.json')
+
+	if status['state'] == 'done':
+		with open(job_queue.path(job_id, '.json')) as f:
+			data = f.read()
+		figure_cache.put((graph_id, cache_key, dataset.version), data)
+		with stage('decode'):
+			return json.loads(data), {'key': key}, True
+	if status['state'] == 'failed':
+		return job_placeholder("Figure failed: %s" % status.get('error', '')), {'key': key}, True
+	return job_placeholder("Preparing figure... " + progress_text(status)), {'key': key, 'job': job_id}, False
+
+def client_codes(values, labels):
+	# 라벨 열을 labels 위치 코드(uint8) base64 로
+	codes = pd.Categorical(values, categories=labels).codes.astype(np.uint8)
+	return {'labels': list(labels), 'codes': base64.b64encode(codes.tobytes()).decode()}
+
+def client_payload():
+	# 브라우저 필터링 모드용 열 단위 데이터 (batch: int16, 라벨 열: uint8 코드) + 색 / 템플릿
+	frame = filter_engine.frame
+	clades = [str(c) for c in count_cube.clades]
+	return {
+		'version': dataset.version,
+		'batch': base64.b64encode(frame['batch'].to_numpy(dtype='<i2').tobytes()).decode(),
+		'year': client_codes(frame['year'].astype(str), [p['name'] for p in filter_engine.partitions]),
+		'qc': client_codes(frame['QC'].astype(str), sorted(frame['QC'].astype(str).unique())),
+		'clade': client_codes(frame['clade'].astype(str).replace(clade_etc_map), clades),
+		'pf': client_codes(frame['P/F'].astype(str), PF_LABELS),
+		'clade_colors': {'22B': 'gray', 'etc': 'yellow'},
+		'pf_colors': {'Pass': 'green', 'Fail': 'red'},
+		'template': pio.templates[pio.templates.default].to_plotly_json(),
+	}
+
+def refresh_dataset(frame, batches, added, removed):
+	# 데이터셋이 바뀌면 전역 데이터프레임, 필터 인덱스, count cube 를 갱신
+	# added / removed: 새 레포트로 추가되고 빠진 행 (None 이면 전체 다시 집계)
+	global covid, covid_groupby_clade, covid_qcgood_groupby_clade, filter_engine, count_cube, lineage_index, clade_etc_map
+	covid = frame
+	with stage('index', len(frame), callback='ingest'):
+		etc_map = clade_etc_map
+		if ETC_MIN_SHARE > 0:
+			etc_map = share_cut(frame['clade'].astype(str).value_counts().to_dict(), ETC_MIN_SHARE)
+		filter_engine = FilterEngine(frame, etc_map)
+		# etc 묶음이 바뀌면 count cube 도 처음부터
+		if added is None or etc_map != clade_etc_map:
+			cube = CountCube(frame, etc_map)
+		else:
+			cube = count_cube.copy()
+			cube.add(removed, -1)
+			cube.add(added)
+		clade_etc_map = etc_map
+		count_cube = cube
+		lineage_index = LineageIndex(count_cube)
+		covid_groupby_clade = count_cube.clade_counts('All', ['All'], 'All', ['All'], [-np.inf, np.inf])
+		covid_qcgood_groupby_clade = count_cube.clade_counts('All', ['All'], 'All', ['good'], [-np.inf, np.inf])
+	figure_cache.clear()
+	job_queue.set_generation(dataset.fingerprint)
+
+
 # COVID DATAFRAME
-covid = pd.concat([covid_table(input_file_list("./input_report_files/2022/")).assign(year='2022'),
-                   covid_table(input_file_list("./input_report_files/2023/")).assign(year='2023')])
+# 새 레포트 파일은 COVID_POLL_INTERVAL 초마다 확인해서 재시작 없이 반영 (0 이면 끔)
+# gunicorn (gunicorn.conf.py) 으로 띄우면 COVID_SHARED_DATASET 이 설정되어 worker 는 레포트를 읽지 않고
+# master 가 만든 snapshot 을 memory-map 으로 공유
+# COVID_REPORT_ROOT 로 레포트 root 폴더를 바꿀 수 있음 (benchmark 는 합성 레포트 폴더로 바꿔서 import)
+POLL_INTERVAL = int(os.environ.get("COVID_POLL_INTERVAL", "30"))
+# 브라우저 필터링 모드: clade / pass-fail 막대그래프와 pass 요약을 브라우저에서 계산 (필터 변경 시 서버 요청 없음)
+# 0: 끔 (기본), 1: 켬, auto: 샘플 수가 CLIENTSIDE_MAX_ROWS 이하일 때만
+CLIENTSIDE = os.environ.get("COVID_CLIENTSIDE", "0")
+CLIENTSIDE_MAX_ROWS = 100000
+# box plot 의 batch 별 outlier 점 상한, parallel coordinates 의 선(행) 상한 (0 이면 전체)
+BOX_MAX_OUTLIERS = int(os.environ.get("COVID_BOX_MAX_OUTLIERS", "50"))
+PARCOORDS_MAX_ROWS = int(os.environ.get("COVID_PARCOORDS_MAX_ROWS", "5000"))
+# Excel 다운로드와 필터된 샘플이 BACKGROUND_MIN_ROWS 개 이상인 parallel coordinates figure 는 작업 큐 프로세스에서 만듦
+# (0 이면 parallel coordinates figure 는 항상 작업 큐에서)
+job_queue = JobQueue()
+BACKGROUND_MIN_ROWS = int(os.environ.get("COVID_BACKGROUND_MIN_ROWS", "200000"))
+BACKGROUND_GRAPHS = ['parallel_coordinates-plot']
+# sunburst 기본 보기 (clade: clade -> pango, lineage: pango 계층) 와 lineage 보기의 단계 수 / etc 로 묶을 비율
+SUNBURST_MODE = os.environ.get("COVID_SUNBURST_MODE", "clade")
+LINEAGE_DEPTH = int(os.environ.get("COVID_LINEAGE_DEPTH", "3"))
+LINEAGE_MIN_SHARE = float(os.environ.get("COVID_LINEAGE_MIN_SHARE", "0.01"))
+# 직렬화된 figure 캐시 용량 (byte, 기본 64MB)
+figure_cache = FigureCache(int(os.environ.get("COVID_FIGURE_CACHE_BYTES", str(64 * 1024 * 1024))))
+# 1 이면 레포트를 백그라운드 스레드에서 읽고 서버와 레이아웃은 바로 뜸. 다 읽을 때까지 /readyz 는 503 이고
+# 콜백은 아무것도 갱신하지 않으며, 다 읽으면 열려 있는 페이지의 필터 옵션을 채움 (ready-poll)
+BACKGROUND_LOAD = os.environ.get("COVID_BACKGROUND_LOAD", "0") == "1"
+covid = covid_groupby_clade = covid_qcgood_groupby_clade = filter_engine = count_cube = lineage_index = None
+dataset_ready = threading.Event()
+dataset_error = None
+if os.environ.get("COVID_SHARED_DATASET"):
+	dataset = SharedDataset()
+else:
+	dataset = LiveDataset(os.environ.get("COVID_REPORT_ROOT", REPORT_ROOT))
+dataset.on_change(refresh_dataset)
+# 샘플별 모든 run (재실험 포함) 을 보관하는 SQLite store (샘플 검색, /api/samples, /api/runs)
+# 단일 프로세스면 데이터가 바뀔 때마다 여기서 백그라운드로 sync, gunicorn 이면 snapshot 프로세스가 sync 하고 worker 는 읽기만
+sample_store = SampleStore()
+SAMPLE_SEARCH_MIN_LENGTH = 3
+SAMPLE_SEARCH_LIMIT = 20
+if STORE_ENABLED and not os.environ.get("COVID_SHARED_DATASET"):
+	dataset.on_change(lambda *changes: start_sync(sample_store, dataset.folders))
+
+def load_dataset():
+	dataset.load()
+	dataset_ready.set()
+	dataset.start_polling(POLL_INTERVAL)
+
+def load_dataset_background():
+	global dataset_error
+	try:
+		load_dataset()
+	except Exception as e:
+		dataset_error = repr(e)
+		print("dataset load failed:", dataset_error, file=sys.stderr)
+
+if BACKGROUND_LOAD:
+	threading.Thread(target=load_dataset_background, name="dataset-load", daemon=True).start()
+else:
+	load_dataset()
+# 백그라운드 로딩이면 샘플 수를 모르므로 auto 는 서버 계산
+CLIENTSIDE_FILTERING = CLIENTSIDE == "1" or (CLIENTSIDE == "auto" and not BACKGROUND_LOAD and len(covid) <= CLIENTSIDE_MAX_ROWS)
 #print(covid[covid['sample'] == "30970543"])
-covid = covid.sort_values('totalreads').drop_duplicates('sample', keep='last')
-covid_groupby_clade = groupby_clade(covid)
-covid_qcgood_groupby_clade = groupby_clade(QC_table(covid, "good"))
-etc_list = ['20C', '20I (Alpha, V1)', '21C (Epsilon)', '21I (Delta)', '21K (Omicron)', '22A (Omicron)', '22C (Omicron)', 'recombinant']
 """
 covid_2022 = covid_table(input_file_list("/denovo/workspace.bsy/work/SEQUEL/COVID/final_report/SARS-CoV-Dashboard/input_report_files/2022/"))
 covid_2023 = covid_table(input_file_list("/denovo/workspace.bsy/work/SEQUEL/COVID/final_report/SARS-CoV-Dashboard/input_report_files/2023/"))
@@ -111,12 +272,28 @@ covid_qcgood_groupby_clade = groupby_clade(covid_qcgood)
 etc_list = ['20C', '20I (Alpha, V1)', '21C (Epsilon)', '21I (Delta)', '21K (Omicron)', '22A (Omicron)', '22C (Omicron)', 'recombinant']
 """
 
+def filter_options():
+	# 필터 옵션 (year, QC, clade) 과 batch 범위. 데이터를 다 읽기 전이면 'All' 과 빈 범위
+	if not dataset_ready.is_set():
+		return ['All'], ['All'], ['All'], 0, 0
+	# year 는 partition 순 (FilterEngine.partitions)
+	return (['All'] + [p['name'] for p in filter_engine.partitions],
+			list(np.append(['All'], sorted(covid['QC'].unique()))),
+			list(np.append(['All'], sorted(covid_groupby_clade['clade'].unique()))),
+			covid_groupby_clade['batch'].min(), covid_groupby_clade['batch'].max())
+
+# 레이아웃을 만들 때의 데이터 상태 (버전을 옵션보다 먼저 읽어서, 그 사이에 로딩이 끝나도 ready-poll 이 다시 채움)
+LAYOUT_READY = dataset_ready.is_set()
+LAYOUT_VERSION = dataset.version if LAYOUT_READY else 0
+YEAR_OPTIONS, QC_OPTIONS, CLADE_OPTIONS, BATCH_MIN, BATCH_MAX = filter_options()
+TABLE_COLUMNS = list(COVID_SCHEMA) + ['year']
+
 # ===== YEAR FILTER ===== #
 year_filter_card = dbc.Card(
 	dbc.CardBody([
 		html.H4(children='Year Select'),
 		dbc.RadioItems(
-			np.append(['All'], sorted(covid['year'].unique())),
+			YEAR_OPTIONS,
 			'All',
 			id='filter-year',
 		)
@@ -128,7 +305,7 @@ qc_filter_card = dbc.Card(
 	dbc.CardBody([
 		html.H4(children='QC filter'),
 		dbc.Checklist(
-			np.append(['All'], sorted(covid['QC'].unique())),
+			QC_OPTIONS,
 			['All'],
 			id='filter-qc',
 		)
@@ -152,7 +329,7 @@ clade_filter_card = dbc.Card(
 	dbc.CardBody([
 		html.H4(children='Clade Check'),
 		dbc.Checklist(
-			np.append(['All'], sorted(covid_groupby_clade['clade'].unique())),
+			CLADE_OPTIONS,
 			['All'],
 			id='check-clade'
 		)
@@ -164,12 +341,12 @@ batch_range_card = dbc.Card(
 	dbc.CardBody([
 		html.H4(children='Batch Range'),
 		dcc.RangeSlider(
-			covid_groupby_clade['batch'].min(),
-			covid_groupby_clade['batch'].max(),
+			BATCH_MIN,
+			BATCH_MAX,
 			step=1,
-			value=[covid_groupby_clade['batch'].min(),covid_groupby_clade['batch'].max()],
+			value=[BATCH_MIN, BATCH_MAX],
 			allowCross=False,
-			marks={str(batch): str(batch) for batch in range(covid_groupby_clade['batch'].min(), covid_groupby_clade['batch'].max()+1, 30)},
+			marks=batch_marks(BATCH_MIN, BATCH_MAX),
 			tooltip={"placement": "bottom", "always_visible": True},
 			id='batch_slider_value',
 		)
@@ -177,24 +354,40 @@ batch_range_card = dbc.Card(
 )
 
 # ===== CLADE DATATABLE ===== #
-total_clade_count_card = dbc.Card(
-	dbc.CardBody([
-		html.H4(children='Total Clade Count'),
-		dash_table.DataTable(
-			data=clade_count(covid).to_dict('records'),
-			columns=[{'id':c, 'name':c} for c in clade_count(covid).columns],
-			fixed_rows={'headers': True},
-			sort_action="native",
-			sort_mode='multi',
-			editable=True,
-		)
-	]), className="m-2 shadow"
-)
+# 레이아웃에서 빠져 있으므로 (아래 주석) 쓸 때만 만듦
+def total_clade_count_card():
+	counts = clade_count(covid)
+	return dbc.Card(
+		dbc.CardBody([
+			html.H4(children='Total Clade Count'),
+			dash_table.DataTable(
+				data=counts.to_dict('records'),
+				columns=[{'id':c, 'name':c} for c in counts.columns],
+				fixed_rows={'headers': True},
+				sort_action="native",
+				sort_mode='multi',
+				editable=True,
+			)
+		]), className="m-2 shadow"
+	)
 
 # ===== SUNBRUST PLOT ===== #
 sunbrust_card = dbc.Card(
 	dbc.CardBody([
 		html.H4(children='Clade & Pango Sunbrust Plot'),
+		# lineage 보기: 조각을 누르면 그 lineage 로 drill-down, 가운데를 누르면 한 단계 위로
+		dbc.Row([
+			dbc.Col(dbc.RadioItems(
+				options=[{'label': 'Clade', 'value': 'clade'}, {'label': 'Lineage', 'value': 'lineage'}],
+				value=SUNBURST_MODE, id='sunburst-mode', inline=True,
+			), width='auto'),
+			dbc.Col(dcc.Slider(1, 6, 1, value=LINEAGE_DEPTH, id='lineage-depth'), width=5),
+			dbc.Col(dbc.InputGroup([
+				dbc.Input(id='lineage-min-share', type='number', min=0, max=50, step=0.5, value=LINEAGE_MIN_SHARE * 100),
+				dbc.InputGroupText('% etc'),
+			], size='sm'), width=3),
+		], align='center', className="g-1"),
+		dcc.Store(id='lineage-root', data=LINEAGE_ROOT),
 		dcc.Graph(id='sunburst-graph', style={'height': '35vh'})
 	]), className="m-2 shadow"
 )
@@ -204,8 +397,10 @@ datatable_card = dbc.Card(
 	dbc.CardBody([
 		html.H4(children='Data Table'),
 
-		dcc.Download(id="download-full"),
-		dcc.Download(id="download-filtered"),
+		# 다운로드는 서버 /export 경로로 이동 (CSV 스트리밍, Excel 은 백그라운드 작업 후)
+		dcc.Location(id="export-location", refresh=True),
+		dcc.Store(id="export-job"),
+		dcc.Interval(id="export-poll", interval=1000, disabled=True),
 		
 		dbc.Row([
 			dbc.Col(
@@ -227,15 +422,21 @@ datatable_card = dbc.Card(
 				html.Div(dbc.Button("Download Filtered Data", id="btn_filtered", color="success"),), md=4
 			), 
 		], className="m-1", align="center"),
+		html.P(id="export-status", className="m-1"),
 
 		# ===== FILTERED TABLE ===== #
 		dash_table.DataTable(
 			id='filtered-table',
-			columns=[{'id':c, 'name':c} for c in covid.columns],
+			columns=[{'id':c, 'name':c} for c in TABLE_COLUMNS],
 			fixed_rows={'headers': True},
-			sort_action="native",
-			sort_mode='multi',
+			page_action='custom',
+			page_current=0,
 			page_size=20,
+			sort_action='custom',
+			sort_mode='multi',
+			sort_by=[],
+			filter_action='custom',
+			filter_query='',
 			style_table={'overflowX': 'auto'},
 			style_data={'whiteSpace': 'normal', 'height':'auto'}
 		),
@@ -243,10 +444,32 @@ datatable_card = dbc.Card(
 )
 
 
+# ===== SAMPLE SEARCH ===== #
+SAMPLE_RUN_COLUMNS = [('sample', 'sample'), ('year', 'year'), ('batch', 'batch'), ('QC', 'QC'), ('pf', 'P/F'), ('totalreads', 'totalreads'),
+					  ('coverage', 'coverage'), ('clade', 'clade'), ('pango', 'pango'), ('file', 'report'), ('retest', 'retest'), ('selected', 'in dataset')]
+
+sample_search_card = dbc.Card(
+	dbc.CardBody([
+		html.H4(children='Sample Search'),
+		dbc.Input(id='sample-search', type='search', placeholder="Sample ID (at least %d characters)" % SAMPLE_SEARCH_MIN_LENGTH, debounce=True),
+		html.P(id='sample-search-status', className="text-muted m-1"),
+		# 샘플의 모든 run (재실험 레포트 포함), 데이터셋에 쓰인 run 은 굵게
+		dash_table.DataTable(
+			id='sample-runs',
+			columns=[{'id': c, 'name': name} for c, name in SAMPLE_RUN_COLUMNS],
+			page_size=10,
+			style_table={'overflowX': 'auto'},
+			style_data_conditional=[{'if': {'filter_query': '{selected} = "✔"'}, 'fontWeight': 'bold'}],
+		),
+	]), className="m-2 shadow"
+)
+
+
 # ===== PASS or FAIL BAR PLOT ===== #
 pass_barplot = dbc.Card(
 	dbc.CardBody([
 		html.H4(children="Pass/Fail"),
+		html.P(id='pass-summary', className="text-muted mb-0"),
 		dbc.Row([
 			# ===== BATCH X P/F BAR PLOT ===== #
 			html.Div([
@@ -308,6 +531,44 @@ parallel_coordinates_plot = dbc.Card(
 #===============================#
 dbc_css = "https://cdn.jsdelivr.net/gh/AnnMarieW/dash-bootstrap-templates/dbc.min.css"
 app = Dash(__name__, external_stylesheets=[dbc.themes.FLATLY, dbc_css])
+server = app.server
+
+# figure 캐시 hit / miss 확인용
+@server.route('/stats/figure-cache')
+def figure_cache_stats():
+	return figure_cache.stats()
+
+# partition (year 폴더) 별 행 수 / batch 범위 / clade 목록
+@server.route('/stats/partitions')
+def partition_stats():
+	abort_until_ready()
+	return {'partitions': filter_engine.partition_stats()}
+
+# 프로세스가 떠 있으면 /healthz 200, 데이터셋을 다 읽어서 요청을 받을 수 있으면 /readyz 200 (읽는 중 / 실패면 503)
+@server.route('/healthz')
+def healthz():
+	return {'status': 'ok'}
+
+@server.route('/readyz')
+def readyz():
+	if dataset_ready.is_set():
+		return {'ready': True, 'version': dataset.version, 'samples': len(covid)}
+	return {'ready': False, 'error': dataset_error}, 503
+
+# 콜백별 소요시간 / 단계별 시간 / 응답 크기 (Prometheus /metrics)
+def metrics_gauges():
+	cache = figure_cache.stats()
+	return {
+		'covid_dataset_ready': (int(dataset_ready.is_set()), "1 once the dataset is loaded"),
+		'covid_dataset_rows': (len(covid) if dataset_ready.is_set() else 0, "Samples in the current dataset"),
+		'covid_dataset_version': (dataset.version, "Current dataset version"),
+		'covid_figure_cache_bytes': (cache['bytes'], "Serialized figures held in the figure cache"),
+		'covid_figure_cache_hits': (cache['hits'], "Figure cache hits in this worker"),
+		'covid_figure_cache_misses': (cache['misses'], "Figure cache misses in this worker"),
+		'covid_jobs_active': (job_queue.active(), "Background jobs queued or running from this worker"),
+	}
+
+covid_metrics.install(server, metrics_gauges)
 
 # ===== DASH LAYOUT ===== #
 # |이 코드는 DNALINK SARS-CoV-Analysis 대시보드의 레이아웃을 구성하는 부분입니다.
@@ -326,6 +587,18 @@ app.layout = dbc.Container([
 	html.Div([
 		html.H1(children='DNALINK SARS-CoV-Analysis DASH BOARD', className="bg-primary bg-gradient text-white text-center fw-bold p-4 m-2"),
 	]),
+
+	# ===== DATASET VERSION ===== #
+	dcc.Store(id='data-version', data=LAYOUT_VERSION),
+	# 백그라운드 로딩 중에 뜬 레이아웃이면 다 읽을 때까지 1 초마다 확인해서 필터 옵션을 채움
+	dcc.Interval(id='ready-poll', interval=1000, disabled=LAYOUT_READY),
+	dcc.Store(id='client-data'),
+	dcc.Interval(id='data-poll', interval=max(POLL_INTERVAL, 1)*1000, disabled=POLL_INTERVAL <= 0),
+	# 그래프별로 브라우저에 마지막으로 보낸 (데이터 버전, 필터) 키
+	html.Div([dcc.Store(id=graph_id + '-key') for graph_id in ['sunburst-graph', 'groupby_pass_count', 'parallel_coordinates-plot',
+		'groupby_clade_count', 'groupby_clade_percent', 'depth-boxplot', 'reads-boxplot', 'filtered-table']]),
+	# 작업 큐에서 만드는 figure 가 끝날 때까지 1 초마다 확인
+	html.Div([dcc.Interval(id=graph_id + '-job-poll', interval=1000, disabled=True) for graph_id in BACKGROUND_GRAPHS]),
 	
 	html.Div([
 		
@@ -346,7 +619,7 @@ app.layout = dbc.Container([
 						# ===== CLADE FILTER ===== #
 						clade_filter_card,
 						# ===== TOTAL CLADE COUNT TABLE ===== #
-						#total_clade_count_card,
+						#total_clade_count_card(),
 					], width=5),
 					dbc.Col([
 						# ===== Pass/Fail Bar Plot ===== #
@@ -358,6 +631,9 @@ app.layout = dbc.Container([
 				], className="g-1")
 			]),
 
+			# ===== SAMPLE SEARCH ===== #
+			sample_search_card,
+
 			# ===== DATA TABLE ===== #
 			#html.Div([
 			#	datatable_card
@@ -367,11 +643,11 @@ app.layout = dbc.Container([
 		# ===== RIGHT LAYOUT =====
 		html.Div([
 			dbc.Tabs([
-				dbc.Tab(label="Parallel Coordinates Plot", children=[parallel_coordinates_plot]),
-				dbc.Tab(label="Bar Plot", children=[barplot]),
-				dbc.Tab(label="Box Plot", children=[boxplot]),
-				dbc.Tab(label="Data Table", children=[datatable_card]),
-			]), 
+				dbc.Tab(label="Parallel Coordinates Plot", children=[parallel_coordinates_plot], tab_id='tab-parallel'),
+				dbc.Tab(label="Bar Plot", children=[barplot], tab_id='tab-bar'),
+				dbc.Tab(label="Box Plot", children=[boxplot], tab_id='tab-box'),
+				dbc.Tab(label="Data Table", children=[datatable_card], tab_id='tab-table'),
+			], id='plot-tabs', active_tab='tab-parallel'), 
 		], style={'width': '50%', 'padding': 13, 'flex': 1})
 
 	], style={'display': 'flex', 'flex-direction': 'row'})
@@ -385,6 +661,35 @@ app.layout = dbc.Container([
 
 
 
+# ===== FILTER OPTIONS REFRESH CALLBACK ===== #
+# 새 레포트가 반영되어 (또는 백그라운드 로딩이 끝나서) 데이터셋 버전이 바뀌면 필터 옵션과 batch 슬라이더 범위를 갱신
+@app.callback(
+	Output('data-version', 'data'),
+	Output('filter-year', 'options'),
+	Output('filter-qc', 'options'),
+	Output('check-clade', 'options'),
+	Output('batch_slider_value', 'min'),
+	Output('batch_slider_value', 'max'),
+	Output('batch_slider_value', 'marks'),
+	Output('batch_slider_value', 'value'),
+	Output('ready-poll', 'disabled'),
+	Input('data-poll', 'n_intervals'),
+	Input('ready-poll', 'n_intervals'),
+	State('data-version', 'data'),
+	State('batch_slider_value', 'value'),
+	State('batch_slider_value', 'max'))
+def refresh_filters(n_intervals, ready_intervals, version, batch, batch_max):
+	require_dataset()
+	if version == dataset.version:
+		raise PreventUpdate
+
+	years, qcs, clades, batch_min, new_max = filter_options()
+	# 슬라이더가 끝까지 열려 있었으면 새 batch 까지 포함
+	batch = [max(batch[0], batch_min), new_max if batch[1] >= batch_max else min(batch[1], new_max)]
+	return dataset.version, years, qcs, clades, batch_min, new_max, batch_marks(batch_min, new_max), batch, True
+
+
+
 # ===== STACKED BAR PLOT CALLBACK ===== #
 # |이 코드는 Dash 앱에서 사용되는 콜백 함수입니다. 이 함수는 사용자가 선택한 필터링 옵션에 따라 데이터를 처리하고, 그 결과를 두 개의 그래프로 시각화하여 출력합니다.
 # |
@@ -396,39 +701,85 @@ app.layout = dbc.Container([
 # |나쁜 점:
 # |- 함수의 인자가 다소 복잡합니다. 여러 개의 입력값과 리스트 형태의 입력값이 함께 사용되고 있습니다. 이로 인해 함수의 사용 방법이 다소 복잡해질 수 있습니다.
 # |- 함수 내에서 주석이 부족합니다. 함수의 역할과 각각의 처리 과정에 대한 설명이 부족하므로, 코드를 이해하는 데 어려움이 있을 수 있습니다.
-@app.callback(
-	Output('groupby_clade_count', 'figure'),
-	Output('groupby_clade_percent', 'figure'),
-	#Output('indicator', 'figure'),
-	Input('filter-year', 'value'),
-	[Input('check-clade', 'value')],
-	Input('filter-cov', 'value'),
-	Input('filter-qc', 'value'),
-	[Input('batch_slider_value', 'value')])
-def clade_graph(year, clade, cov, qc, batch):
-	# year filter
-	if year == 'All':
-		df_year = covid
-	else:
-		df_year = covid[covid['year'] == year]
-
-	# coverage filter
-	if cov == '>=90%':
-		df_cov = df_year[df_year['coverage'] >= 0.9]
-	elif cov == '<90%':
-		df_cov = df_year[df_year['coverage'] < 0.9]
-	elif cov == 'All':
-		df_cov = df_year
-
-	# qc filter
-	#if qc == 'All':
-	if 'All' in qc:
-		df_qc = groupby_clade(df_cov)
-	else:
-		df_qc = groupby_clade(df_cov[df_cov['QC'].isin(qc)])
-
-	# batch & clade filter
-	dfp = df_qc[(df_qc['batch'] >= batch[0]) & (df_qc['batch'] <= batch[1])]
+def lazy_figure(graph_id, tab_id, build, use_clade=True, view=None, extra=(), background=None):
+	# graph_id 의 figure 를 따로 계산하는 콜백 등록
+	# tab_id 탭이 보일 때만 계산하고 (안 보이면 탭을 열 때까지 미룸), 브라우저에 이미 같은 필터 + 데이터 버전의
+	# figure 가 있으면 다시 만들거나 보내지 않음 (<graph_id>-key 에 마지막으로 보낸 키 저장)
+	# view(fig, traces, year, clade, cov, qc, batch) 가 있으면 figure 는 전체 batch 범위로 만들고,
+	# batch 범위 (use_clade=False 면 clade 선택도) 는 view 가 축 범위 / trace visible 로 반영.
+	# 이미 보낸 figure 에서 그 값만 바뀌면 전체 figure 대신 dash.Patch 만 보냄
+	# extra: 필터 외의 추가 Input (값은 build 에 필터 다음 인자로 전달, 캐시 키에 포함)
+	# background(year, clade, cov, qc, batch) 가 (fn, args) 를 주면 작업 큐에서 만듦 (background_figure, BACKGROUND_GRAPHS)
+	poll = [Output(graph_id + '-job-poll', 'disabled'), Input(graph_id + '-job-poll', 'n_intervals')] if background else []
+	@app.callback(
+		Output(graph_id, 'figure'),
+		Output(graph_id + '-key', 'data'),
+		*poll[:1],
+		Input('filter-year', 'value'),
+		[Input('check-clade', 'value')],
+		Input('filter-cov', 'value'),
+		Input('filter-qc', 'value'),
+		[Input('batch_slider_value', 'value')],
+		Input('plot-tabs', 'active_tab'),
+		Input('data-version', 'data'),
+		*extra,
+		*poll[1:],
+		State(graph_id + '-key', 'data'))
+	def update(year, clade, cov, qc, batch, active_tab, version, *args):
+		extra_values, rendered = args[:len(extra)], args[-1]
+		require_dataset()
+		if tab_id is not None and active_tab != tab_id:
+			raise PreventUpdate
+		# percent 그래프 등 clade 필터와 상관없는 figure 는 clade 없이 캐시
+		build_clade = clade if use_clade else ['All']
+		if background is not None:
+			return background_figure(graph_id, build, background, year, build_clade, cov, qc, batch, extra_values, rendered)
+		if view is None:
+			key = json.loads(json.dumps([dataset.version, normalize_filter(year, build_clade, cov, qc, batch)] + list(extra_values)))
+			if key == rendered:
+				raise PreventUpdate
+			return cached_figure(graph_id, build, year, build_clade, cov, qc, batch, extra_values), key
+
+		build_batch = full_batch_range()
+		key = json.loads(json.dumps({'figure': [dataset.version, normalize_filter(year, build_clade, cov, qc, build_batch)] + list(extra_values),
+									 'view': normalize_filter(year, clade, cov, qc, batch)}))
+		if rendered and rendered['figure'] == key['figure']:
+			if rendered['view'] == key['view']:
+				raise PreventUpdate
+			fig = Patch()
+			traces = rendered['traces']
+		else:
+			fig = cached_figure(graph_id, build, year, build_clade, cov, qc, build_batch, extra_values)
+			traces = [trace.get('name') for trace in fig['data']]
+		view(fig, traces, year, clade, cov, qc, batch)
+		key['traces'] = traces
+		return fig, key
+	return update
+
+def full_batch_range():
+	batches = count_cube.batches
+	return [int(batches.min()), int(batches.max())] if len(batches) else [0, 0]
+
+def set_figure(fig, path, value):
+	# fig (figure dict 또는 dash.Patch) 의 path 위치에 value 설정
+	for name in path[:-1]:
+		fig = fig.setdefault(name, {}) if isinstance(fig, dict) else fig[name]
+	fig[path[-1]] = value
+
+def batch_view(fig, batch, y_max=None):
+	# x 축을 batch 범위로, y 축을 그 범위의 최대 막대 높이로
+	set_figure(fig, ('layout', 'xaxis', 'range'), [batch[0] - 0.5, batch[1] + 0.5])
+	if y_max is not None:
+		set_figure(fig, ('layout', 'yaxis', 'range'), [0, (y_max or 1) * 1.05])
+
+def stacked_max(df, value):
+	return float(df.groupby('batch')[value].sum().max()) if len(df) else 0
+
+def clade_count_figure(year, clade, cov, qc, batch):
+	# batch x clade 집계는 count cube 에서 잘라서 가져옴
+	dfp = count_cube.clade_counts(year, clade, cov, qc, batch)
+
+	# clade filter
 	if 'All' in clade:
 		dfc = dfp
 	else:
@@ -437,139 +788,430 @@ def clade_graph(year, clade, cov, qc, batch):
 	#fig_indi = go.Figure(go.Indicator(mode="delta", value=dfc[(dfc['batch'] == batch[1]) & (dfc['clade'] == "22B (Omicron)")]['count'].values[0], delta={"reference": dfc[(dfc['batch'] == batch[0]) & (dfc['clade'] == "22B (Omicron)")]['count'].values[0], "relative": True}))
 
 	# make plot	
-	fig_count = px.bar(dfc, x='batch', y='count', color='clade', title='Clade Count BarPlot', color_discrete_map={'22B': 'gray', 'etc': 'yellow'})
-	fig_percent = px.bar(dfp, x='batch', y='percent', color='clade', title='Clade Percent BarPlot', color_discrete_map={'22B': 'gray', 'etc': 'yellow'})
-	return fig_count, fig_percent
-
-
+	return px.bar(dfc, x='batch', y='count', color='clade', title='Clade Count BarPlot', color_discrete_map={'22B': 'gray', 'etc': 'yellow'})
+
+def clade_percent_figure(year, clade, cov, qc, batch):
+	dfp = count_cube.clade_counts(year, clade, cov, qc, batch)
+	return px.bar(dfp, x='batch', y='percent', color='clade', title='Clade Percent BarPlot', color_discrete_map={'22B': 'gray', 'etc': 'yellow'})
+
+def clade_count_view(fig, traces, year, clade, cov, qc, batch):
+	# 선택하지 않은 clade 의 trace 는 숨김
+	dfp = count_cube.clade_counts(year, ['All'], cov, qc, batch)
+	if 'All' not in clade:
+		dfp = dfp[dfp['clade'].isin(clade)]
+	for i, name in enumerate(traces):
+		set_figure(fig, ('data', i, 'visible'), 'All' in clade or name in clade)
+	batch_view(fig, batch, stacked_max(dfp, 'count'))
+
+def clade_percent_view(fig, traces, year, clade, cov, qc, batch):
+	batch_view(fig, batch)
+
+
+
+# ===== PASS/FAIL SUMMARY CALLBACK ===== #
+# batch 범위 합계는 count cube 누적합으로 구하므로 슬라이더를 움직여도 batch 수와 상관없이 일정
+def pass_summary(year, clade, cov, qc, batch, version=None):
+	require_dataset()
+	summary = count_cube.summary(year, clade, cov, qc, batch)
+	return "{:,} samples · Pass {:,} ({:.1%}) · Fail {:,}".format(summary['samples'], summary['pass'], summary['pass_rate'], summary['fail'])
+
+
+
+# ===== BOX PLOT & SUNBRUST PLOT ===== #
+def box_figure(column, title, year, clade, cov, qc, batch):
+	# year -> coverage -> qc -> batch -> clade filter ('etc' 는 clade_etc_map 의 clade 전체)
+	# 샘플 값 대신 batch 별 box 통계만 보냄 (outlier 는 batch 마다 BOX_MAX_OUTLIERS 개까지)
+	dff = filter_engine.filter(year, clade, cov, qc, batch)
+	values = dff[column].to_numpy(dtype=float, na_value=np.nan)
+	stats, out_batch, out_values = box_stats(dff['batch'].values, values, BOX_MAX_OUTLIERS)
+	fig = go.Figure([
+		go.Box(x=stats['batch'], q1=stats['q1'], median=stats['median'], q3=stats['q3'],
+			   lowerfence=stats['lowerfence'], upperfence=stats['upperfence'], name=column,
+			   marker_color=px.colors.qualitative.Plotly[0], showlegend=False),
+		go.Scatter(x=out_batch, y=out_values, mode='markers', name='outlier',
+				   marker=dict(color=px.colors.qualitative.Plotly[0], size=4), showlegend=False),
+	])
+	fig.update_layout(title=title, xaxis_title='batch', yaxis_title=column)
+	return fig
+
+def depth_box_figure(year, clade, cov, qc, batch):
+	return box_figure('depth', 'Depth BoxPlot', year, clade, cov, qc, batch)
+
+def reads_box_figure(year, clade, cov, qc, batch):
+	return box_figure('totalreads', 'Total Reads BoxPlot', year, clade, cov, qc, batch)
+
+def sunburst_figure(year, clade, cov, qc, batch, mode='clade', root=LINEAGE_ROOT, depth=LINEAGE_DEPTH, min_share=LINEAGE_MIN_SHARE * 100):
+	if mode == 'lineage':
+		return lineage_figure(year, clade, cov, qc, batch, root, depth, min_share)
+	# sunbrust-data-parsing (count cube)
+	dff_sun = count_cube.sunburst(year, clade, cov, qc, batch)
+	return px.sunburst(dff_sun, path=['clade', 'pango'], values='count', color='clade')
+
+def lineage_figure(year, clade, cov, qc, batch, root, depth, min_share):
+	# pango 계층 sunburst: root 아래 depth 단계, root 샘플의 min_share(%) 보다 적은 lineage 는 부모별 etc 로
+	# subtree 샘플 수는 lineage_index 에 필터별로 캐시되어 있어서 drill-down / depth 변경은 트리 조회만 함
+	dfl = lineage_index.sunburst(year, clade, cov, qc, batch, root, depth or 1, (min_share or 0) / 100)
+	fig = go.Figure(go.Sunburst(ids=dfl['id'], labels=dfl['label'], parents=dfl['parent'], values=dfl['value'],
+								branchvalues='total', hovertemplate='%{id}<br>%{value:,} samples (%{percentRoot:.1%})<extra></extra>'))
+	fig.update_layout(margin=dict(t=10, b=10, l=10, r=10))
+	return fig
+
+def parallel_columns(year, clade, cov, qc, batch):
+	# parallel coordinates plot 에 쓰는 열만 (clade 는 etc 묶음). 작업 큐로 넘길 때도 이 열만 pickle
+	dff = filter_engine.filter(year, clade, cov, qc, batch)
+	dff = dff[['batch', 'totalreads', 'coverage', 'depth', 'QC', 'clade', 'P/F']]
+	return dff.replace({'clade' : clade_etc_map})
+
+def parallel_figure(year, clade, cov, qc, batch):
+	return parallel_coordinates_figure(parallel_columns(year, clade, cov, qc, batch), PARCOORDS_MAX_ROWS)
+
+def parallel_job(year, clade, cov, qc, batch):
+	# 필터된 샘플이 BACKGROUND_MIN_ROWS 개 이상이면 작업 큐에서 만듦 (적으면 None: 요청 안에서 바로)
+	if len(filter_engine.rows(year, clade, cov, qc, batch)) < BACKGROUND_MIN_ROWS:
+		return None
+	return figure_job, (parallel_coordinates_figure, parallel_columns(year, clade, cov, qc, batch), PARCOORDS_MAX_ROWS)
+
+def pass_figure(year, clade, cov, qc, batch):
+	dfpf = count_cube.passfail(year, clade, cov, qc, batch)
+	return px.bar(dfpf, x='batch', y='count', color='P/F', color_discrete_map={'Pass': 'green', 'Fail': 'red'})
+
+def pass_view(fig, traces, year, clade, cov, qc, batch):
+	batch_view(fig, batch, stacked_max(count_cube.passfail(year, clade, cov, qc, batch), 'count'))
+
+# 왼쪽 (항상 보임)
+sunburst_graph = lazy_figure('sunburst-graph', None, sunburst_figure,
+							 extra=[Input('sunburst-mode', 'value'), Input('lineage-root', 'data'), Input('lineage-depth', 'value'), Input('lineage-min-share', 'value')])
+
+# lineage sunburst drill-down / drill-up (다른 보기로 바꾸면 처음부터)
+@app.callback(
+	Output('lineage-root', 'data'),
+	Input('sunburst-graph', 'clickData'),
+	Input('sunburst-mode', 'value'),
+	State('lineage-root', 'data'),
+	prevent_initial_call=True)
+def drill_lineage(click, mode, root):
+	require_dataset()
+	if callback_context.triggered[0]['prop_id'] == 'sunburst-mode.value':
+		return LINEAGE_ROOT
+	node = (click or {}).get('points', [{}])[0].get('id')
+	if mode != 'lineage' or node is None or node.endswith(' etc'):
+		raise PreventUpdate
+	return lineage_index.parent(root) if node == root else node
+# 오른쪽 탭
+parallel_graph = lazy_figure('parallel_coordinates-plot', 'tab-parallel', parallel_figure, background=parallel_job)
+depth_box_graph = lazy_figure('depth-boxplot', 'tab-box', depth_box_figure)
+reads_box_graph = lazy_figure('reads-boxplot', 'tab-box', reads_box_figure)
+
+FILTER_INPUTS = [
+	Input('filter-year', 'value'),
+	Input('check-clade', 'value'),
+	Input('filter-cov', 'value'),
+	Input('filter-qc', 'value'),
+	Input('batch_slider_value', 'value'),
+]
+
+if CLIENTSIDE_FILTERING:
+	# 막대그래프 / pass 요약은 assets/covid_clientside.js 에서 계산. 서버는 데이터 버전이 바뀔 때만 데이터를 보냄
+	@app.callback(
+		Output('client-data', 'data'),
+		Input('data-version', 'data'),
+		State('client-data', 'data'))
+	def client_data(version, data):
+		require_dataset()
+		if data and data['version'] == dataset.version:
+			raise PreventUpdate
+		with stage('serialize'):
+			return client_payload()
+
+	for output, function in [(Output('groupby_pass_count', 'figure'), 'pass_count'), (Output('groupby_clade_count', 'figure'), 'clade_count'),
+							 (Output('groupby_clade_percent', 'figure'), 'clade_percent'), (Output('pass-summary', 'children'), 'pass_summary')]:
+		app.clientside_callback(ClientsideFunction('covid', function), output, *FILTER_INPUTS, Input('client-data', 'data'))
+else:
+	pass_graph = lazy_figure('groupby_pass_count', None, pass_figure, view=pass_view)
+	clade_count_graph = lazy_figure('groupby_clade_count', 'tab-bar', clade_count_figure, use_clade=False, view=clade_count_view)
+	clade_percent_graph = lazy_figure('groupby_clade_percent', 'tab-bar', clade_percent_figure, use_clade=False, view=clade_percent_view)
+	app.callback(Output('pass-summary', 'children'), *FILTER_INPUTS, Input('data-version', 'data'))(pass_summary)
+
+
+
+# ===== DATATABLE CALLBACK ===== #
+# 페이지/정렬/필터를 서버에서 처리해서 보이는 페이지(20행)만 브라우저로 보냄
+TABLE_FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+
+def split_filter_part(filter_part):
+	# DataTable filter_query 한 조건 ("{col} op value") 을 (col, op, value) 로 분리
+	# value 는 따옴표만 벗긴 문자열 (숫자 변환은 열 타입을 아는 query_rows 에서)
+	for operator_type in TABLE_FILTER_OPERATORS:
+		for operator in operator_type:
+			if operator in filter_part:
+				name_part, value_part = filter_part.split(operator, 1)
+				name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+				value_part = value_part.strip()
+				v0 = value_part[0] if value_part else ''
+				if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+					value = value_part[1: -1].replace('\\' + v0, v0)
+				else:
+					value = value_part
+
+				# word operators need spaces after them in the filter string,
+				# but we don't want these later
+				return name, operator_type[0].strip(), value
+
+	return [None] * 3
+
+def query_rows(df, filter_query):
+	# filter_query 를 만족하는 df 의 행 위치
+	mask = np.ones(len(df), dtype=bool)
+	for filter_part in (filter_query or '').split(' && '):
+		col_name, operator, filter_value = split_filter_part(filter_part)
+		if col_name not in df.columns:
+			continue
+		col = df[col_name]
+		if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+			# 숫자 열만 숫자로 비교 (sample 같은 문자열 / category 열은 입력한 문자열 그대로)
+			try:
+				if not pd.api.types.is_numeric_dtype(col):
+					raise ValueError(filter_value)
+				cond = getattr(col, operator)(float(filter_value))
+			except ValueError:
+				cond = getattr(col.astype(str), operator)(filter_value)
+		elif operator == 'contains':
+			cond = col.astype(str).str.contains(filter_value, regex=False)
+		elif operator == 'datestartswith':
+			cond = col.astype(str).str.startswith(filter_value)
+		else:
+			continue
+		mask &= cond.fillna(False).to_numpy(dtype=bool)
+	return np.flatnonzero(mask)
+
+def table_rows(year, clade, cov, qc, batch, sort_by, filter_query):
+	# 필터 엔진 결과에 DataTable filter_query / sort_by 를 적용한 행 위치 (filter_engine.frame 기준)
+	engine = filter_engine
+	rows = engine.rows(year, clade, cov, qc, batch)
+	if filter_query:
+		rows = rows[query_rows(engine.frame.iloc[rows], filter_query)]
+	return engine, engine.sort_rows(rows, sort_by)
 
-# ===== BOX PLOT & SUNBRUST PLOT CALLBACK ===== #
 @app.callback(
-	Output('depth-boxplot', 'figure'),
-	Output('reads-boxplot', 'figure'),
 	Output('filtered-table', 'data'),
-	Output("sunburst-graph", "figure"),
-	Output("parallel_coordinates-plot", "figure"),
-	Output("groupby_pass_count", "figure"),
+	Output('filtered-table', 'page_count'),
+	Output('filtered-table-key', 'data'),
+	Input('filtered-table', 'page_current'),
+	Input('filtered-table', 'page_size'),
+	Input('filtered-table', 'sort_by'),
+	Input('filtered-table', 'filter_query'),
 	Input('filter-year', 'value'),
 	[Input('check-clade', 'value')],
 	Input('filter-cov', 'value'),
 	Input('filter-qc', 'value'),
-	[Input('batch_slider_value', 'value')])
-def boxplot(year, clade, cov, qc, batch):
-	# year filter
-	if year == 'All':
-		df_year = covid
-	else:
-		df_year = covid[covid['year'] == year]
-
-	# coverage filter
-	if cov == '>=90%':
-		df_cov = df_year[df_year['coverage'] >= 0.9]
-	elif cov == '<90%':
-		df_cov = df_year[df_year['coverage'] < 0.9]
-	elif cov == 'All':
-		df_cov = df_year
-
-	# qc filter
-	#if qc == 'All':
-	if 'All' in qc: 
-		df_qc = df_cov
-	else:
-		df_qc = df_cov[df_cov['QC'].isin(qc)]
-
-	# clade
-	if 'All' in clade:
-		dff = df_qc[(df_qc['batch'] >= batch[0]) & (df_qc['batch'] <= batch[1])]
-	elif 'etc' in clade:
-		dff = df_qc[(df_qc['batch'] >= batch[0]) & (df_qc['batch'] <= batch[1]) & (df_qc['clade'].isin(clade + etc_list))]
-	else:
-		dff = df_qc[(df_qc['batch'] >= batch[0]) & (df_qc['batch'] <= batch[1]) & (df_qc['clade'].isin(clade))]
-
-	# sunbrust-data-parsing
-	dff_sun = dff.groupby(['clade', 'pango'])['sample'].count().to_frame()
-	dff_sun.reset_index(inplace=True)
-	dff_sun.columns = 'clade', 'pango', 'count'
-	
-
-	# parallel-coordinates plot
-	dff = dff.replace({'clade' : {'20C':'etc', '20I (Alpha, V1)':'etc', '21C (Epsilon)':'etc', '21I (Delta)':'etc',
-								'21K':'etc', '22A':'etc', '22C':'etc', 'recombinant':'etc', '20A':'etc', '19A':'etc', '23A':'etc'}})
-	dff_parallel = dff[['batch', 'totalreads', 'coverage', 'depth']]
-	dff_parallel.insert(0, 'QC', dff['QC'].map({j: i for i,j in enumerate(sorted(dff['QC'].unique()))}))
-	dff_parallel.insert(4, 'clade', dff['clade'].map({j: i for i,j in enumerate(sorted(dff['clade'].unique()))}))
-	dff_parallel.insert(0, 'P/F', dff['P/F'].map({j: i for i,j in enumerate(sorted(dff['P/F'].unique()))}))
-	
+	[Input('batch_slider_value', 'value')],
+	Input('plot-tabs', 'active_tab'),
+	Input('data-version', 'data'),
+	State('filtered-table-key', 'data'))
+def update_table(page_current, page_size, sort_by, filter_query, year, clade, cov, qc, batch, active_tab='tab-table', version=None, rendered=None):
+	# Data Table 탭이 보일 때만 계산 (lazy_figure 와 같은 방식)
+	require_dataset()
+	if active_tab != 'tab-table':
+		raise PreventUpdate
+	key = json.loads(json.dumps([dataset.version, normalize_filter(year, clade, cov, qc, batch), page_current, page_size, sort_by, filter_query]))
+	if key == rendered:
+		raise PreventUpdate
+	engine, rows = table_rows(year, clade, cov, qc, batch, sort_by, filter_query)
+	page_count = max(1, -(-len(rows) // page_size))
+	page_current = min(page_current or 0, page_count - 1)
+	with stage('serialize'):
+		page = engine.frame.iloc[rows[page_current*page_size:(page_current+1)*page_size]].to_dict('records')
+	return page, page_count, key
+
+
+
+# ===== DATATABLE DOWNLOAD ===== #
+# CSV 는 /export 경로에서 스트리밍, Excel 은 작업 큐에서 파일을 만든 뒤 /export/jobs 에서 받음
+
+def export_filters(year, clade, cov, qc, batch, sort_by, filter_query):
+	return {'year': year, 'clade': clade, 'cov': cov, 'qc': qc, 'batch': batch, 'sort_by': sort_by or [], 'filter_query': filter_query or ''}
+
+# /export/filtered.csv 의 q (export_filters 의 JSON) 키와 타입. year ~ batch 는 꼭 있어야 함
+EXPORT_FILTER_KEYS = {'year': str, 'clade': list, 'cov': str, 'qc': list, 'batch': list, 'sort_by': list, 'filter_query': str}
+EXPORT_FILTER_REQUIRED = ['year', 'clade', 'cov', 'qc', 'batch']
+
+def parse_export_filters(text):
+	# q 를 table_rows() 인자로. 형식이 틀리면 ValueError (메시지를 400 응답으로 보냄)
+	try:
+		filters = json.loads(text)
+	except ValueError:
+		raise ValueError("q is not valid JSON")
+	if not isinstance(filters, dict):
+		raise ValueError("q must be a JSON object")
+	unknown = sorted(set(filters) - set(EXPORT_FILTER_KEYS))
+	if unknown:
+		raise ValueError("unknown filter key(s): %s" % ", ".join(unknown))
+	missing = [key for key in EXPORT_FILTER_REQUIRED if key not in filters]
+	if missing:
+		raise ValueError("missing filter key(s): %s" % ", ".join(missing))
+	for key, value in filters.items():
+		# 체크리스트 / sort_by / filter_query 는 비어 있으면 Dash 가 None 으로 보냄
+		if value is None and key not in ('year', 'cov', 'batch'):
+			continue
+		if not isinstance(value, EXPORT_FILTER_KEYS[key]):
+			raise ValueError("%s must be a %s" % (key, 'list' if EXPORT_FILTER_KEYS[key] is list else 'string'))
+	for key in ('clade', 'qc'):
+		if not all(isinstance(v, str) for v in filters[key] or []):
+			raise ValueError("%s must be a list of strings" % key)
+	if len(filters['batch']) != 2 or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in filters['batch']):
+		raise ValueError("batch must be [min, max]")
+	for sort in filters.get('sort_by') or []:
+		if not isinstance(sort, dict) or sort.get('column_id') not in TABLE_COLUMNS or sort.get('direction') not in ('asc', 'desc'):
+			raise ValueError('sort_by entries must be {"column_id": <table column>, "direction": "asc" | "desc"}')
+	return export_filters(**{key: filters.get(key) for key in EXPORT_FILTER_KEYS})
+
+def attachment(name):
+	return {'Content-Disposition': 'attachment; filename="%s"' % name}
+
+def abort_until_ready():
+	if not dataset_ready.is_set():
+		flask.abort(503)
+
+@server.route('/export/full.csv')
+def export_full_csv():
+	# 데이터셋 버전별로 한 번 만들어 둔 파일을 그대로 보냄
+	abort_until_ready()
+	path = full_csv(covid, dataset.fingerprint)
+	return flask.send_file(path, mimetype='text/csv', as_attachment=True, download_name="SARS-COVID.Full.csv")
+
+@server.route('/export/filtered.csv')
+def export_filtered_csv():
+	abort_until_ready()
+	try:
+		filters = parse_export_filters(flask.request.args.get('q', '{}'))
+	except ValueError as e:
+		flask.abort(400, description=str(e))
+	engine, rows = table_rows(**filters)
+	return flask.Response(csv_chunks(engine.frame, rows), mimetype='text/csv', headers=attachment("SARS-COVID.Filtered.csv"))
+
+@server.route('/export/jobs/<job_id>.xlsx')
+def export_job(job_id):
+	if job_queue.status(job_id, '.xlsx')['state'] != 'done':
+		flask.abort(404)
+	name = flask.request.args.get('name', "SARS-COVID.xlsx")
+	return flask.send_file(job_queue.path(job_id, '.xlsx'), as_attachment=True, download_name=name)
 
-
-	# make figure
-	fig_depth = px.box(dff, x='batch', y='depth', title='Depth BoxPlot')
-	fig_reads = px.box(dff, x='batch', y='totalreads', title='Total Reads BoxPlot')
-	fig_sun = px.sunburst(dff_sun, path=['clade', 'pango'], values='count', color='clade')
-	#fig_parallel = px.parallel_coordinates(dff_parallel, color='batch', color_continuous_scale=px.colors.sequential.Viridis,
-	#									   dimensions=['P/F', 'QC', 'totalreads', 'coverage', 'depth', 'clade'])
-
-	fig_parallel = go.Figure(data=
-		go.Parcoords(
-			line = dict(color=dff_parallel['batch'], colorscale='matter', showscale=True),
-			dimensions = list([
-				dict(label='Total Reads', range=[dff_parallel['totalreads'].min(), dff_parallel['totalreads'].max()],
-					 values=dff_parallel['totalreads']),
-				dict(label='Pass/Fail', range=[-1,2], tickvals=[i for i,j in enumerate(sorted(dff['P/F'].unique()))],
-					 ticktext=[j for i,j in enumerate(sorted(dff['P/F'].unique()))], values=dff_parallel['P/F']),
-				dict(label='Coverage', range=[0, 1],
-					 values=dff_parallel['coverage']),
-				dict(label='QC', range=[-1,4], 
-					 tickvals=[i for i,j in enumerate(sorted(dff['QC'].unique()))],
-					 ticktext=[j for i,j in enumerate(sorted(dff['QC'].unique()))], values=dff_parallel['QC']),
-				dict(label='Depth', range=[dff_parallel['depth'].min(), dff_parallel['depth'].max()],
-					 values=dff_parallel['depth']),
-				dict(label='Clade', range=[dff_parallel['clade'].min(), dff_parallel['clade'].max()], 
-					 tickvals=[i for i,j in enumerate(sorted(dff['clade'].unique()))],
-					 ticktext=[j for i,j in enumerate(sorted(dff['clade'].unique()))], values=dff_parallel['clade']),
-			])
-		)
-	)
-
-	dfpf = dff.groupby(['batch','P/F'], sort=False)['P/F'].count().unstack(fill_value=0).stack().to_frame()
-	dfpf.reset_index(inplace=True)
-	dfpf.columns = 'batch', 'P/F', 'count'
-	fig_pass = px.bar(dfpf, x='batch', y='count', color='P/F', color_discrete_map={'Pass': 'green', 'Fail': 'red'})
-
-	return fig_depth, fig_reads, dff.to_dict('records'), fig_sun, fig_parallel, fig_pass
-
-
-
-# ===== FULL DATATABLE DOWNLOAD BTN ===== #
 @app.callback(
-	Output("download-full", "data"),
+	Output("export-location", "href"),
+	Output("export-job", "data"),
+	Output("export-poll", "disabled"),
+	Output("export-status", "children"),
 	Input("btn_full", "n_clicks"),
+	Input("btn_filtered", "n_clicks"),
+	Input("export-poll", "n_intervals"),
 	State("download-filtered-dropdown", "value"),
+	State('filter-year', 'value'),
+	State('check-clade', 'value'),
+	State('filter-cov', 'value'),
+	State('filter-qc', 'value'),
+	State('batch_slider_value', 'value'),
+	State('filtered-table', 'sort_by'),
+	State('filtered-table', 'filter_query'),
+	State("export-job", "data"),
 	prevent_initial_call=True,
 )
-def func(n_clicks_btn, download_type):
+def export_data(n_full, n_filtered, n_intervals, download_type, year, clade, cov, qc, batch, sort_by, filter_query, job):
+	require_dataset()
+	trigger = callback_context.triggered[0]['prop_id'].split('.')[0]
+
+	# Excel 작업 진행 확인
+	if trigger == "export-poll":
+		if not job:
+			return no_update, None, True, ""
+		status = job_queue.status(job['id'], '.xlsx')
+		if status['state'] in ('queued', 'running'):
+			return no_update, no_update, no_update, "Preparing Excel file... " + progress_text(status)
+		if status['state'] != 'done':
+			return no_update, None, True, "Excel export %s." % ('cancelled' if status['state'] == 'cancelled' else 'failed')
+		return "/export/jobs/%s.xlsx?name=%s" % (job['id'], job['name']), None, True, ""
+
+	# 기다리던 Excel 작업은 새 다운로드로 바뀌면 취소
+	previous = job['id'] if job else None
+	full = trigger == "btn_full"
+	filters = export_filters(year, clade, cov, qc, batch, sort_by, filter_query)
 	if download_type == "csv":
-		return dcc.send_data_frame(covid.to_csv, "SARS-COVID.Full.csv")
+		if previous:
+			job_queue.cancel(previous)
+		if full:
+			return "/export/full.csv?v=%s" % dataset.fingerprint, None, True, ""
+		# n_clicks 를 붙여서 같은 조건으로 다시 눌러도 다운로드되게 함
+		return "/export/filtered.csv?" + urlencode({'q': json.dumps(filters), 'n': n_filtered}), None, True, ""
+
+	if full:
+		name = "SARS-COVID.Full.xlsx"
+		job_id = job_queue.submit(['excel', 'full', dataset.fingerprint], '.xlsx', excel_job, (covid,), replaces=previous)
 	else:
-		return dcc.send_data_frame(covid.to_excel, "SARS-COVID.Full.xlsx")
+		name = "SARS-COVID.Filtered.xlsx"
+		engine, rows = table_rows(**filters)
+		job_id = job_queue.submit(['excel', 'filtered', dataset.fingerprint, filters], '.xlsx', excel_job, (engine.frame.iloc[rows],), replaces=previous)
+	return no_update, {'id': job_id, 'name': name}, False, "Preparing Excel file..."
 
 
-# ===== FILTERED DATATABLE DOWNLOAD BTN ===== #
-@app.callback(
-	Output("download-filtered", "data"),
-	Input("btn_filtered", "n_clicks"),
-	State("filtered-table", "derived_virtual_data"),
-	State("download-filtered-dropdown", "value"),
-	prevent_initial_call=True,
-)
-def func(n_clicks_btn, df, download_type):
-	filtered_df = pd.DataFrame(df)
-	if download_type == "csv":
-		return dcc.send_data_frame(filtered_df.to_csv, "SARS-COVID.Filtered.csv")
-	else:
-		return dcc.send_data_frame(filtered_df.to_excel, "SARS-COVID.Filtered.xlsx")
 
+# ===== SAMPLE STORE ===== #
+# 메모리 데이터셋에는 샘플별로 run 하나만 남으므로 조회 / 재실험 이력 / 전체 이력은 store 에서
+def sample_run_rows(runs):
+	return [dict(r, file=os.path.basename(r['source']), retest="재실험" if r['retest'] else "", selected="✔" if r['selected'] else "") for r in runs]
 
+@app.callback(
+	Output('sample-runs', 'data'),
+	Output('sample-search-status', 'children'),
+	Input('sample-search', 'value'),
+	Input('data-version', 'data'),
+)
+def search_samples(query, version):
+	query = (query or "").strip()
+	if not STORE_ENABLED:
+		return [], "Sample store is disabled (COVID_STORE=0)."
+	if len(query) < SAMPLE_SEARCH_MIN_LENGTH:
+		return [], ""
+	runs = sample_store.search(query, SAMPLE_SEARCH_LIMIT)
+	if not runs:
+		return [], "No sample starting with %s." % query
+	samples = len(set(r['sample'] for r in runs))
+	retests = sum(1 for r in runs if r['retest'])
+	more = " (first %d)" % SAMPLE_SEARCH_LIMIT if samples >= SAMPLE_SEARCH_LIMIT else ""
+	return sample_run_rows(runs), "%d sample(s)%s, %d run(s), %d from retest reports" % (samples, more, len(runs), retests)
+
+def store_or_404():
+	if not STORE_ENABLED:
+		flask.abort(404)
+	return sample_store
+
+@server.route('/api/samples/<sample>')
+def api_sample(sample):
+	# 샘플의 모든 run 과 데이터셋에 쓰인 run
+	runs = store_or_404().history(sample)
+	if not runs:
+		flask.abort(404)
+	return {'sample': sample, 'runs': runs, 'retest_runs': sum(r['retest'] for r in runs), 'selected': next(r for r in runs if r['selected'])}
+
+@server.route('/api/samples')
+def api_samples():
+	# ?prefix=3097&limit=20 : prefix 로 시작하는 샘플들의 모든 run
+	prefix = flask.request.args.get('prefix', '')
+	if not prefix:
+		flask.abort(400)
+	limit = min(flask.request.args.get('limit', SAMPLE_SEARCH_LIMIT, type=int), 1000)
+	return {'runs': store_or_404().search(prefix, limit)}
+
+@server.route('/api/runs')
+def api_runs():
+	# ?batch_min=&batch_max=&clade=&pango=&sample=&retest=0|1&limit= : 조건에 맞는 run 을 JSON lines 로 스트리밍
+	args = flask.request.args
+	batch = None
+	if 'batch_min' in args or 'batch_max' in args:
+		batch = [args.get('batch_min', -2**31, type=int), args.get('batch_max', 2**31, type=int)]
+	retest = args.get('retest', type=int)
+	runs = store_or_404().runs(batch=batch, clade=args.get('clade'), pango=args.get('pango'), sample=args.get('sample'),
+							   retest=retest, limit=args.get('limit', type=int))
+	return flask.Response((json.dumps(r, ensure_ascii=False) + "\n" for r in runs), mimetype='application/x-ndjson')
 
 
 
@@ -0,0 +1,171 @@
+// 브라우저 필터링 모드 (COVID_CLIENTSIDE)
+// 서버가 데이터셋 버전마다 한 번 보내는 열 단위 데이터(client-data)로 clade / pass-fail 막대그래프와
+// pass 요약을 브라우저에서 계산한다. 집계 방식은 CountCube.clade_counts / passfail / summary 와 같음.
+
+(function () {
+	var decoded = {version: null};
+
+	function decode(b64, Type) {
+		var bin = atob(b64);
+		var bytes = new Uint8Array(bin.length);
+		for (var i = 0; i < bin.length; i++) {
+			bytes[i] = bin.charCodeAt(i);
+		}
+		return new Type(bytes.buffer);
+	}
+
+	function columns(data) {
+		// base64 열을 typed array 로 (버전이 바뀔 때만)
+		if (decoded.version !== data.version) {
+			decoded = {
+				version: data.version,
+				batch: decode(data.batch, Int16Array),
+				year: decode(data.year.codes, Uint8Array),
+				qc: decode(data.qc.codes, Uint8Array),
+				clade: decode(data.clade.codes, Uint8Array),
+				pf: decode(data.pf.codes, Uint8Array)
+			};
+		}
+		return decoded;
+	}
+
+	function selected(labels, values) {
+		// 체크리스트 / 라디오 값에 해당하는 코드 표 ('All' 이면 null)
+		if (values === 'All' || (Array.isArray(values) && values.indexOf('All') >= 0)) {
+			return null;
+		}
+		values = Array.isArray(values) ? values : [String(values)];
+		return labels.map(function (label) { return values.indexOf(label) >= 0; });
+	}
+
+	function rowFilter(data, year, clade, cov, qc, useClade) {
+		// year / QC / coverage(P/F) / clade 조건을 행 코드로 확인하는 함수
+		var years = selected(data.year.labels, year);
+		var qcs = selected(data.qc.labels, qc);
+		var clades = useClade ? selected(data.clade.labels, clade) : null;
+		var pass = data.pf.labels.indexOf('Pass');
+		var col = columns(data);
+		return function (i) {
+			if (years && !years[col.year[i]]) return false;
+			if (qcs && !qcs[col.qc[i]]) return false;
+			if (clades && !clades[col.clade[i]]) return false;
+			if (cov === '>=90%' && col.pf[i] !== pass) return false;
+			if (cov === '<90%' && col.pf[i] === pass) return false;
+			return true;
+		};
+	}
+
+	function countBy(data, keep, labelColumn, nLabels, lo, hi) {
+		// {batch: [label 별 수]} 와 batch 목록 (오름차순)
+		var col = columns(data);
+		var codes = col[labelColumn];
+		var counts = {};
+		for (var i = 0; i < col.batch.length; i++) {
+			var b = col.batch[i];
+			if (b < lo || b > hi || !keep(i)) continue;
+			if (!counts[b]) {
+				counts[b] = new Array(nLabels).fill(0);
+			}
+			counts[b][codes[i]] += 1;
+		}
+		var batches = Object.keys(counts).map(Number).sort(function (a, b) { return a - b; });
+		return {counts: counts, batches: batches};
+	}
+
+	function barFigure(data, colors, title, colorName, valueName, names, x, ys) {
+		// px.bar(color=..., color_discrete_map=colors) 와 같은 모양의 stacked bar figure
+		var mapping = Object.assign({}, colors);
+		var sequence = data.template.layout.colorway;
+		var traces = names.map(function (name, k) {
+			if (!(name in mapping)) {
+				mapping[name] = sequence[Object.keys(mapping).length % sequence.length];
+			}
+			return {
+				type: 'bar', name: name, x: x, y: ys[k], orientation: 'v', textposition: 'auto',
+				marker: {color: mapping[name], pattern: {shape: ''}},
+				legendgroup: name, offsetgroup: name, alignmentgroup: 'True', showlegend: true,
+				hovertemplate: colorName + '=' + name + '<br>batch=%{x}<br>' + valueName + '=%{y}<extra></extra>'
+			};
+		});
+		var layout = {
+			template: data.template, barmode: 'relative',
+			xaxis: {anchor: 'y', domain: [0, 1], title: {text: 'batch'}},
+			yaxis: {anchor: 'x', domain: [0, 1], title: {text: valueName}},
+			legend: {title: {text: colorName}, tracegroupgap: 0}
+		};
+		if (title) {
+			layout.title = {text: title};
+		}
+		return {data: traces, layout: layout};
+	}
+
+	function cladeCounts(data, year, cov, qc, batch) {
+		// CountCube.clade_counts: clade 는 전체 batch 에서 한 번이라도 나온 것, batch 는 범위 안에서 샘플이 있는 것
+		var keep = rowFilter(data, year, null, cov, qc, false);
+		var n = data.clade.labels.length;
+		var all = countBy(data, keep, 'clade', n, -Infinity, Infinity);
+		var present = new Array(n).fill(false);
+		all.batches.forEach(function (b) {
+			all.counts[b].forEach(function (c, k) { if (c > 0) present[k] = true; });
+		});
+		var inRange = countBy(data, keep, 'clade', n, batch[0], batch[1]);
+		var clades = [];
+		for (var k = 0; k < n; k++) {
+			if (present[k]) clades.push(k);
+		}
+		return {clades: clades, batches: inRange.batches, counts: inRange.counts};
+	}
+
+	window.dash_clientside = Object.assign({}, window.dash_clientside, {
+		covid: {
+			clade_count: function (year, clade, cov, qc, batch, data) {
+				if (!data) return window.dash_clientside.no_update;
+				var r = cladeCounts(data, year, cov, qc, batch);
+				var show = selected(data.clade.labels, clade);
+				var clades = r.clades.filter(function (k) { return !show || show[k]; });
+				return barFigure(data, data.clade_colors, 'Clade Count BarPlot', 'clade', 'count',
+					clades.map(function (k) { return data.clade.labels[k]; }), r.batches,
+					clades.map(function (k) { return r.batches.map(function (b) { return r.counts[b][k]; }); }));
+			},
+
+			clade_percent: function (year, clade, cov, qc, batch, data) {
+				if (!data) return window.dash_clientside.no_update;
+				var r = cladeCounts(data, year, cov, qc, batch);
+				var totals = r.batches.map(function (b) { return r.counts[b].reduce(function (s, c) { return s + c; }, 0); });
+				return barFigure(data, data.clade_colors, 'Clade Percent BarPlot', 'clade', 'percent',
+					r.clades.map(function (k) { return data.clade.labels[k]; }), r.batches,
+					r.clades.map(function (k) { return r.batches.map(function (b, j) { return r.counts[b][k] / totals[j] * 100; }); }));
+			},
+
+			pass_count: function (year, clade, cov, qc, batch, data) {
+				if (!data) return window.dash_clientside.no_update;
+				var keep = rowFilter(data, year, clade, cov, qc, true);
+				var n = data.pf.labels.length;
+				var r = countBy(data, keep, 'pf', n, batch[0], batch[1]);
+				var labels = [];
+				for (var k = 0; k < n; k++) {
+					if (r.batches.some(function (b) { return r.counts[b][k] > 0; })) labels.push(k);
+				}
+				return barFigure(data, data.pf_colors, null, 'P/F', 'count',
+					labels.map(function (k) { return data.pf.labels[k]; }), r.batches,
+					labels.map(function (k) { return r.batches.map(function (b) { return r.counts[b][k]; }); }));
+			},
+
+			pass_summary: function (year, clade, cov, qc, batch, data) {
+				if (!data) return window.dash_clientside.no_update;
+				var keep = rowFilter(data, year, clade, cov, qc, true);
+				var col = columns(data);
+				var pass = data.pf.labels.indexOf('Pass');
+				var passed = 0, failed = 0;
+				for (var i = 0; i < col.batch.length; i++) {
+					if (col.batch[i] < batch[0] || col.batch[i] > batch[1] || !keep(i)) continue;
+					if (col.pf[i] === pass) passed++; else failed++;
+				}
+				var total = passed + failed;
+				var rate = total ? passed / total * 100 : 0;
+				return total.toLocaleString('en-US') + ' samples · Pass ' + passed.toLocaleString('en-US') +
+					' (' + rate.toFixed(1) + '%) · Fail ' + failed.toLocaleString('en-US');
+			}
+		}
+	});
+})();
@@ -0,0 +1,428 @@
+# 합성 레포트로 데이터 규모별 성능 측정
+#
+# python benchmark.py generate --samples 100000           : 합성 레포트(xlsx) 생성 (.bench/data/n100000/<year>/)
+# python benchmark.py run --samples 10000 100000 1000000  : 생성 + 읽기 / 중복 제거 / 인덱스 / 콜백 / payload 크기 측정
+# python benchmark.py compare old.json new.json           : 두 결과 비교 (느려진 항목이 있으면 exit 1)
+# python benchmark.py startup                             : 새 프로세스에서 `import app` 시간 / 모듈별 import 시간 (-X importtime),
+#                                                           데이터셋을 다 읽을 때까지 시간 (동기 로딩 / 백그라운드 로딩)
+#
+# 합성 레포트는 실제 레포트와 같은 형식 (헤더 2 줄 + 14 열, "22_용역23차(PAC)_87" / "23_023_PAC_03" batch,
+# 실제 데이터 비율에 가까운 clade / pango / QC, 재실험 레포트) 이라 covid_table() 로 그대로 읽는다.
+# 결과는 JSON 으로 저장 (기본 .bench/results/<git commit>.json) 해서 커밋 사이에 비교한다.
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+
+BENCH_DIR = "./.bench"
+# 이 샘플 수보다 크면 xlsx 를 쓰고 읽는 대신 메모리에서 만든 레포트로 정리 단계만 측정
+INGEST_MAX_SAMPLES = 500000
+SAMPLES_PER_BATCH = 192
+BATCHES_PER_FILE = 2
+# 재실험 레포트로 다시 나오는 샘플 비율
+RETEST_RATE = 0.03
+
+REPORT_HEADER = [
+	['sample/QC', None, None, None, None, '결과값', None, None, None, None, None, None, None, None],
+	['순번', '입고 일', 'Sample ID', 'QC', 'Result', 'Date', 'Total number of filtered reads', 'map reads',
+	 'Base\nCoverage (%)', 'bad base(N)', 'Sequencing depth (x)', 'contig_length', 'Clade', 'Pango'],
+]
+
+# (레포트의 clade 표기, pango, 비율) - 실제 레포트의 상위 lineage 비율에 etc 로 묶이는 clade 를 조금 섞음
+CLADE_MIX = [
+	('22B (Omicron)', 'BA.5.2', 0.196), ('22B (Omicron)', 'BA.5.2.1', 0.131), ('22D (Omicron)', 'BN.1.3', 0.098),
+	('22D (Omicron)', 'BN.1.2', 0.089), ('23A', 'XBB.1.5', 0.045), ('22F (Omicron)', 'XBB.1.9.1', 0.025),
+	('22D (Omicron)', 'CH.1.1', 0.024), ('22B (Omicron)', 'BF.5', 0.018), ('22D (Omicron)', 'CJ.1', 0.015),
+	('22B (Omicron)', 'BF.7', 0.013), ('22B (Omicron)', 'BA.5.2.43', 0.013), ('22D (Omicron)', 'BN.1', 0.012),
+	('22F (Omicron)', 'EG.1', 0.012), ('22E (Omicron)', 'BQ.1.24', 0.011), ('22B (Omicron)', 'BA.5.1', 0.011),
+	('22E (Omicron)', 'BQ.1.22', 0.011), ('22F (Omicron)', 'XBB.1.9.2', 0.009), ('22D (Omicron)', 'BN.1.2.3', 0.009),
+	('23B', 'XBB.1.16', 0.008), ('22B (Omicron)', 'BA.5.2.19', 0.007), ('21L (Omicron)', 'BA.2.3.20', 0.006),
+	('22E (Omicron)', 'BQ.1', 0.006), ('22B (Omicron)', 'BA.5.2.6', 0.005), ('22E (Omicron)', 'BQ.1.2', 0.005),
+	('22B (Omicron)', 'BA.5.5', 0.004), ('22D (Omicron)', 'BN.3.1', 0.004), ('22A (Omicron)', 'BA.4.6', 0.003),
+	('22C (Omicron)', 'BA.2.12.1', 0.002), ('21K (Omicron)', 'BA.1.1', 0.002), ('21I (Delta)', 'AY.103', 0.001),
+	('recombinant', 'XBB.1.5.1', 0.001), ('20C', 'B.1.497', 0.0005),
+]
+QC_MIX = [('good', 0.905), ('bad', 0.05), ('mediocre', 0.043), (None, 0.002)]
+
+
+# ===== GENERATOR ===== #
+def _batch_label(year, batch, pos, style):
+	# 실제 레포트의 두 가지 batch 표기
+	if style == 0:
+		return "%s_용역%d차(PAC%s)_%d" % (str(year)[-2:], batch, '3' if batch % 3 == 0 else '', pos)
+	return "%s_%03d_PAC_%02d" % (str(year)[-2:], batch, pos)
+
+def _report_rows(rng, year, batches, samples, labels_style, date):
+	# batches 의 샘플 행 (레포트 14 열) 데이터프레임
+	n = len(samples)
+	mix = rng.choice(len(CLADE_MIX), n, p=_weights(CLADE_MIX))
+	qc = rng.choice(len(QC_MIX), n, p=_weights(QC_MIX))
+	# coverage 는 대부분 0.99 근처, 일부 실패 샘플은 0 ~ 0.9
+	coverage = np.where(rng.random(n) < 0.06, rng.uniform(0, 0.9, n), rng.uniform(0.95, 0.998, n)).round(3)
+	totalreads = np.maximum(rng.gamma(3.0, 4300, n), 2).astype(np.int64)
+	mappedreads = totalreads - rng.integers(0, 20, n).clip(max=totalreads - 1)
+	badbases = ((1 - coverage) * 29903).astype(np.int64) + rng.integers(88, 160, n)
+	depth = (totalreads * 0.0218 * coverage).round(2)
+	batch_of = np.repeat(batches, SAMPLES_PER_BATCH)[:n]
+	pos = np.tile(np.arange(1, SAMPLES_PER_BATCH + 1), len(batches))[:n]
+	no_call = np.array([QC_MIX[i][0] is None for i in qc])
+	return pd.DataFrame({
+		0: [_batch_label(year, b, p, labels_style) for b, p in zip(batch_of, pos)],
+		1: None, 2: samples, 3: [QC_MIX[i][0] for i in qc], 4: None, 5: date,
+		6: totalreads, 7: mappedreads, 8: coverage, 9: badbases, 10: depth,
+		11: rng.integers(29800, 29900, n),
+		12: [CLADE_MIX[i][0] for i in mix],
+		13: np.where(no_call, None, np.array([CLADE_MIX[i][1] for i in mix], dtype=object)),
+	})
+
+def _weights(mix):
+	w = np.array([m[-1] for m in mix], dtype=float)
+	return w / w.sum()
+
+def synthetic_reports(samples, years=('2022', '2023'), seed=0):
+	# (year, 파일 이름, 레포트 행) 을 생성. 샘플 수는 years 에 나눠 담고 batch 번호는 년도마다 1 부터
+	# 파일 하나에 BATCHES_PER_FILE 개 batch, 10 번째 파일마다 앞 파일 샘플 일부의 재실험 레포트
+	rng = np.random.default_rng(seed)
+	next_sample = 25000000
+	per_year = -(-samples // len(years))
+	left = samples
+	for y, year in enumerate(years):
+		count = min(per_year, left)
+		left -= count
+		batch = 1
+		recent = []
+		while count > 0:
+			n = min(count, SAMPLES_PER_BATCH * BATCHES_PER_FILE)
+			batches = list(range(batch, batch + -(-n // SAMPLES_PER_BATCH)))
+			ids = np.arange(next_sample, next_sample + n)
+			date = "%s.%02d.%02d" % (year, 1 + batch // 30 % 12, 1 + batch % 28)
+			rows = _report_rows(rng, year, batches, ids, batch % 2, date)
+			name = "질병관리청 %s차 %d건 샘플 실험실 확인용 레포트.xlsx" % ("_".join("%03d" % b for b in batches), n)
+			yield year, name, rows
+			recent.append(ids)
+			next_sample += n
+			count -= n
+			batch = batches[-1] + 1
+
+			if len(recent) == 10 or count == 0:
+				pool = np.concatenate(recent)
+				retest = rng.choice(pool, max(1, int(len(pool) * RETEST_RATE)), replace=False)
+				rows = _report_rows(rng, year, [batches[-1]], retest, 1, date)
+				yield year, "질병관리청 %03d차(재실험) %d건 샘플 실험실 확인용 레포트.xlsx" % (batches[-1], len(retest)), rows
+				recent = []
+
+def write_report(path, rows):
+	# 실제 레포트와 같은 형식 (헤더 2 줄, 병합 셀 없음) 의 xlsx
+	wb = Workbook(write_only=True)
+	ws = wb.create_sheet("Sheet1")
+	for header in REPORT_HEADER:
+		ws.append(header)
+	for row in rows.itertuples(index=False, name=None):
+		ws.append([None if v is None or (isinstance(v, float) and np.isnan(v)) else v.item() if hasattr(v, 'item') else v for v in row])
+	wb.save(path)
+
+def generate(samples, out_dir, years=('2022', '2023'), seed=0):
+	# out_dir/<year>/ 에 합성 레포트를 쓰고 ({year: [파일 경로]}, 생성 시간) 반환 (같은 인자로 이미 만들었으면 재사용)
+	marker = os.path.join(out_dir, "generated.json")
+	params = {'samples': samples, 'years': list(years), 'seed': seed, 'samples_per_batch': SAMPLES_PER_BATCH,
+			  'batches_per_file': BATCHES_PER_FILE, 'retest_rate': RETEST_RATE}
+	try:
+		with open(marker) as f:
+			done = json.load(f)
+		if done['params'] == params:
+			return done['files'], done['seconds']
+	except (OSError, ValueError, KeyError):
+		pass
+
+	shutil.rmtree(out_dir, ignore_errors=True)
+	start = time.perf_counter()
+	files = {year: [] for year in years}
+	for year, name, rows in synthetic_reports(samples, years, seed):
+		os.makedirs(os.path.join(out_dir, year), exist_ok=True)
+		path = os.path.join(out_dir, year, name)
+		write_report(path, rows)
+		files[year].append(path)
+	with open(marker, 'w') as f:
+		json.dump({'params': params, 'files': files, 'seconds': time.perf_counter() - start}, f, ensure_ascii=False)
+	return files, time.perf_counter() - start
+
+
+# ===== MEASUREMENT ===== #
+def timed(fn, repeat=1, setup=None):
+	# fn() 을 repeat 번 실행해서 (마지막 결과, {'seconds': 중앙값, 'min': 최소값})
+	times = []
+	for _ in range(repeat):
+		if setup is not None:
+			setup()
+		start = time.perf_counter()
+		result = fn()
+		times.append(time.perf_counter() - start)
+	return result, {'seconds': float(np.median(times)), 'min': float(min(times))}
+
+def _dir_bytes(files):
+	return sum(os.path.getsize(i) for paths in files.values() for i in paths)
+
+def bench_ingest(files, workers, cache_dir):
+	# 레포트 읽기: 캐시 없이 파싱 + 캐시 쓰기 / 캐시에서 다시 읽기
+	from covid_data import covid_table, concat_typed, with_year, ingest_report
+	import covid_data
+
+	shutil.rmtree(cache_dir, ignore_errors=True)
+	def read():
+		return concat_typed([with_year(covid_table(paths, cache_dir, workers), year) for year, paths in files.items() if paths])
+	frame, cold = timed(read)
+	parse = ingest_report(covid_data.ingest_timings)
+	_, warm = timed(read)
+	cold.update(files=sum(len(paths) for paths in files.values()), rows=len(frame), workers=workers,
+				file_mean=float(parse['seconds'].mean()), file_max=float(parse['seconds'].max()))
+	return frame, {'parse_and_cache': cold, 'cached': warm}
+
+def bench_ingest_in_memory(samples, years, seed):
+	# xlsx 없이 합성 레포트 행에 clean_report() / apply_schema() 만 적용 (큰 규모용)
+	from covid_data import clean_report, apply_schema, concat_typed, with_year
+
+	reports = {}
+	for year, name, rows in synthetic_reports(samples, years, seed):
+		reports.setdefault(year, []).append(rows)
+
+	def read():
+		frames = []
+		for year, raws in reports.items():
+			df = pd.concat([clean_report(raw) for raw in raws], ignore_index=True)
+			frames.append(with_year(apply_schema(df).sort_values(by='batch'), year))
+		return concat_typed(frames)
+	frame, clean = timed(read)
+	clean['rows'] = len(frame)
+	return frame, {'clean_in_memory': clean}
+
+# 콜백 측정용 필터 조합 (batch 범위 None 은 전체)
+SCENARIOS = {
+	'all': ('All', ['All'], 'All', ['All'], None),
+	'year': ('2023', ['All'], 'All', ['All'], None),
+	'qc_good_pass': ('All', ['All'], '>=90%', ['good'], None),
+	'clade_subset': ('All', ['22B', '22D', 'etc'], 'All', ['All'], None),
+	'narrow_batch': ('All', ['All'], 'All', ['All'], 'narrow'),
+}
+
+def bench_callbacks(frame, repeat, report_root):
+	# app 의 figure 함수들을 frame 으로 실행한 시간과 직렬화 크기
+	# app 은 import 할 때 레포트를 읽으므로 실제 레포트 / SQLite store 대신 합성 레포트 폴더를 읽게 함
+	# (app 은 처음 한 번만 import 되므로 첫 규모의 폴더를 읽고, 측정할 데이터는 refresh_dataset 으로 바꿈)
+	os.environ.setdefault("COVID_POLL_INTERVAL", "0")
+	os.environ["COVID_REPORT_ROOT"] = report_root
+	os.environ["COVID_STORE"] = "0"
+	import app
+	from figure_cache import to_json
+
+	_, index = timed(lambda: app.refresh_dataset(frame, None, None, None))
+	lo, hi = app.full_batch_range()
+
+	def table_page(year, clade, cov, qc, batch):
+		# Data Table 첫 페이지 (20 행)
+		engine, rows = app.table_rows(year, clade, cov, qc, batch, [], '')
+		return engine.frame.iloc[rows[:20]].to_dict('records')
+
+	figures = {
+		'clade_count': app.clade_count_figure, 'clade_percent': app.clade_percent_figure,
+		'pass_count': app.pass_figure, 'sunburst': app.sunburst_figure,
+		'depth_box': app.depth_box_figure, 'reads_box': app.reads_box_figure,
+		'parallel': app.parallel_figure, 'pass_summary': app.pass_summary, 'table_page': table_page,
+	}
+
+	def clear():
+		# FilterEngine 필터 결과 캐시를 비워서 매번 처음 계산하는 시간으로
+		app.filter_engine._memo.clear()
+
+	out = {}
+	for name, build in figures.items():
+		out[name] = {}
+		for scenario, (year, clade, cov, qc, batch) in SCENARIOS.items():
+			if batch == 'narrow':
+				batch = [lo + (hi - lo) // 2, min(hi, lo + (hi - lo) // 2 + 10)]
+			elif batch is None:
+				batch = [lo, hi]
+			fig, stats = timed(lambda: build(year, clade, cov, qc, batch), repeat, clear)
+			data, serialize = timed(lambda: to_json(fig), repeat)
+			stats.update(serialize=serialize['seconds'], bytes=len(data))
+			out[name][scenario] = stats
+
+	# 예전 방식 (전체 샘플 groupby) 비교용
+	_, legacy = timed(lambda: app.groupby_clade(frame), repeat)
+	return {'index': index, 'figures': out, 'legacy_groupby_clade': legacy}
+
+def bench_size(samples, args):
+	from covid_data import dedup_samples
+
+	result = {'samples': samples}
+	years = tuple(args.years)
+	# ingest_max 보다 큰 규모는 레포트 파일을 만들지 않으므로 app 이 읽을 폴더도 없음
+	out_dir = os.path.join(args.bench_dir, "data", "n%d" % samples)
+	if samples <= args.ingest_max:
+		files, seconds = generate(samples, out_dir, years, args.seed)
+		result['generate'] = {'seconds': seconds, 'files': sum(len(paths) for paths in files.values()), 'bytes': _dir_bytes(files)}
+		frame, result['ingest'] = bench_ingest(files, args.workers, os.path.join(args.bench_dir, "cache", "n%d" % samples))
+	else:
+		frame, result['ingest'] = bench_ingest_in_memory(samples, years, args.seed)
+
+	deduped, dedup = timed(lambda: dedup_samples(frame), args.repeat)
+	dedup.update(rows_in=len(frame), rows_out=len(deduped))
+	result['dedup'] = dedup
+	result['memory_bytes'] = int(deduped.memory_usage(deep=True).sum())
+	result['callbacks'] = bench_callbacks(deduped, args.repeat, out_dir)
+	return result
+
+# ===== STARTUP ===== #
+STARTUP_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.dataset_ready.wait()
+print(json.dumps({'import_seconds': imported - start, 'ready_seconds': time.perf_counter() - start,
+				  'loaded': [m for m in %r if m in sys.modules]}))
+"""
+# 첫 요청 전까지 import 하지 않아야 하는 모듈
+LAZY_MODULES = ('plotly.express', 'openpyxl')
+
+def import_times(stderr):
+	# python -X importtime 출력에서 (app 모듈 본문 시간, app 이 직접 import 한 모듈별 누적 시간 큰 순)
+	pending, children, body = [], [], 0.0
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		self_us, cumulative_us, name = line[len("import time:"):].split("|")
+		depth = (len(name) - len(name.lstrip()) - 1) // 2
+		if depth == 1:
+			pending.append({'module': name.strip(), 'seconds': int(cumulative_us) / 1e6})
+		elif depth == 0:
+			if name.strip() == 'app':
+				children, body = pending, int(self_us) / 1e6
+			pending = []
+	return body, sorted(children, key=lambda m: -m['seconds'])
+
+def bench_startup(background, repeat, top=10):
+	# 새 인터프리터에서 import app (레포트 캐시는 첫 실행에서 채워짐, 중앙값)
+	# -X importtime 의 중첩 단계는 스레드를 구분하지 않아서 모듈별 시간은 동기 로딩일 때만 구함
+	env = dict(os.environ, COVID_POLL_INTERVAL="0", COVID_STORE="0", COVID_BACKGROUND_LOAD="1" if background else "0")
+	command = [sys.executable] + ([] if background else ['-X', 'importtime']) + ['-c', STARTUP_SCRIPT % (LAZY_MODULES,)]
+	runs = []
+	for _ in range(repeat):
+		proc = subprocess.run(command, capture_output=True, text=True, env=env, check=True)
+		result = json.loads(proc.stdout.strip().splitlines()[-1])
+		result['app_body_seconds'], result['modules'] = import_times(proc.stderr) if not background else (None, [])
+		runs.append(result)
+	result = sorted(runs, key=lambda r: r['ready_seconds'])[len(runs) // 2]
+	result['modules'] = result['modules'][:top]
+	return result
+
+def _git(*args):
+	try:
+		return subprocess.run(['git'] + list(args), capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def environment():
+	import plotly
+	return {
+		'commit': _git('rev-parse', '--short', 'HEAD'), 'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+		'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform(),
+		'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__, 'plotly': plotly.__version__,
+	}
+
+
+# ===== COMPARE ===== #
+def flatten(result, prefix=''):
+	# 결과 JSON 을 {'n10000/callbacks/figures/clade_count/all/seconds': 값, ...} 으로
+	out = {}
+	if isinstance(result, dict):
+		for key, value in result.items():
+			out.update(flatten(value, prefix + '/' + str(key) if prefix else str(key)))
+	elif isinstance(result, (int, float)) and not isinstance(result, bool):
+		out[prefix] = result
+	return out
+
+def compare(old, new, threshold):
+	# seconds / bytes 항목이 threshold 비율 이상 커진 것을 느려진 항목으로 출력
+	old = {k: v for r in old['results'] for k, v in flatten(r, 'n%d' % r['samples']).items()}
+	new = {k: v for r in new['results'] for k, v in flatten(r, 'n%d' % r['samples']).items()}
+	regressions = 0
+	for key in sorted(set(old) & set(new)):
+		# 합성 레포트 생성 시간은 비교하지 않음
+		if not key.endswith(('/seconds', '/bytes')) or '/generate/' in key or not old[key]:
+			continue
+		ratio = new[key] / old[key]
+		flag = ''
+		# 아주 짧은 시간은 잡음이 커서 제외
+		if ratio > 1 + threshold and (key.endswith('/bytes') or new[key] - old[key] > 0.005):
+			flag = '  <-- regression'
+			regressions += 1
+		print("%-70s %12.4g %12.4g %7.2fx%s" % (key, old[key], new[key], ratio, flag))
+	return regressions
+
+
+# ===== CLI ===== #
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="SARS-CoV dashboard benchmark")
+	parser.add_argument('command', choices=['generate', 'run', 'compare', 'startup'])
+	parser.add_argument('files', nargs='*', help="compare: old.json new.json")
+	parser.add_argument('--samples', type=int, nargs='+', default=[10000, 100000], help="sample counts (default: %(default)s)")
+	parser.add_argument('--years', nargs='+', default=['2022', '2023'])
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--repeat', type=int, default=3, help="timing repeats per callback (median is kept)")
+	parser.add_argument('--workers', type=int, default=1, help="ingest parser processes (default: %(default)s)")
+	parser.add_argument('--ingest-max', type=int, default=INGEST_MAX_SAMPLES,
+						help="above this many samples, skip xlsx and time cleaning in memory (default: %(default)s)")
+	parser.add_argument('--bench-dir', default=BENCH_DIR)
+	parser.add_argument('--output', help="result JSON (default: <bench-dir>/results/<commit>.json)")
+	parser.add_argument('--threshold', type=float, default=0.2, help="compare: slowdown ratio to report (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	if args.command == 'compare':
+		if len(args.files) != 2:
+			parser.error("compare needs two result files")
+		old, new = [json.load(open(i)) for i in args.files]
+		return 1 if compare(old, new, args.threshold) else 0
+
+	if args.command == 'startup':
+		for background in (False, True):
+			result = bench_startup(background, args.repeat)
+			body = "" if background else " (app module body %.2fs)" % result['app_body_seconds']
+			print("%s loading: import %.2fs%s, ready %.2fs, lazy modules loaded: %s" % (
+				'background' if background else 'synchronous', result['import_seconds'], body, result['ready_seconds'],
+				", ".join(result['loaded']) or "none"))
+			for module in result['modules']:
+				print("  %-40s %6.3fs" % (module['module'], module['seconds']))
+		return 0
+
+	if args.command == 'generate':
+		for samples in args.samples:
+			out_dir = os.path.join(args.bench_dir, "data", "n%d" % samples)
+			files, seconds = generate(samples, out_dir, tuple(args.years), args.seed)
+			print("%d samples: %d files in %s (%.1fs)" % (samples, sum(len(v) for v in files.values()), out_dir, seconds))
+		return 0
+
+	# app 이 import 할 때 읽는 합성 레포트의 캐시는 실제 레포트 캐시와 따로 둠 (covid_data 를 import 하기 전에 정해야 함)
+	os.environ.setdefault("COVID_CACHE_DIR", os.path.join(args.bench_dir, "cache", "app"))
+	report = {'environment': environment(), 'args': vars(args), 'results': []}
+	output = args.output or os.path.join(args.bench_dir, "results", "%s.json" % (report['environment']['commit'] or 'unknown'))
+	for samples in args.samples:
+		print("benchmark: %d samples" % samples, flush=True)
+		report['results'].append(bench_size(samples, args))
+		os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+		with open(output, 'w') as f:
+			json.dump(report, f, indent=1)
+	print("results:", output)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,847 @@
+# 질병관리청 실험실 확인용 레포트(xlsx)를 읽어 COVID 데이터프레임을 만드는 모듈
+#
+# python covid_data.py check    : 캐시 상태 확인 (stale 항목이 있으면 exit 1)
+# python covid_data.py rebuild  : 캐시 전체 재생성
+# python covid_data.py memory   : 샘플당 메모리 사용량 (fillna 방식 / typed schema)
+# python covid_data.py parser   : 파일별 파싱 시간 (read_excel / 스트리밍 파서) 과 결과 비교
+# python covid_data.py snapshot : worker 공유용 데이터셋 snapshot 생성 (--poll N: N 초마다 새 레포트 반영)
+
+import os
+import re
+import gc
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import functools
+import posixpath
+import threading
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import iterparse, parse as parse_xml
+import covid_metrics
+from covid_metrics import metrics, stage
+
+
+# 이 폴더 아래 하위 폴더 하나가 partition 하나 (폴더 이름이 year 값, 새 폴더는 자동으로 추가됨)
+REPORT_ROOT = "./input_report_files"
+CACHE_DIR = os.environ.get("COVID_CACHE_DIR", "./.report_cache")
+
+# 레포트 파싱 프로세스 수 (기본: CPU 수)
+INGEST_WORKERS = int(os.environ.get("COVID_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+
+# read_report() 결과 형식이 바뀌면 올려서 기존 캐시를 무효화
+CACHE_VERSION = 2
+
+REPORT_COLUMNS = 'batch', 'date', 'sample', 'QC', 'result', 'day', 'totalreads', 'mappedreads', 'coverage', 'badbases', 'depth', 'length', 'clade', 'pango'
+COVID_COLUMNS = ['batch', 'sample', 'QC', 'totalreads', 'mappedreads', 'coverage', 'badbases', 'depth', 'length', 'clade', 'pango']
+
+# covid 데이터프레임 열 타입. 숫자 열은 nullable 타입이라 빈 값은 "NA" 문자열이 아니라 <NA>,
+# 라벨 열은 category ("NA" 라벨 유지). batch 는 int16, year (partition 폴더 이름) 는 category
+COVID_SCHEMA = {
+	'batch': 'int16', 'sample': 'object', 'QC': 'category', 'P/F': 'category',
+	'totalreads': 'Int32', 'mappedreads': 'Int32', 'coverage': 'Float64', 'badbases': 'Int32',
+	'depth': 'Float64', 'length': 'Int32', 'clade': 'category', 'pango': 'category',
+}
+PF_CATEGORIES = ['Fail', 'Pass']
+
+try:
+	import pyarrow  # noqa: F401
+	CACHE_FORMAT = "parquet"
+except ImportError:
+	CACHE_FORMAT = "pkl"
+
+
+#22_용역23차(PAC)_87 -> 23_87
+#23_023_PAC_03 -> 23_023_03
+
+# "실험실 확인용 레포트" 두 번째 헤더 줄 (공백 / 줄바꿈 / 대소문자는 무시하고 비교). 14 열 고정
+REPORT_HEADER = ['순번', '입고 일', 'Sample ID', 'QC', 'Result', 'Date', 'Total number of filtered reads', 'map reads',
+				 'Base Coverage (%)', 'bad base(N)', 'Sequencing depth (x)', 'contig_length', 'Clade', 'Pango']
+REPORT_HEADER_ROWS = 2
+# batch 번호: 22_용역23차(PAC)_87 / 22_용역23차(PAC3)_87 -> 23, 23_023_PAC_03 -> 23
+BATCH_PATTERN = re.compile(r"^[^_]*_(?:용역)?(\d+)차?(?:\(PAC3?\))?_")
+REPORT_LABEL_COLUMNS = ['sample', 'QC', 'clade', 'pango']
+REPORT_NUMBER_COLUMNS = {'totalreads': 'Int32', 'mappedreads': 'Int32', 'coverage': 'Float64', 'badbases': 'Int32',
+						 'depth': 'Float64', 'length': 'Int32'}
+
+
+class ReportLayoutError(ValueError):
+	# 레포트 형식이 REPORT_HEADER / batch 형식과 다름 (열이 추가 / 이동되었거나 다른 종류의 파일)
+	pass
+
+def report_partitions(root=REPORT_ROOT):
+	# root 아래 partition 폴더 {'2022': './input_report_files/2022/', ...} (숨김 폴더 제외, 이름 순)
+	if not os.path.isdir(root):
+		return {}
+	names = sorted(name for name in os.listdir(root) if not name.startswith('.') and os.path.isdir(os.path.join(root, name)))
+	return {name: os.path.join(root, name, "") for name in names}
+
+def input_file_list(folder_path):
+	# 해당 폴더 경로 내의 모든 xlsx 파일을 리스트로 반환하는 함수
+	# folder_path: 파일 리스트를 가져올 폴더 경로
+	# glob.glob() 함수를 사용하여 폴더 내의 모든 xlsx 파일을 가져옴 (파일 이름 순. 재실험 결과가 같을 때 순서 기준)
+	file_list = sorted(glob.glob(folder_path + "/./*xlsx"))
+	return file_list
+
+# ===== REPORT PARSER ===== #
+# xlsx 의 첫 시트 XML 을 행 단위로 읽어서 쓰는 열의 셀 값만 꺼냄 (스타일 / 안 쓰는 열은 읽지 않음)
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+@functools.lru_cache(maxsize=None)
+def _column_letters_index(letters):
+	# "C" -> 2, "AA" -> 26
+	n = 0
+	for ch in letters:
+		n = n * 26 + ord(ch) - 64
+	return n - 1
+
+def _column_index(ref):
+	# "C12" -> 2
+	return _column_letters_index(ref.rstrip('0123456789'))
+
+def _first_sheet(book):
+	# read_excel 의 sheet_name=0 과 같은 첫 번째 시트의 zip 안 경로
+	workbook = parse_xml(book.open('xl/workbook.xml')).getroot()
+	rel_id = workbook.find(XLSX_NS + 'sheets')[0].get(XLSX_REL_ID)
+	for rel in parse_xml(book.open('xl/_rels/workbook.xml.rels')).getroot():
+		if rel.get('Id') == rel_id:
+			target = rel.get('Target')
+			return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+	raise ReportLayoutError("no worksheet in workbook")
+
+def _shared_strings(book):
+	try:
+		f = book.open('xl/sharedStrings.xml')
+	except KeyError:
+		return []
+	with f:
+		return ["".join(t.text or '' for t in si.iter(XLSX_NS + 't')) for si in parse_xml(f).getroot()]
+
+def sheet_rows(path, columns):
+	# 첫 시트의 행마다 columns (0 부터 시작하는 열 위치) 의 값 리스트를 생성 (openpyxl 과 같은 셀 값 변환)
+	position = {c: n for n, c in enumerate(columns)}
+	cell_tag, row_tag, value_tag, text_tag = XLSX_NS + 'c', XLSX_NS + 'row', XLSX_NS + 'v', XLSX_NS + 't'
+	with zipfile.ZipFile(path) as book:
+		strings = _shared_strings(book)
+		with book.open(_first_sheet(book)) as f:
+			row = [None] * len(columns)
+			for _, el in iterparse(f):
+				if el.tag == cell_tag:
+					n = position.get(_column_index(el.get('r')))
+					if n is None:
+						continue
+					kind = el.get('t', 'n')
+					if kind == 'inlineStr':
+						value = "".join(t.text or '' for t in el.iter(text_tag))
+					else:
+						value = el.findtext(value_tag)
+						if not value or kind == 'e':
+							value = None
+						elif kind == 's':
+							value = strings[int(value)]
+						elif kind == 'n':
+							value = float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+						elif kind == 'b':
+							value = value == '1'
+					row[n] = None if value == '' else value
+				elif el.tag == row_tag:
+					yield row
+					row = [None] * len(columns)
+					el.clear()
+
+def _header_key(value):
+	return " ".join(str(value).split()).lower() if value is not None else ""
+
+def _label(value):
+	# read_excel 과 같은 셀 값 (정수인 float 는 int) 을 문자열로, 빈 셀은 None
+	if value is None:
+		return None
+	if isinstance(value, float) and value.is_integer():
+		value = int(value)
+	return str(value)
+
+def read_report(path):
+	# 레포트 파일 하나를 읽어 COVID_COLUMNS 데이터프레임으로 반환 (apply_schema 이전 단계)
+	# 시트를 행 단위로 읽으면서 쓰는 열만 열별 리스트에 모으고 끝에서 열 타입으로 한 번에 변환.
+	# 헤더가 REPORT_HEADER 와 다르거나 batch 형식을 모르면 ReportLayoutError
+	keep = [REPORT_COLUMNS.index(c) for c in COVID_COLUMNS]
+	columns = {c: [] for c in COVID_COLUMNS}
+	rows = sheet_rows(path, list(range(len(REPORT_HEADER) + 1)))
+	header = [next(rows, []) for _ in range(REPORT_HEADER_ROWS)][-1]
+	found = [_header_key(v) for v in header]
+	expected = [_header_key(v) for v in REPORT_HEADER]
+	if found[:len(expected)] != expected or any(found[len(expected):]):
+		raise ReportLayoutError("%s: unexpected report header %r (expected %r)" % (path, header, REPORT_HEADER))
+
+	for n, row in enumerate(rows, REPORT_HEADER_ROWS + 1):
+		values = [row[i] for i in keep]
+		# 서식만 있는 빈 행
+		if all(v is None for v in values):
+			continue
+		match = BATCH_PATTERN.match(str(values[0]))
+		if match is None:
+			raise ReportLayoutError("%s row %d: unexpected batch id %r" % (path, n, values[0]))
+		values[0] = int(match.group(1))
+		for c, v in zip(COVID_COLUMNS, values):
+			columns[c].append(v)
+
+	out = {'batch': np.array(columns['batch'], dtype=np.int16)}
+	for c in REPORT_LABEL_COLUMNS:
+		out[c] = [_label(v) for v in columns[c]]
+	# 기존 read_excel 경로와 같게 clade 는 " (Omicron)" 을 빼고 빈 값은 "nan"
+	out['clade'] = ["nan" if v is None else v.replace(" (Omicron)", "") for v in out['clade']]
+	for c, dtype in REPORT_NUMBER_COLUMNS.items():
+		out[c] = pd.to_numeric(pd.Series(columns[c], dtype=object), errors='coerce').astype(dtype).array
+	return pd.DataFrame(out, columns=COVID_COLUMNS)
+
+def read_report_excel(path):
+	# 이전 방식 (pd.read_excel 로 시트 전체를 읽은 뒤 clean_report). parser 명령의 비교 기준
+	return clean_report(pd.read_excel(path, header=None).iloc[2:,:])
+
+def clean_report(df):
+	# 헤더 두 줄을 뺀 레포트 14 열 데이터프레임을 정리 (batch 번호 추출, clade 이름 정리)
+	# convert column name
+	df.columns = REPORT_COLUMNS
+
+	# [batch] column rename
+	df['batch'] = df['batch'].astype('str').str.replace(r"\(PAC3\)","",regex=True).str.replace(r"\(PAC\)","",regex=True).str.replace("용역","").str.replace("차","").str.split("_", expand = True)[1]
+
+	# [clade] column rename
+	df['clade'] = df['clade'].astype('str').str.replace(r" \(Omicron\)", "", regex=True)
+
+	# dataframe pivot
+	df = df[COVID_COLUMNS].reset_index(drop=True)
+	return df.infer_objects()
+
+def _timed_read_report(path):
+	start = time.perf_counter()
+	df = read_report(path)
+	return df, time.perf_counter() - start
+
+def parse_reports(file_list, workers=INGEST_WORKERS):
+	# read_report() 를 프로세스 풀에서 병렬로 실행. [(df, 소요시간), ...] 를 file_list 순서대로 반환
+	if workers <= 1 or len(file_list) <= 1:
+		return [_timed_read_report(i) for i in file_list]
+	with ProcessPoolExecutor(max_workers=min(workers, len(file_list))) as pool:
+		return list(pool.map(_timed_read_report, file_list, chunksize=max(1, len(file_list) // (workers * 4))))
+
+# 마지막 covid_table() 호출의 파일별 소요시간 (path, source, rows, seconds)
+ingest_timings = []
+
+def ingest_report(timings=None):
+	# 파일별 소요시간을 데이터프레임으로 반환 (느린 순)
+	df = pd.DataFrame(ingest_timings if timings is None else timings, columns=['path', 'source', 'rows', 'seconds'])
+	return df.sort_values('seconds', ascending=False, ignore_index=True)
+
+def apply_schema(df):
+	# read_report() 결과를 합친 데이터프레임을 COVID_SCHEMA 타입으로 변환 (P/F 열 추가)
+	coverage = pd.to_numeric(df['coverage'], errors='coerce').astype('Float64')
+	out = {}
+	for column, dtype in COVID_SCHEMA.items():
+		if column == 'P/F':
+			# coverage 90% 이상 Pass (빈 값은 Fail)
+			out[column] = pd.Categorical(np.where(coverage.fillna(0) >= 0.9, 'Pass', 'Fail'), categories=PF_CATEGORIES)
+		elif column == 'coverage':
+			out[column] = coverage
+		elif dtype == 'category':
+			out[column] = df[column].fillna("NA").astype(str).astype('category')
+		elif dtype == 'object':
+			out[column] = df[column].fillna("NA").astype(str)
+		else:
+			out[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+	return pd.DataFrame(out, index=df.index)
+
+def with_year(df, year):
+	# year 열 추가. 폴더 이름이 숫자든 아니든 ('2022', '2023_retest', 'pilot') 같은 타입이 되도록 문자열 category
+	return df.assign(year=pd.Categorical([str(year)] * len(df)))
+
+def concat_typed(frames, **kwargs):
+	# category 열의 categories 를 합쳐서 concat (그냥 concat 하면 object 로 바뀜)
+	frames = [f for f in frames if f is not None]
+	if not frames:
+		return pd.DataFrame(columns=list(COVID_SCHEMA))
+	for column in frames[0].columns:
+		if any(isinstance(f[column].dtype, pd.CategoricalDtype) for f in frames):
+			categories = sorted(set().union(*[f[column].astype('category').cat.categories for f in frames]), key=str)
+			frames = [f.assign(**{column: pd.Categorical(f[column], categories=categories)}) for f in frames]
+	return pd.concat(frames, **kwargs)
+
+def covid_table(file_list, cache_dir=CACHE_DIR, workers=INGEST_WORKERS):
+	# data merge (파일별 프레임을 모두 읽은 뒤 한 번만 concat)
+	# 단계별 시간 / 행 수는 covid_metrics 에 callback="ingest" 로 기록
+	with stage('load', len(file_list), callback='ingest') as s:
+		frames = load_reports(file_list, cache_dir, workers)
+		s['rows_out'] = sum(len(f) for f in frames)
+	with stage('concat', callback='ingest'):
+		merged_data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COVID_COLUMNS)
+	if cache_dir is not None:
+		with stage('evict', callback='ingest'):
+			evict_stale(cache_dir)
+
+	# typed columns + pass/fail column
+	with stage('schema', len(merged_data), callback='ingest'):
+		merged_data = apply_schema(merged_data)
+
+	# dataframe sort by batch (같은 batch 안에서는 file_list 순서 유지)
+	with stage('sort', len(merged_data), callback='ingest'):
+		merged_data = merged_data.sort_values(by='batch', kind='mergesort')
+	return merged_data
+
+def memory_report(file_list, cache_dir=CACHE_DIR):
+	# 예전 방식(fillna("NA") + object 열)과 COVID_SCHEMA 방식의 샘플당 메모리 비교
+	merged_data = pd.concat(load_reports(file_list, cache_dir), ignore_index=True)
+	legacy = merged_data.fillna("NA")
+	legacy.insert(3, 'P/F', legacy['coverage'].apply(lambda x: "Pass" if x >= 0.9 else "Fail"))
+	legacy = legacy.astype({'batch': int}).assign(year='2022')
+	typed = with_year(apply_schema(merged_data), 2022)
+
+	report = pd.DataFrame({
+		'before_dtype': legacy.dtypes.astype(str), 'before_bytes': legacy.memory_usage(deep=True, index=False),
+		'after_dtype': typed.dtypes.astype(str), 'after_bytes': typed.memory_usage(deep=True, index=False),
+	})
+	report.loc['total'] = ['', report['before_bytes'].sum(), '', report['after_bytes'].sum()]
+	report['before_per_sample'] = report['before_bytes'] / max(len(typed), 1)
+	report['after_per_sample'] = report['after_bytes'] / max(len(typed), 1)
+	return report
+
+def parser_report(file_list):
+	# 파일별 파싱 시간: read_excel (read_report_excel) / 스트리밍 파서 (read_report), 두 결과가 같은지
+	# 앞 파서가 남긴 객체의 GC 가 다음 측정에 들어가지 않도록 측정 전마다 gc.collect()
+	rows = []
+	for i in file_list:
+		gc.collect()
+		start = time.perf_counter()
+		excel = read_report_excel(i)
+		gc.collect()
+		middle = time.perf_counter()
+		stream = read_report(i)
+		end = time.perf_counter()
+		same = apply_schema(excel).reset_index(drop=True).equals(apply_schema(stream))
+		rows.append((os.path.basename(i), len(stream), (middle - start) * 1000, (end - middle) * 1000, same))
+	report = pd.DataFrame(rows, columns=['file', 'rows', 'read_excel_ms', 'stream_ms', 'same'])
+	report['speedup'] = report['read_excel_ms'] / report['stream_ms']
+	return report.sort_values('speedup', ignore_index=True)
+
+def _reads(df):
+	return pd.to_numeric(df['totalreads'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+# 샘플의 run 중 데이터셋에 남기는 run: (totalreads, partition, batch, 파일 이름) 이 가장 큰 run.
+# totalreads 가 NA 면 값이 있는 run 에 짐. covid_store 의 selected 도 같은 기준 (run_rank)
+def run_rank(totalreads, year, batch, source):
+	return (totalreads is not None, totalreads or 0, str(year), batch, os.path.basename(source))
+
+def dedup_samples(df):
+	# 재실험 샘플은 run_rank 가 가장 큰 결과만 남김. 파일 이름은 열이 없으므로 행 순서로
+	# (covid_table 은 파일 이름 순으로 읽고 batch 안에서는 그 순서를 유지함)
+	with stage('dedup', len(df), callback='ingest') as s:
+		df = df.sort_values(['totalreads', 'year', 'batch'], kind='mergesort', na_position='first').drop_duplicates('sample', keep='last')
+		s['rows_out'] = len(df)
+	return df
+
+
+# ===== LIVE DATASET ===== #
+# partition (년도) 폴더를 주기적으로 확인해서 새 레포트만 읽어 현재 데이터셋에 병합한다.
+# root 폴더를 주면 확인할 때마다 하위 폴더를 다시 찾으므로 새 년도 폴더도 바로 읽는다.
+# 샘플별 최고 totalreads 인덱스(_best)를 유지하므로 전체를 다시 정렬하지 않는다.
+# 기존 파일이 바뀌거나 삭제된 경우 (그리고 새 run 과 기존 run 이 파일 이름으로만 갈리는 경우) 에만
+# 전체를 다시 읽는다 (캐시 사용).
+
+class LiveDataset:
+	def __init__(self, folders=REPORT_ROOT, cache_dir=CACHE_DIR, workers=INGEST_WORKERS, settle=2.0):
+		# folders: partition 폴더들의 root ('./input_report_files') 또는 {'2022': './input_report_files/2022/', ...}
+		self.root = folders if isinstance(folders, str) else None
+		self._folders = None if self.root else dict(folders)
+		self.cache_dir = cache_dir
+		self.workers = workers
+		self.settle = settle
+		self.frame = None
+		self.version = 0
+		# 읽은 레포트 내용 기준 (재시작해도 같은 데이터면 같은 값. 다운로드 / 작업 결과 파일 이름에 씀)
+		self.fingerprint = None
+		self.lock = threading.RLock()
+		self._best = pd.Series(dtype=float)
+		self._seen = {}
+		self._listeners = []
+		self._thread = None
+
+	def on_change(self, fn):
+		# fn(frame, batches, added, removed): batches 는 다시 집계해야 하는 batch 집합,
+		# added / removed 는 추가되고 빠진 행 (전체 reload 면 셋 다 None)
+		self._listeners.append(fn)
+
+	@property
+	def folders(self):
+		return report_partitions(self.root) if self.root else self._folders
+
+	def _scan(self):
+		found = {}
+		for year, folder in self.folders.items():
+			for i in input_file_list(folder):
+				st = os.stat(i)
+				found[_cache_key(i)] = (year, i, st.st_size, st.st_mtime_ns)
+		return found
+
+	def _read(self, year_files):
+		return concat_typed([with_year(covid_table(files, self.cache_dir, self.workers), year) for year, files in year_files.items() if files])
+
+	def load(self):
+		# 전체 다시 읽기
+		with self.lock:
+			found = self._scan()
+			year_files = {}
+			for year, i, size, mtime in found.values():
+				year_files.setdefault(year, []).append(i)
+			frame = dedup_samples(self._read(year_files))
+			self._seen = {key: v[2:] for key, v in found.items()}
+			self._best = pd.Series(_reads(frame), index=frame['sample'].values)
+			self._publish(frame, None, None, None)
+		return frame
+
+	def merge(self, new):
+		# 새 레포트의 행들을 현재 데이터셋에 병합하고 영향받은 batch 집합을 반환
+		# (totalreads / partition / batch 가 모두 같은 run 이 있으면 파일 이름 순이라 전체 reload 하고 None)
+		with self.lock:
+			new = dedup_samples(new)
+			reads = _reads(new)
+			old_reads = self._best.reindex(new['sample'].values).values
+			present = new['sample'].isin(self._best.index).values
+			# 기존 값이 NA (또는 없음) 면 새 결과가 이김. 새 값만 NA 면 기존 결과 유지
+			take = ~present | (np.isnan(old_reads) & ~np.isnan(reads)) | (reads > old_reads)
+			frame = self.frame
+
+			# totalreads 가 같으면 (둘 다 NA 포함) partition, batch 순 (run_rank)
+			tie = present & ((reads == old_reads) | (np.isnan(reads) & np.isnan(old_reads)))
+			if tie.any():
+				tied = new[tie]
+				old = frame[frame['sample'].isin(set(tied['sample']))].set_index('sample').loc[tied['sample'].values]
+				new_key = list(zip(tied['year'].astype(str), tied['batch']))
+				old_key = list(zip(old['year'].astype(str), old['batch']))
+				if any(a == b for a, b in zip(new_key, old_key)):
+					self.load()
+					return None
+				take[tie] = [a > b for a, b in zip(new_key, old_key)]
+			winners = new[take]
+
+			# 이미 있는 샘플은 기존 값이 NA 여도 이전 행을 뺀다
+			replaced = frame['sample'].isin(set(winners['sample']) & set(self._best.index))
+			removed = frame[replaced]
+			batches = set(winners['batch']) | set(removed['batch'])
+			frame = concat_typed([frame[~replaced], winners])
+
+			best = pd.Series(reads[take], index=winners['sample'].values)
+			self._best = pd.concat([self._best.drop(best.index, errors='ignore'), best])
+			self._publish(frame, batches, winners, removed)
+			return batches
+
+	def poll(self):
+		# 폴더를 한 번 확인. 새 파일만 있으면 병합, 기존 파일이 바뀌거나 지워졌으면 전체 reload
+		with self.lock:
+			found = self._scan()
+			changed = [key for key in self._seen if key not in found or found[key][2:] != self._seen[key]]
+			if changed:
+				self.load()
+				return None
+
+			now = time.time()
+			year_files = {}
+			for key, (year, i, size, mtime) in found.items():
+				# 복사 중인 파일은 다음 확인 때 읽음
+				if key not in self._seen and now - mtime / 1e9 >= self.settle:
+					year_files.setdefault(year, []).append(i)
+			if not year_files:
+				return set()
+
+			new = self._read(year_files)
+			for files in year_files.values():
+				for i in files:
+					self._seen[_cache_key(i)] = found[_cache_key(i)][2:]
+			return self.merge(new)
+
+	def _publish(self, frame, batches, added, removed):
+		self.frame = frame
+		self.version += 1
+		self.fingerprint = dataset_fingerprint(self._seen, self.cache_dir)
+		for fn in self._listeners:
+			fn(frame, batches, added, removed)
+
+	def start_polling(self, interval=30):
+		# 백그라운드 스레드에서 interval 초마다 poll()
+		def run():
+			while True:
+				time.sleep(interval)
+				try:
+					self.poll()
+				except Exception as e:
+					print("report polling failed:", repr(e), file=sys.stderr)
+
+		if self._thread is None and interval > 0:
+			self._thread = threading.Thread(target=run, name="report-poller", daemon=True)
+			self._thread.start()
+
+
+def dataset_fingerprint(keys, cache_dir=CACHE_DIR):
+	# 레포트 경로 + 내용 sha1 (캐시 manifest) + CACHE_VERSION 으로 만든 데이터셋 식별자
+	# version 은 프로세스마다 1 부터 다시 세므로, 재시작 뒤에도 남는 파일은 이 값으로 구분
+	files = read_manifest(cache_dir)
+	sources = sorted((key, files.get(key, {}).get('sha1')) for key in keys)
+	return hashlib.sha1(json.dumps([CACHE_VERSION, sources]).encode()).hexdigest()[:16]
+
+
+# ===== SHARED SNAPSHOT ===== #
+# gunicorn worker 여러 개가 데이터셋을 한 번만 만들어 같이 쓰도록, 정리된 데이터프레임을
+# 열별 .npy 파일로 저장해 두고 worker 는 읽기 전용 memory-map 으로 연다 (OS page cache 공유).
+# <cache_dir>/snapshot/current 가 최신 snapshot 폴더 이름과 version 을 가리킨다.
+
+def _snapshot_root(cache_dir):
+	return os.path.join(cache_dir, "snapshot")
+
+def read_snapshot_pointer(cache_dir=CACHE_DIR):
+	try:
+		with open(os.path.join(_snapshot_root(cache_dir), "current")) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+def write_snapshot(frame, cache_dir=CACHE_DIR, fingerprint=None):
+	# frame 을 partition (year) 별 batch 순으로 저장하고 current 를 새 snapshot 으로 바꾼 뒤 version 을 반환
+	root = _snapshot_root(cache_dir)
+	os.makedirs(root, exist_ok=True)
+	current = read_snapshot_pointer(cache_dir)
+	version = (current['version'] if current else 0) + 1
+	name = "v%d-%d" % (version, os.getpid())
+	tmp = os.path.join(root, name + ".tmp")
+	os.makedirs(tmp)
+
+	# FilterEngine 이 partition 순 정렬을 다시 하지 않도록 (정렬하면 worker 마다 복사본이 생김)
+	from covid_index import partition_order
+	order = partition_order(frame)
+	if order is not None:
+		frame = frame.iloc[order]
+	np.save(os.path.join(tmp, "index.npy"), frame.index.values)
+	columns = []
+	for n, column in enumerate(frame.columns):
+		s = frame[column]
+		meta = {'name': column, 'dtype': str(s.dtype)}
+		path = os.path.join(tmp, "%d" % n)
+		if isinstance(s.dtype, pd.CategoricalDtype):
+			np.save(path + ".codes.npy", s.cat.codes.values)
+			meta['categories'] = s.cat.categories.tolist()
+		elif isinstance(s.dtype, pd.api.extensions.ExtensionDtype):
+			# nullable 숫자 열: 값 + 결측 mask
+			np.save(path + ".npy", s.to_numpy(dtype=s.dtype.numpy_dtype, na_value=0))
+			np.save(path + ".mask.npy", s.isna().to_numpy())
+		elif s.dtype == object:
+			np.save(path + ".npy", s.to_numpy(dtype=str))
+		else:
+			np.save(path + ".npy", s.to_numpy())
+		columns.append(meta)
+	with open(os.path.join(tmp, "meta.json"), 'w') as f:
+		json.dump({'version': version, 'fingerprint': fingerprint, 'rows': len(frame), 'columns': columns}, f, ensure_ascii=False)
+	os.rename(tmp, os.path.join(root, name))
+
+	pointer = os.path.join(root, "current.%d.%d.tmp" % (os.getpid(), threading.get_ident()))
+	with open(pointer, 'w') as f:
+		json.dump({'name': name, 'version': version}, f)
+	os.replace(pointer, os.path.join(root, "current"))
+
+	# 바로 전 snapshot 은 아직 여는 중인 worker 가 있을 수 있으니 남겨 둠
+	# (이미 memory-map 된 파일은 지워도 worker 가 unmap 할 때까지 유지됨)
+	keep = {name, current['name']} if current else {name}
+	for old in os.listdir(root):
+		path = os.path.join(root, old)
+		if os.path.isdir(path) and old not in keep and not old.endswith(".tmp"):
+			shutil.rmtree(path, ignore_errors=True)
+	return version
+
+def open_snapshot(cache_dir=CACHE_DIR):
+	# current snapshot 을 memory-map 으로 열어 (frame, version, fingerprint) 반환
+	current = read_snapshot_pointer(cache_dir)
+	if current is None:
+		raise FileNotFoundError("no dataset snapshot in %s (run: python covid_data.py snapshot)" % _snapshot_root(cache_dir))
+	folder = os.path.join(_snapshot_root(cache_dir), current['name'])
+	with open(os.path.join(folder, "meta.json")) as f:
+		meta = json.load(f)
+
+	def load(name):
+		return np.load(os.path.join(folder, name), mmap_mode='r')
+
+	out = {}
+	for n, column in enumerate(meta['columns']):
+		dtype = column['dtype']
+		if dtype == 'category':
+			out[column['name']] = pd.Categorical.from_codes(load("%d.codes.npy" % n), categories=column['categories'])
+		elif dtype in ('Int32', 'Int64'):
+			out[column['name']] = pd.arrays.IntegerArray(load("%d.npy" % n), load("%d.mask.npy" % n))
+		elif dtype in ('Float32', 'Float64'):
+			out[column['name']] = pd.arrays.FloatingArray(load("%d.npy" % n), load("%d.mask.npy" % n))
+		elif dtype == 'object':
+			# 문자열 열(sample)만 worker 마다 object 로 복사됨
+			out[column['name']] = load("%d.npy" % n).astype(object)
+		else:
+			out[column['name']] = load("%d.npy" % n)
+	frame = pd.DataFrame(out, index=pd.Index(load("index.npy")), copy=False)
+	return frame, meta['version'], meta.get('fingerprint')
+
+
+class SharedDataset:
+	# LiveDataset 과 같은 인터페이스로 snapshot 을 읽는 worker 쪽 데이터셋.
+	# 레포트를 직접 읽지 않고 current 가 바뀌면 새 snapshot 을 다시 연다 (전체 reload).
+	def __init__(self, cache_dir=CACHE_DIR):
+		self.cache_dir = cache_dir
+		self.frame = None
+		self.version = 0
+		self.fingerprint = None
+		self.lock = threading.RLock()
+		self._listeners = []
+		self._thread = None
+
+	def on_change(self, fn):
+		self._listeners.append(fn)
+
+	def load(self):
+		with self.lock:
+			frame, version, fingerprint = open_snapshot(self.cache_dir)
+			self.frame = frame
+			self.version = version
+			# fingerprint 없이 쓴 예전 snapshot 이면 snapshot version 으로 (그 snapshot 폴더에서만 유효)
+			self.fingerprint = fingerprint or "snapshot-%d" % version
+			for fn in self._listeners:
+				fn(frame, None, None, None)
+		return frame
+
+	def poll(self):
+		with self.lock:
+			current = read_snapshot_pointer(self.cache_dir)
+			if current is not None and current['version'] != self.version:
+				self.load()
+				return None
+			return set()
+
+	def start_polling(self, interval=30):
+		def run():
+			while True:
+				time.sleep(interval)
+				try:
+					self.poll()
+				except Exception as e:
+					print("snapshot polling failed:", repr(e), file=sys.stderr)
+
+		if self._thread is None and interval > 0:
+			self._thread = threading.Thread(target=run, name="snapshot-poller", daemon=True)
+			self._thread.start()
+
+
+# ===== REPORT CACHE ===== #
+# 파일 경로별로 (size, mtime, sha1) 과 정리된 데이터프레임을 저장해 두고,
+# 바뀐 파일만 다시 읽는다. 데이터 파일 이름은 sha1 이라 내용이 같은 파일은 공유한다.
+
+def _cache_key(path):
+	return os.path.normpath(os.path.abspath(path))
+
+def _file_sha1(path):
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+def _manifest_path(cache_dir):
+	return os.path.join(cache_dir, "manifest.json")
+
+# 캐시 항목 데이터 파일 이름 (<sha1>.parquet / <sha1>.pkl). evict_stale 은 이 이름의 파일만 지움
+CACHE_ENTRY_PATTERN = re.compile(r"^[0-9a-f]{40}\.(?:parquet|pkl)$")
+
+def _entry_path(cache_dir, entry):
+	return os.path.join(cache_dir, entry['sha1'] + "." + entry['format'])
+
+def read_manifest(cache_dir=CACHE_DIR):
+	try:
+		with open(_manifest_path(cache_dir)) as f:
+			manifest = json.load(f)
+	except (OSError, ValueError):
+		return {}
+	if manifest.get('version') != CACHE_VERSION:
+		return {}
+	return manifest.get('files', {})
+
+def write_manifest(files, cache_dir=CACHE_DIR):
+	os.makedirs(cache_dir, exist_ok=True)
+	tmp = _manifest_path(cache_dir) + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+	with open(tmp, 'w') as f:
+		json.dump({'version': CACHE_VERSION, 'files': files}, f, ensure_ascii=False, indent=1)
+	os.replace(tmp, _manifest_path(cache_dir))
+
+def _write_entry(df, path):
+	tmp = path + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+	if path.endswith(".parquet"):
+		df.to_parquet(tmp, index=False)
+	else:
+		df.to_pickle(tmp)
+	os.replace(tmp, path)
+
+def _read_entry(path):
+	if path.endswith(".parquet"):
+		return pd.read_parquet(path)
+	return pd.read_pickle(path)
+
+def cache_status(path, files):
+	# 캐시 항목 상태를 반환: 'fresh' / 'stale' / 'missing'
+	# size, mtime 이 같으면 해시 계산 없이 fresh 로 본다
+	entry = files.get(_cache_key(path))
+	if entry is None:
+		return 'missing', None
+	st = os.stat(path)
+	if entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+		return 'fresh', entry
+	sha1 = _file_sha1(path)
+	if sha1 == entry['sha1']:
+		# touch 등으로 mtime 만 바뀐 경우
+		entry = dict(entry, size=st.st_size, mtime=st.st_mtime_ns)
+		return 'fresh', entry
+	return 'stale', None
+
+def load_reports(file_list, cache_dir=CACHE_DIR, workers=INGEST_WORKERS):
+	# 파일별 데이터프레임 리스트를 반환. 캐시에 있으면 캐시를 읽고, 없거나 바뀐 파일만 read_report() 로 다시 읽는다
+	# 다시 읽어야 하는 파일은 workers 개의 프로세스에서 병렬로 파싱
+	global ingest_timings
+	timings = []
+	frames = [None] * len(file_list)
+	files = read_manifest(cache_dir) if cache_dir is not None else {}
+	updated = {}
+	misses = []
+	for n, i in enumerate(file_list):
+		start = time.perf_counter()
+		state, entry = cache_status(i, files) if cache_dir is not None else ('missing', None)
+		if state == 'fresh' and os.path.exists(_entry_path(cache_dir, entry)):
+			if files[_cache_key(i)] != entry:
+				updated[_cache_key(i)] = entry
+			frames[n] = _read_entry(_entry_path(cache_dir, entry))
+			timings.append((i, 'cache', len(frames[n]), time.perf_counter() - start))
+			metrics.observe('covid_ingest_file_seconds', timings[-1][3], source='cache')
+		else:
+			misses.append(n)
+
+	parsed = parse_reports([file_list[n] for n in misses], workers)
+	for n, (df, seconds) in zip(misses, parsed):
+		frames[n] = df
+		timings.append((file_list[n], 'parsed', len(df), seconds))
+		metrics.observe('covid_ingest_file_seconds', seconds, source='parsed')
+		if cache_dir is None:
+			continue
+		i = file_list[n]
+		st = os.stat(i)
+		entry = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': _file_sha1(i), 'format': CACHE_FORMAT, 'rows': len(df)}
+		os.makedirs(cache_dir, exist_ok=True)
+		_write_entry(df, _entry_path(cache_dir, entry))
+		updated[_cache_key(i)] = entry
+
+	if updated:
+		# 다른 프로세스가 그 사이 기록한 항목을 덮어쓰지 않도록 다시 읽어서 병합
+		files = read_manifest(cache_dir)
+		files.update(updated)
+		write_manifest(files, cache_dir)
+	ingest_timings = timings
+	return frames
+
+def evict_stale(cache_dir=CACHE_DIR):
+	# 원본 레포트가 삭제된 캐시 항목을 지우고, 지운 경로 리스트를 반환
+	files = read_manifest(cache_dir)
+	removed = [key for key in files if not os.path.exists(key)]
+	for key in removed:
+		del files[key]
+	if removed:
+		write_manifest(files, cache_dir)
+
+	# 어떤 항목도 참조하지 않는 데이터 파일 정리 (store / export 등 캐시 폴더의 다른 파일은 건드리지 않음)
+	used = set(os.path.basename(_entry_path(cache_dir, e)) for e in files.values())
+	for name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+		path = os.path.join(cache_dir, name)
+		if CACHE_ENTRY_PATTERN.match(name) and name not in used and os.path.isfile(path):
+			os.remove(path)
+	return removed
+
+def report_files(root=REPORT_ROOT):
+	# root 아래 모든 partition 폴더의 레포트 파일 리스트
+	return sorted(i for folder in report_partitions(root).values() for i in glob.glob(os.path.join(folder, "*xlsx")))
+
+
+# ===== CLI ===== #
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="SARS-CoV report cache")
+	parser.add_argument('command', choices=['check', 'rebuild', 'memory', 'parser', 'snapshot'])
+	parser.add_argument('--root', default=REPORT_ROOT, help="report folder root (default: %(default)s)")
+	parser.add_argument('--cache-dir', default=CACHE_DIR, help="cache folder (default: %(default)s)")
+	parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help="parser processes (default: %(default)s)")
+	parser.add_argument('--poll', type=int, default=0, help="snapshot: re-check reports every N seconds (default: once)")
+	args = parser.parse_args(argv)
+
+	if args.command == 'snapshot':
+		dataset = LiveDataset(args.root, args.cache_dir, args.workers)
+		dataset.on_change(lambda frame, *changes: print("snapshot v%d (%d samples)" % (write_snapshot(frame, args.cache_dir, dataset.fingerprint), len(frame)), flush=True))
+		dataset.load()
+		# worker 는 샘플 store 를 읽기만 하므로 여기서 sync (바뀐 레포트만 다시 넣음)
+		from covid_store import SampleStore, STORE_ENABLED
+		store = SampleStore() if STORE_ENABLED else None
+		if store is not None:
+			store.sync(dataset.folders, args.cache_dir, args.workers)
+		# 레포트 읽기 단계 시간을 worker 의 /metrics 에 합쳐서 보이도록
+		if covid_metrics.METRICS_DIR:
+			covid_metrics.save(force=True)
+		while args.poll > 0:
+			time.sleep(args.poll)
+			dataset.poll()
+			if store is not None:
+				store.sync(dataset.folders, args.cache_dir, args.workers)
+			if covid_metrics.METRICS_DIR:
+				covid_metrics.save(force=True)
+		return 0
+
+	file_list = report_files(args.root)
+	if args.command == 'parser':
+		report = parser_report(file_list)
+		pd.set_option('display.width', 200)
+		print(report.to_string(float_format=lambda x: "%.1f" % x))
+		print("total: read_excel %.2fs, stream %.2fs (%.1fx), median per-file speedup %.1fx, %d file(s) differ" % (
+			report['read_excel_ms'].sum() / 1000, report['stream_ms'].sum() / 1000, report['read_excel_ms'].sum() / report['stream_ms'].sum(),
+			report['speedup'].median(), (~report['same']).sum()))
+		return 0 if report['same'].all() else 1
+
+	if args.command == 'memory':
+		report = memory_report(file_list, args.cache_dir)
+		pd.set_option('display.width', 200)
+		print(report.to_string(float_format=lambda x: "%.1f" % x))
+		return 0
+
+	if args.command == 'rebuild':
+		if os.path.exists(_manifest_path(args.cache_dir)):
+			os.remove(_manifest_path(args.cache_dir))
+		start = time.perf_counter()
+		load_reports(file_list, args.cache_dir, args.workers)
+		evict_stale(args.cache_dir)
+		print("rebuilt %d report(s) in %s (%.1fs, %d workers)" % (len(file_list), args.cache_dir, time.perf_counter() - start, args.workers))
+		print(ingest_report().head(10).to_string(index=False))
+		return 0
+
+	files = read_manifest(args.cache_dir)
+	counts = {'fresh': 0, 'stale': 0, 'missing': 0}
+	for i in file_list:
+		state, _ = cache_status(i, files)
+		counts[state] += 1
+		if state != 'fresh':
+			print("%-7s %s" % (state, i))
+	orphans = [key for key in files if not os.path.exists(key)]
+	for key in orphans:
+		print("%-7s %s" % ('orphan', key))
+	print("fresh=%(fresh)d stale=%(stale)d missing=%(missing)d" % counts, "orphan=%d" % len(orphans))
+	return 0 if counts['stale'] == counts['missing'] == len(orphans) == 0 else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
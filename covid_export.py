@@ -0,0 +1,71 @@
+# 데이터 테이블 다운로드 (CSV / Excel)
+#
+# - CSV 는 CSV_CHUNK_ROWS 행씩 잘라서 스트리밍 (전체 문자열을 메모리에 만들지 않음)
+# - 전체 데이터 CSV 는 데이터셋 버전마다 한 번만 만들어 두고 재사용
+# - Excel 은 작업 큐 (covid_jobs.JobQueue) 의 프로세스에서 openpyxl write-only 모드로 파일에 쓰고, 끝나면 다운로드
+
+import os
+import threading
+from covid_data import CACHE_DIR
+
+
+EXPORT_DIR = os.path.join(CACHE_DIR, "exports")
+CSV_CHUNK_ROWS = 50000
+# Excel 을 쓸 때 진행률을 알리는 행 간격
+EXCEL_CHUNK_ROWS = 5000
+
+
+def csv_chunks(frame, rows=None, chunk_rows=CSV_CHUNK_ROWS):
+	# frame.iloc[rows] 를 to_csv 와 같은 형식(index 포함)으로 chunk_rows 행씩 생성
+	if rows is None:
+		rows = range(len(frame))
+	yield frame.iloc[:0].to_csv()
+	for start in range(0, len(rows), chunk_rows):
+		yield frame.iloc[rows[start:start + chunk_rows]].to_csv(header=False)
+
+
+def _write_atomic(path, write):
+	tmp = path + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+	try:
+		write(tmp)
+		os.replace(tmp, path)
+	finally:
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+
+def full_csv(frame, fingerprint, export_dir=EXPORT_DIR):
+	# 데이터셋 (LiveDataset.fingerprint) 별 전체 CSV 경로 (없으면 만들고, 다른 데이터셋의 파일은 지움)
+	# 프로세스마다 다시 세는 version 이 아니라 레포트 내용 기준이라 재시작 뒤에 예전 파일을 쓰지 않음
+	os.makedirs(export_dir, exist_ok=True)
+	path = os.path.join(export_dir, "full-%s.csv" % fingerprint)
+	if not os.path.exists(path):
+		def write(tmp):
+			with open(tmp, 'w', encoding='utf-8', newline='') as f:
+				for chunk in csv_chunks(frame):
+					f.write(chunk)
+		_write_atomic(path, write)
+		for name in os.listdir(export_dir):
+			if name.startswith("full-") and name.endswith(".csv") and name != os.path.basename(path):
+				os.remove(os.path.join(export_dir, name))
+	return path
+
+
+def write_excel(path, frame, rows=None, chunk_rows=EXCEL_CHUNK_ROWS, progress=None):
+	# to_excel 과 같은 배치 (첫 열 index) 로 write-only 워크북에 행 단위로 씀
+	# progress(done, total, message): chunk_rows 행마다 진행률 (covid_jobs.Progress)
+	# openpyxl 은 import 가 무거워서 (0.1 초) Excel 을 처음 만들 때 import
+	from openpyxl import Workbook
+	wb = Workbook(write_only=True)
+	ws = wb.create_sheet("Sheet1")
+	ws.append([None] + list(frame.columns))
+	if rows is None:
+		rows = range(len(frame))
+	for start in range(0, len(rows), chunk_rows):
+		chunk = frame.iloc[rows[start:start + chunk_rows]].astype(object)
+		chunk = chunk.where(chunk.notna(), None)
+		for row in chunk.itertuples(name=None):
+			ws.append(row)
+		if progress is not None:
+			progress(start + len(chunk), len(rows) + 1, "writing rows")
+	wb.save(path)
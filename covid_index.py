@@ -0,0 +1,447 @@
+# COVID 데이터프레임 필터/집계용 인덱스 모듈
+
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from covid_metrics import stage, timed_stage
+
+
+def _pack(mask):
+	return np.packbits(np.asarray(mask, dtype=bool))
+
+
+def normalize_filter(year, clade, cov, qc, batch):
+	# 콜백 입력값을 캐시 키로 쓸 수 있는 튜플로 정규화
+	# 체크리스트는 'All' 이 있으면 순서와 상관없이 'All' 로 본다
+	def checklist(values):
+		values = values or []
+		return 'All' if 'All' in values else tuple(sorted(values))
+	return (str(year), checklist(clade), str(cov), checklist(qc), batch[0], batch[1])
+
+
+# ===== PARTITIONS ===== #
+# year 값 하나가 partition 하나 (input_report_files/ 아래 폴더). 행을 (year, batch) 순으로 두면
+# partition 마다 연속 구간이 되고 그 안은 batch 순이다.
+
+def _partition_keys(frame):
+	codes, names = pd.factorize(frame['year'].astype(str).values, sort=True)
+	return codes, names, frame['batch'].values
+
+def partition_order(frame):
+	# frame 을 (year, batch) 순으로 두는 행 위치 (이미 그 순서면 None)
+	codes, names, batch = _partition_keys(frame)
+	step = np.diff(codes)
+	if ((step > 0) | ((step == 0) & (np.diff(batch) >= 0))).all():
+		return None
+	return np.lexsort((batch, codes))
+
+
+# ===== FILTER ENGINE ===== #
+# 데이터프레임을 partition (year) 별 batch 순으로 정렬해 두고, QC / clade(etc 묶음) / coverage 값마다
+# 비트맵(np.packbits)을 미리 만들어 둔다. partition 마다 batch 범위, 행 수, clade 집합을 두어서
+# year / batch 범위 / clade 로 걸러지는 partition 은 통째로 건너뛰고, 남은 partition 의 batch 구간
+# 바이트만 AND 해서 행 위치를 구한다 (년도가 늘어도 한 해 보기의 비용은 그대로).
+# 필터 결과는 LRU 로 캐시해서 같은 입력으로 동시에 불리는 콜백들이 한 번 계산한 결과를 같이 쓴다.
+
+class FilterEngine:
+	def __init__(self, frame, clade_map=None, maxsize=128):
+		# frame: covid 데이터프레임, clade_map: {'20C': 'etc', ...} clade 묶음
+		# 이미 (year, batch) 순이면 (snapshot) 복사하지 않음
+		order = partition_order(frame)
+		if order is not None:
+			frame = frame.iloc[order]
+		self.frame = frame
+		self.n = len(frame)
+		self.maxsize = maxsize
+		self._memo = OrderedDict()
+		self._lock = threading.Lock()
+
+		frame = self.frame
+		self.batch = frame['batch'].values
+		self.qc = self._bitmaps(frame['QC'].astype(str))
+		clades = frame['clade'].replace(clade_map or {}).astype(str)
+		self.clade = self._bitmaps(clades)
+		# coverage 필터는 P/F 열 기준 (coverage 가 NA 면 Fail 이라 '<90%'). CountCube / 브라우저 필터링과 같은 규칙
+		pf = frame['P/F'].astype(str).values
+		self.cov = {'>=90%': _pack(pf == 'Pass'), '<90%': _pack(pf == 'Fail')}
+
+		# partition 별 [start, end) 구간과 통계
+		codes, names, batch = _partition_keys(frame)
+		bounds = np.searchsorted(codes, np.arange(len(names) + 1))
+		clades = clades.values
+		self.partitions = []
+		for name, start, end in zip(names, bounds[:-1], bounds[1:]):
+			self.partitions.append({'name': name, 'start': int(start), 'end': int(end), 'rows': int(end - start),
+									'batch_min': int(batch[start]), 'batch_max': int(batch[end - 1]),
+									'clades': frozenset(clades[start:end])})
+
+	def _bitmaps(self, values):
+		codes, uniques = pd.factorize(values)
+		return {value: _pack(codes == n) for n, value in enumerate(uniques)}
+
+	def _union(self, bitmaps, values, b0, b1):
+		out = np.zeros(b1 - b0, dtype=np.uint8)
+		for value in values:
+			if value in bitmaps:
+				out |= bitmaps[value][b0:b1]
+		return out
+
+	def _cached(self, key, compute):
+		with self._lock:
+			if key in self._memo:
+				self._memo.move_to_end(key)
+				return self._memo[key]
+		value = compute()
+		with self._lock:
+			self._memo[key] = value
+			while len(self._memo) > self.maxsize:
+				self._memo.popitem(last=False)
+		return value
+
+	def partition_stats(self):
+		# partition 별 행 수 / batch 범위 / clade 목록
+		return [dict(p, clades=sorted(p['clades'])) for p in self.partitions]
+
+	def batch_ranges(self, year, clade, lo, hi):
+		# year / batch [lo, hi] / clade 선택과 겹칠 수 있는 partition 들의 batch 구간 [start, end) 리스트
+		ranges = []
+		for p in self.partitions:
+			if (year != 'All' and p['name'] != year) or p['batch_max'] < lo or p['batch_min'] > hi:
+				continue
+			if clade != 'All' and p['clades'].isdisjoint(clade):
+				continue
+			batch = self.batch[p['start']:p['end']]
+			start = p['start'] + np.searchsorted(batch, lo, side='left')
+			end = p['start'] + np.searchsorted(batch, hi, side='right')
+			if start < end:
+				ranges.append((int(start), int(end)))
+		return ranges
+
+	def _range_rows(self, start, end, clade, cov, qc):
+		# [start, end) 구간에서 coverage / QC / clade 를 통과한 행 위치
+		if clade == qc == 'All' and cov not in self.cov:
+			return np.arange(start, end)
+		b0, b1 = start // 8, (end + 7) // 8
+		bits = np.full(b1 - b0, 0xff, dtype=np.uint8)
+		if cov in self.cov:
+			bits &= self.cov[cov][b0:b1]
+		if qc != 'All':
+			bits &= self._union(self.qc, qc, b0, b1)
+		if clade != 'All':
+			bits &= self._union(self.clade, clade, b0, b1)
+		# 0 이 아닌 바이트만 풀어서 행 위치로 변환
+		nz = np.flatnonzero(bits)
+		hit = np.unpackbits(bits[nz]).reshape(-1, 8).astype(bool)
+		rows = ((nz + b0) * 8)[:, None] + np.arange(8)
+		rows = rows[hit]
+		return rows[(rows >= start) & (rows < end)]
+
+	def rows(self, year, clade, cov, qc, batch):
+		# year / batch / clade 로 partition 을 고르고, 남은 구간에서 coverage -> QC -> clade 필터를 통과한 행 위치
+		# (self.frame 기준, partition 순 -> batch 순)
+		year, clade, cov, qc, lo, hi = normalize_filter(year, clade, cov, qc, batch)
+		def compute():
+			ranges = self.batch_ranges(year, clade, lo, hi)
+			with stage('filter', sum(end - start for start, end in ranges)) as record:
+				parts = [self._range_rows(start, end, clade, cov, qc) for start, end in ranges]
+				rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+				rows.setflags(write=False)
+				record['rows_out'] = len(rows)
+			return rows
+		return self._cached((year, clade, cov, qc, lo, hi), compute)
+
+	def filter(self, year, clade, cov, qc, batch):
+		# 필터를 통과한 데이터프레임 (batch 순)
+		return self.frame.iloc[self.rows(year, clade, cov, qc, batch)]
+
+	def sort_rank(self, column):
+		# column 값의 순위 (같은 값은 같은 순위, 빈 값은 마지막). 처음 요청될 때 만들어 캐시
+		def compute():
+			values = self.frame[column]
+			try:
+				codes, uniques = pd.factorize(values, sort=True)
+			except TypeError:
+				# 숫자와 문자열이 섞인 열은 문자열로 비교
+				codes, uniques = pd.factorize(values.astype(str), sort=True)
+			rank = np.where(codes < 0, len(uniques), codes)
+			rank.setflags(write=False)
+			return rank
+		return self._cached(('rank', column), compute)
+
+	def sort_order(self, column):
+		# column 기준으로 정렬한 전체 행 위치
+		return self._cached(('order', column), lambda: np.argsort(self.sort_rank(column), kind='stable'))
+
+	@timed_stage('sort')
+	def sort_rows(self, rows, sort_by):
+		# rows 를 DataTable sort_by ([{'column_id': ..., 'direction': 'asc'|'desc'}, ...]) 순서로 정렬
+		if not sort_by:
+			return rows
+		if len(sort_by) == 1 and len(rows) > self.n // 8:
+			# 결과가 크면 미리 만든 전체 정렬 순서에서 골라냄 (O(n))
+			order = self.sort_order(sort_by[0]['column_id'])
+			mask = np.zeros(self.n, dtype=bool)
+			mask[rows] = True
+			order = order[mask[order]]
+			return order[::-1] if sort_by[0]['direction'] == 'desc' else order
+		keys = []
+		for sort in reversed(sort_by):
+			rank = self.sort_rank(sort['column_id'])[rows]
+			keys.append(-rank if sort['direction'] == 'desc' else rank)
+		return rows[np.lexsort(keys)]
+
+
+# ===== COUNT CUBE ===== #
+# batch x (clade, pango) x QC x year x P/F 샘플 수를 미리 세어 둔 배열.
+# clade / pass-fail / sunburst 집계는 이 배열을 잘라서 더하기만 하므로
+# 샘플 수가 아니라 batch 수에 비례하는 비용으로 만들어진다.
+# (clade, pango) 축은 etc 로 묶은 clade 축으로 합쳐서 쓴다.
+# batch 축 누적합(cumulative)도 같이 두어서 batch 범위 합계는 batch 수와 상관없이
+# cumulative[end] - cumulative[start] 한 번으로 구한다.
+
+PF_LABELS = ['Fail', 'Pass']
+
+def _cov_select(counts, cov):
+	# 마지막 축이 P/F 인 배열에서 coverage 필터에 맞지 않는 쪽을 0 으로
+	if cov == '>=90%':
+		counts = counts * np.array([0, 1])
+	elif cov == '<90%':
+		counts = counts * np.array([1, 0])
+	return counts
+
+class CountCube:
+	def __init__(self, frame, clade_map=None):
+		self.clade_map = dict(clade_map or {})
+		self.batches = np.array([], dtype=np.int64)
+		self.pairs = []
+		self.qcs = []
+		self.years = []
+		self._index = {'pair': {}, 'QC': {}, 'year': {}}
+		self.counts = np.zeros((0, 0, 0, 0, len(PF_LABELS)), dtype=np.int32)
+		self._cumulative = None
+		self._update_clades()
+		self.add(frame)
+
+	def copy(self):
+		cube = CountCube.__new__(CountCube)
+		cube.__dict__.update(self.__dict__)
+		cube.pairs, cube.qcs, cube.years = list(self.pairs), list(self.qcs), list(self.years)
+		cube._index = {k: dict(v) for k, v in self._index.items()}
+		cube.counts = self.counts.copy()
+		cube._cumulative = None
+		return cube
+
+	def _grow(self, axis, pos, size):
+		# counts 의 axis 축을 size 로 늘리고 기존 값은 pos 위치로 옮김
+		shape = list(self.counts.shape)
+		shape[axis] = size
+		out = np.zeros(shape, dtype=self.counts.dtype)
+		sl = [slice(None)] * out.ndim
+		sl[axis] = pos
+		out[tuple(sl)] = self.counts
+		self.counts = out
+
+	def _labels(self, name, labels, values):
+		# values 를 축 인덱스로 바꾸고, 처음 보는 값이면 축을 늘림
+		codes, uniques = pd.factorize(values)
+		index = self._index[name]
+		new = [v for v in uniques if v not in index]
+		if new:
+			for v in new:
+				index[v] = len(labels)
+				labels.append(v)
+			self._grow(('batch', 'pair', 'QC', 'year').index(name), np.arange(len(labels) - len(new)), len(labels))
+		return np.array([index[v] for v in uniques], dtype=np.int64)[codes]
+
+	def _update_clades(self):
+		self.pair_clade = np.array([p[0] for p in self.pairs], dtype=object)
+		self.pair_pango = np.array([p[1] for p in self.pairs], dtype=object)
+		collapsed = np.array([self.clade_map.get(c, c) for c in self.pair_clade], dtype=object)
+		self.clades, self.pair_group = np.unique(collapsed, return_inverse=True) if len(collapsed) else (np.array([], dtype=object), np.array([], dtype=np.int64))
+
+	def add(self, rows, sign=1):
+		# rows 의 샘플을 더함 (sign=-1 이면 뺌)
+		if rows is None or len(rows) == 0:
+			return
+		batch = rows['batch'].values.astype(np.int64)
+		new = np.setdiff1d(batch, self.batches)
+		if len(new):
+			merged = np.union1d(self.batches, new)
+			self._grow(0, np.searchsorted(merged, self.batches), len(merged))
+			self.batches = merged
+		b = np.searchsorted(self.batches, batch)
+		p = self._labels('pair', self.pairs, pd.Series(list(zip(rows['clade'].astype(str), rows['pango'].astype(str))), dtype=object))
+		q = self._labels('QC', self.qcs, rows['QC'].astype(str))
+		y = self._labels('year', self.years, rows['year'].astype(str))
+		f = (rows['P/F'].astype(str).values == 'Pass').astype(np.int64)
+		np.add.at(self.counts, (b, p, q, y, f), sign)
+		self._cumulative = None
+		self._update_clades()
+
+	@property
+	def cumulative(self):
+		# batch 축 누적합, cumulative[i] = counts[:i].sum(axis=0)
+		cumulative = self._cumulative
+		if cumulative is None:
+			cumulative = np.zeros((self.counts.shape[0] + 1,) + self.counts.shape[1:], dtype=np.int64)
+			np.cumsum(self.counts, axis=0, out=cumulative[1:])
+			self._cumulative = cumulative
+		return cumulative
+
+	def _range_total(self, year, qc, lo, hi):
+		# batch 범위 [lo, hi] 합계를 누적합 차이로 구한 (pair, P/F) 샘플 수
+		start, end = np.searchsorted(self.batches, lo, side='left'), np.searchsorted(self.batches, hi, side='right')
+		cumulative = self.cumulative
+		total = cumulative[end] - cumulative[start]
+		if year != 'All':
+			total = total[:, :, [self._index['year'][year]] if year in self._index['year'] else []]
+		if qc != 'All':
+			total = total[:, [self._index['QC'][v] for v in qc if v in self._index['QC']]]
+		return total.sum(axis=(1, 2))
+
+	@timed_stage('aggregate')
+	def summary(self, year, clade, cov, qc, batch):
+		# 필터 조건의 샘플 수 / Pass, Fail 수 / clade 별 샘플 수 (etc 묶음)
+		year, clade, cov, qc, lo, hi = normalize_filter(year, clade, cov, qc, batch)
+		total = self._range_total(year, qc, lo, hi) * self._pair_mask(clade)[:, None]
+		total = _cov_select(total, cov)
+		failed, passed = total.sum(axis=0)
+		by_clade = np.zeros(len(self.clades), dtype=np.int64)
+		np.add.at(by_clade, self.pair_group, total.sum(axis=1))
+		return {
+			'samples': int(passed + failed), 'pass': int(passed), 'fail': int(failed),
+			'pass_rate': passed / (passed + failed) if passed + failed else 0.0,
+			'clades': {c: int(n) for c, n in zip(self.clades, by_clade) if n},
+		}
+
+	def _slice(self, year, qc, lo, hi):
+		# batch 범위 [lo, hi] 와 year / QC 로 자른 (batch, pair, QC, year, P/F) 배열
+		start, end = np.searchsorted(self.batches, lo, side='left'), np.searchsorted(self.batches, hi, side='right')
+		cube = self.counts[start:end]
+		if year != 'All':
+			cube = cube[:, :, :, [self._index['year'][year]] if year in self._index['year'] else []]
+		if qc != 'All':
+			cube = cube[:, :, [self._index['QC'][v] for v in qc if v in self._index['QC']]]
+		return self.batches[start:end], cube
+
+	def _select(self, year, cov, qc, lo, hi):
+		# _slice() 에서 coverage(P/F) 까지 골라 더한 (batch, pair) 배열
+		batches, cube = self._slice(year, qc, lo, hi)
+		return batches, _cov_select(cube.sum(axis=(2, 3)), cov).sum(axis=2)
+
+	def _pair_mask(self, clade):
+		if clade == 'All':
+			return np.ones(len(self.pairs), dtype=bool)
+		return np.isin(self.clades[self.pair_group], list(clade)) if len(self.pairs) else np.zeros(0, dtype=bool)
+
+	def _by_clade(self, counts):
+		# (batch, pair) -> (batch, etc 로 묶은 clade)
+		out = np.zeros((counts.shape[0], len(self.clades)), dtype=np.int64)
+		np.add.at(out.T, self.pair_group, counts.T)
+		return out
+
+	@timed_stage('aggregate')
+	def clade_counts(self, year, clade, cov, qc, batch):
+		# groupby_clade() 와 같은 형식 (batch, clade, count, percent)
+		# clade 는 year/coverage/QC 조건에서 한 번이라도 나온 clade, batch 는 범위 안에서 샘플이 있는 batch
+		year, clade, cov, qc, lo, hi = normalize_filter(year, clade, cov, qc, batch)
+		total = _cov_select(self._range_total(year, qc, -np.inf, np.inf), cov).sum(axis=1)
+		present = self._by_clade(total[None, :])[0] > 0
+		batches, counts = self._select(year, cov, qc, lo, hi)
+		counts = self._by_clade(counts)[:, present]
+		keep = counts.sum(axis=1) > 0
+		batches, counts = batches[keep], counts[keep]
+		df = pd.DataFrame({
+			'batch': np.repeat(batches, counts.shape[1]),
+			'clade': np.tile(self.clades[present], len(batches)),
+			'count': counts.ravel(),
+		})
+		df['percent'] = (counts / counts.sum(axis=1, keepdims=True)).ravel() * 100
+		return df
+
+	@timed_stage('aggregate')
+	def passfail(self, year, clade, cov, qc, batch):
+		# batch x P/F 샘플 수 (batch, P/F, count)
+		year, clade, cov, qc, lo, hi = normalize_filter(year, clade, cov, qc, batch)
+		batches, cube = self._slice(year, qc, lo, hi)
+		counts = _cov_select(cube[:, self._pair_mask(clade)].sum(axis=(1, 2, 3)), cov)
+		keep = counts.sum(axis=1) > 0
+		pf = counts[keep].sum(axis=0) > 0
+		batches, counts = batches[keep], counts[keep][:, pf]
+		return pd.DataFrame({
+			'batch': np.repeat(batches, counts.shape[1]),
+			'P/F': np.tile(np.array(PF_LABELS, dtype=object)[pf], len(batches)),
+			'count': counts.ravel(),
+		})
+
+	@timed_stage('aggregate')
+	def pair_counts(self, year, clade, cov, qc, batch):
+		# (clade, pango) 쌍별 샘플 수 (self.pairs 순서)
+		year, clade, cov, qc, lo, hi = normalize_filter(year, clade, cov, qc, batch)
+		return _cov_select(self._range_total(year, qc, lo, hi), cov).sum(axis=1) * self._pair_mask(clade)
+
+	def sunburst(self, year, clade, cov, qc, batch):
+		# (clade, pango) 샘플 수 (clade, pango, count)
+		counts = self.pair_counts(year, clade, cov, qc, batch)
+		keep = counts > 0
+		return pd.DataFrame({'clade': self.pair_clade[keep], 'pango': self.pair_pango[keep], 'count': counts[keep]})
+
+
+# ===== PLOT REDUCTION ===== #
+# 샘플 수에 비례해서 커지던 figure 를 batch 수 / 행 상한에 비례하도록 줄인다.
+# box plot 은 batch 별 통계만 (q1 / median / q3 / fence + 상한 있는 outlier),
+# parallel coordinates 는 batch 순 행에서 일정 간격으로 뽑음 (batch 비율 유지)
+
+@timed_stage('reduce')
+def box_stats(batch, values, max_outliers=50):
+	# batch 별 box 통계 (plotly 기본값처럼 whisker 는 1.5 IQR 안의 가장 먼 값)
+	# 반환: (stats 데이터프레임, outlier batch, outlier 값). outlier 는 batch 마다 최대 max_outliers 개 (0 이하면 전체)
+	values = np.asarray(values, dtype=float)
+	batch = np.asarray(batch)
+	keep = ~np.isnan(values)
+	values, batch = values[keep], batch[keep]
+	order = np.lexsort((values, batch))
+	values, batch = values[order], batch[order]
+	if len(values) == 0:
+		empty = pd.DataFrame(columns=['batch', 'q1', 'median', 'q3', 'lowerfence', 'upperfence', 'count'])
+		return empty, batch, values
+
+	starts = np.flatnonzero(np.r_[True, batch[1:] != batch[:-1]])
+	counts = np.diff(np.r_[starts, len(values)])
+
+	def quantile(q):
+		# np.percentile(linear) 을 batch 별로 한 번에
+		pos = starts + q * (counts - 1)
+		lo = np.floor(pos).astype(np.int64)
+		hi = np.minimum(lo + 1, starts + counts - 1)
+		return values[lo] + (pos - lo) * (values[hi] - values[lo])
+
+	q1, median, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+	iqr = q3 - q1
+	group = np.repeat(np.arange(len(starts)), counts)
+	inside = (values >= (q1 - 1.5 * iqr)[group]) & (values <= (q3 + 1.5 * iqr)[group])
+	lowerfence = np.minimum.reduceat(np.where(inside, values, np.inf), starts)
+	upperfence = np.maximum.reduceat(np.where(inside, values, -np.inf), starts)
+	stats = pd.DataFrame({'batch': batch[starts], 'q1': q1, 'median': median, 'q3': q3,
+						  'lowerfence': lowerfence, 'upperfence': upperfence, 'count': counts})
+
+	# outlier: batch 마다 값 순으로 일정 간격으로 max_outliers 개까지 (양쪽 끝 값은 항상 포함)
+	out = np.flatnonzero(~inside)
+	out_group = group[out]
+	out_starts = np.flatnonzero(np.r_[True, out_group[1:] != out_group[:-1]]) if len(out) else out
+	out_counts = np.diff(np.r_[out_starts, len(out)])
+	picked = []
+	for start, count in zip(out_starts, out_counts):
+		if max_outliers <= 0 or count <= max_outliers:
+			picked.append(out[start:start + count])
+		else:
+			picked.append(out[start + np.unique(np.linspace(0, count - 1, max_outliers).round().astype(np.int64))])
+	out = np.concatenate(picked) if picked else out
+	return stats, batch[out], values[out]
+
+def decimate(rows, max_rows):
+	# batch 순 행 위치에서 일정 간격으로 최대 max_rows 개 (같은 입력이면 같은 결과)
+	if max_rows <= 0 or len(rows) <= max_rows:
+		return rows
+	return rows[np.linspace(0, len(rows) - 1, max_rows).round().astype(np.int64)]
@@ -0,0 +1,295 @@
+# 오래 걸리는 작업 (Excel 파일, 샘플이 많은 parallel coordinates figure) 을 요청 스레드 밖에서 실행하는 작업 큐
+#
+# - 브로커 없이 ProcessPoolExecutor (COVID_JOB_WORKERS 개 프로세스) 에서 실행해서, 무거운 작업이 도는 동안에도
+#   Flask worker 는 다른 사용자의 필터 콜백을 바로 처리한다 (GIL 을 같이 쓰지 않음)
+# - 같은 key (데이터셋 fingerprint + 필터 등) 는 같은 job id: 이미 끝났거나 진행 중이면 새로 만들지 않음
+#   job id 앞에 데이터셋 fingerprint 를 붙이고 (set_generation), 데이터셋이 바뀌면 다른 fingerprint 의 파일을 지워서
+#   재시작 뒤에도 예전 데이터로 만든 결과를 돌려주지 않음
+# - submit(..., replaces=이전 job id): 같은 화면에서 필터가 바뀌어 필요 없어진 작업은 취소
+#   (아직 시작 전이면 future 취소, 실행 중이면 <id>.cancel 파일을 보고 작업이 다음 progress() 에서 멈춤)
+# - 상태 / 진행률은 <job_dir>/<id>.state (JSON), 결과는 <id><ext> 파일이라 어느 gunicorn worker 에서든 확인 가능
+#
+# 작업 함수는 fn(path, progress, *args) 형식으로 path 에 결과를 쓰고, 중간중간 progress(done, total, message) 를 부른다.
+# 프로세스로 넘어가므로 fn 은 모듈 최상위 함수, args 는 pickle 가능한 값 (필요한 열만 잘라서 넘김)
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from covid_data import CACHE_DIR
+from covid_index import decimate
+from covid_export import write_excel, _write_atomic
+
+
+JOB_DIR = os.path.join(CACHE_DIR, "jobs")
+# 작업 프로세스 수 (기본 1: 작업이 CPU 를 다 차지하지 않도록)
+JOB_WORKERS = int(os.environ.get("COVID_JOB_WORKERS", "1"))
+# 작업 프로세스의 nice 값 (CPU 가 모자라면 필터 콜백을 처리하는 worker 가 먼저)
+JOB_NICE = int(os.environ.get("COVID_JOB_NICE", "10"))
+# 이 시간(초)보다 오래된 작업 파일은 새 작업을 시작할 때 지움
+JOB_MAX_AGE = 3600
+# progress 파일을 이 간격(초)보다 자주 쓰지 않음
+PROGRESS_INTERVAL = 0.2
+# 다른 worker 가 넣은 작업의 상태 파일이 이 시간(초) 동안 바뀌지 않으면 그 worker 가 죽은 것으로 보고 다시 넣음
+JOB_STALE = 300
+
+
+class JobCancelled(Exception):
+	pass
+
+
+def _write_state(job_dir, job_id, state):
+	path = os.path.join(job_dir, job_id + ".state")
+	def write(tmp):
+		with open(tmp, 'w') as f:
+			json.dump(state, f)
+	_write_atomic(path, write)
+
+
+class Progress:
+	# 작업 프로세스 안에서 진행률을 기록하고 취소 요청을 확인
+	def __init__(self, job_dir, job_id):
+		self.job_dir = job_dir
+		self.job_id = job_id
+		self._last = 0.0
+
+	def cancelled(self):
+		return os.path.exists(os.path.join(self.job_dir, self.job_id + ".cancel"))
+
+	def __call__(self, done, total, message=""):
+		if self.cancelled():
+			raise JobCancelled(self.job_id)
+		now = time.monotonic()
+		if now - self._last >= PROGRESS_INTERVAL or done >= total:
+			self._last = now
+			_write_state(self.job_dir, self.job_id, {'state': 'running', 'done': done, 'total': total, 'message': message})
+
+
+def _lower_priority(nice):
+	if nice and hasattr(os, 'nice'):
+		os.nice(nice)
+
+
+def _run(job_dir, job_id, path, fn, args):
+	# 작업 프로세스에서 실행: fn 결과를 path 에 atomic 하게 쓰고 상태 파일 갱신
+	progress = Progress(job_dir, job_id)
+	try:
+		progress(0, 1)
+		_write_atomic(path, lambda tmp: fn(tmp, progress, *args))
+	except JobCancelled:
+		_write_state(job_dir, job_id, {'state': 'cancelled'})
+	except Exception as e:
+		print("background job %s failed:" % job_id, repr(e), file=sys.stderr)
+		_write_state(job_dir, job_id, {'state': 'failed', 'error': repr(e)})
+	else:
+		_write_state(job_dir, job_id, {'state': 'done'})
+
+
+class JobQueue:
+	def __init__(self, job_dir=JOB_DIR, workers=JOB_WORKERS):
+		self.job_dir = job_dir
+		self.workers = workers
+		self._executor = None
+		# 지금 데이터셋의 fingerprint (job id 앞에 붙음)
+		self.generation = ''
+		# 이 프로세스에서 넣은 진행 중 작업: job id -> [future, 기다리는 화면 수]
+		self._jobs = {}
+		self._lock = threading.Lock()
+
+	def job_id(self, key):
+		# 같은 데이터셋의 같은 key 는 같은 작업
+		digest = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+		return "%s-%s" % (self.generation, digest) if self.generation else digest
+
+	def set_generation(self, generation):
+		# 데이터셋이 바뀌면 (재시작 포함) 다른 데이터셋으로 만든 결과 / 상태 파일을 지움 (진행 중인 작업 제외)
+		with self._lock:
+			self.generation = generation
+			if not os.path.isdir(self.job_dir):
+				return
+			for name in os.listdir(self.job_dir):
+				job_id = name.split(".")[0]
+				if name.endswith(".tmp") or job_id.startswith(generation + "-") or job_id in self._jobs:
+					continue
+				try:
+					os.remove(os.path.join(self.job_dir, name))
+				except OSError:
+					pass
+
+	def path(self, job_id, ext):
+		return os.path.join(self.job_dir, job_id + ext)
+
+	def submit(self, key, ext, fn, args=(), replaces=None):
+		# 작업을 넣고 job id 반환. 결과가 이미 있거나 진행 중이면 기다리는 화면 수만 늘림
+		# replaces: 이 화면이 기다리던 이전 작업 (다른 화면도 기다리지 않으면 취소)
+		job_id = self.job_id(key)
+		if replaces and replaces != job_id:
+			self.cancel(replaces)
+		with self._lock:
+			if job_id in self._jobs:
+				# 취소 요청 뒤에 다시 기다리는 화면이 생김
+				if os.path.exists(self.path(job_id, ".cancel")):
+					os.remove(self.path(job_id, ".cancel"))
+				self._jobs[job_id][1] += 1
+				return job_id
+			# 결과가 있거나 다른 worker 가 진행 중
+			if self.status(job_id, ext)['state'] in ('done', 'queued', 'running'):
+				return job_id
+			os.makedirs(self.job_dir, exist_ok=True)
+			self.prune()
+			for suffix in (".cancel", ".state"):
+				if os.path.exists(self.path(job_id, suffix)):
+					os.remove(self.path(job_id, suffix))
+			_write_state(self.job_dir, job_id, {'state': 'queued'})
+			future = self._start(job_id, self.path(job_id, ext), fn, args)
+			self._jobs[job_id] = [future, 1]
+		future.add_done_callback(lambda f: self._finished(job_id, f))
+		return job_id
+
+	def _start(self, job_id, path, fn, args):
+		# 작업 프로세스가 죽어서 pool 이 깨졌으면 새로 만들어서 한 번 더
+		for retry in (False, True):
+			if self._executor is None:
+				self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_lower_priority, initargs=(JOB_NICE,))
+			try:
+				return self._executor.submit(_run, self.job_dir, job_id, path, fn, args)
+			except BrokenProcessPool:
+				self._executor = None
+				if retry:
+					raise
+
+	def _finished(self, job_id, future):
+		with self._lock:
+			self._jobs.pop(job_id, None)
+		# 넘기지 못한 인자 (pickle 실패) / 죽은 작업 프로세스
+		if not future.cancelled() and future.exception() is not None:
+			print("background job %s failed:" % job_id, repr(future.exception()), file=sys.stderr)
+			_write_state(self.job_dir, job_id, {'state': 'failed', 'error': repr(future.exception())})
+
+	def cancel(self, job_id):
+		# 기다리는 화면이 더 없으면 취소 (시작 전이면 바로, 실행 중이면 다음 progress() 에서)
+		with self._lock:
+			job = self._jobs.get(job_id)
+			if job is not None:
+				job[1] -= 1
+				if job[1] > 0:
+					return False
+				if job[0].cancel():
+					self._jobs.pop(job_id, None)
+					_write_state(self.job_dir, job_id, {'state': 'cancelled'})
+					return True
+		if self.status(job_id)['state'] in ('queued', 'running'):
+			with open(self.path(job_id, ".cancel"), 'w'):
+				pass
+			return True
+		return False
+
+	def status(self, job_id, ext=None):
+		# {'state': 'queued' / 'running' / 'done' / 'failed' / 'cancelled' / 'unknown', 'done', 'total', 'message'}
+		# ext 를 주면 결과 파일이 있을 때 'done' (상태 파일이 정리된 뒤에도)
+		if ext is not None and os.path.exists(self.path(job_id, ext)):
+			return {'state': 'done'}
+		path = self.path(job_id, ".state")
+		try:
+			with open(path) as f:
+				status = json.load(f)
+			stale = job_id not in self._jobs and time.time() - os.path.getmtime(path) > JOB_STALE
+		except (OSError, ValueError):
+			return {'state': 'unknown'}
+		if status['state'] in ('queued', 'running') and stale:
+			return {'state': 'unknown'}
+		return status
+
+	def active(self):
+		with self._lock:
+			return len(self._jobs)
+
+	def prune(self, max_age=JOB_MAX_AGE):
+		now = time.time()
+		for name in os.listdir(self.job_dir):
+			path = os.path.join(self.job_dir, name)
+			if not name.endswith(".tmp") and name.split(".")[0] not in self._jobs and now - os.path.getmtime(path) > max_age:
+				os.remove(path)
+
+
+def progress_text(status):
+	# 'Preparing ... 45% (building figure)' 에 붙일 진행률 문자열
+	if status['state'] == 'queued':
+		return "queued"
+	if status.get('total'):
+		text = "%d%%" % (100 * status['done'] / status['total'])
+		return text + (" (%s)" % status['message'] if status.get('message') else "")
+	return ""
+
+
+# ===== JOBS ===== #
+# 작업 프로세스에서 실행되는 함수들 (fn(path, progress, *args))
+
+def excel_job(path, progress, frame, rows=None):
+	write_excel(path, frame, rows, progress=progress)
+
+
+def _axis_range(values):
+	# 축 범위 {'range': [최소, 최대]}. 선택된 샘플이 없거나 값이 모두 NA 면 범위 없이 (plotly 가 정함)
+	values = values.to_numpy(dtype=float, na_value=np.nan)
+	if not np.isfinite(values).any():
+		return {}
+	return {'range': [np.nanmin(values), np.nanmax(values)]}
+
+def parallel_coordinates_figure(dff, max_rows, progress=None):
+	# dff: ['batch', 'totalreads', 'coverage', 'depth', 'QC', 'clade', 'P/F'] (clade 는 etc 묶음을 적용한 값)
+	# 작업 프로세스에서 처음 figure 를 만들 때 import
+	import plotly.graph_objects as go
+	progress = progress or (lambda done, total, message="": None)
+
+	progress(0, 3, "encoding axes")
+	dff_parallel = dff[['batch', 'totalreads', 'coverage', 'depth']]
+	dff_parallel.insert(0, 'QC', dff['QC'].map({j: i for i,j in enumerate(sorted(dff['QC'].unique()))}).astype(int))
+	dff_parallel.insert(4, 'clade', dff['clade'].map({j: i for i,j in enumerate(sorted(dff['clade'].unique()))}).astype(int))
+	dff_parallel.insert(0, 'P/F', dff['P/F'].map({j: i for i,j in enumerate(sorted(dff['P/F'].unique()))}).astype(int))
+
+	# 선은 max_rows 개까지만 그림 (partition / batch 순으로 일정 간격 추출). 축 범위 / 눈금은 전체 기준
+	shown = dff_parallel.iloc[decimate(np.arange(len(dff_parallel)), max_rows)]
+
+	#fig_parallel = px.parallel_coordinates(dff_parallel, color='batch', color_continuous_scale=px.colors.sequential.Viridis,
+	#									   dimensions=['P/F', 'QC', 'totalreads', 'coverage', 'depth', 'clade'])
+
+	progress(1, 3, "building figure")
+	fig_parallel = go.Figure(data=
+		go.Parcoords(
+			line = dict(color=shown['batch'], colorscale='matter', showscale=True),
+			dimensions = list([
+				dict(label='Total Reads', values=shown['totalreads'], **_axis_range(dff_parallel['totalreads'])),
+				dict(label='Pass/Fail', range=[-1,2], tickvals=[i for i,j in enumerate(sorted(dff['P/F'].unique()))],
+					 ticktext=[j for i,j in enumerate(sorted(dff['P/F'].unique()))], values=shown['P/F']),
+				dict(label='Coverage', range=[0, 1],
+					 values=shown['coverage']),
+				dict(label='QC', range=[-1,4],
+					 tickvals=[i for i,j in enumerate(sorted(dff['QC'].unique()))],
+					 ticktext=[j for i,j in enumerate(sorted(dff['QC'].unique()))], values=shown['QC']),
+				dict(label='Depth', values=shown['depth'], **_axis_range(dff_parallel['depth'])),
+				dict(label='Clade', **_axis_range(dff_parallel['clade']),
+					 tickvals=[i for i,j in enumerate(sorted(dff['clade'].unique()))],
+					 ticktext=[j for i,j in enumerate(sorted(dff['clade'].unique()))], values=shown['clade']),
+			])
+		)
+	)
+	if len(shown) < len(dff_parallel):
+		fig_parallel.update_layout(title="{:,} of {:,} samples".format(len(shown), len(dff_parallel)))
+	return fig_parallel
+
+
+def figure_job(path, progress, build, *args):
+	# build(*args, progress=progress) 로 만든 figure 를 JSON 으로 (figure_cache 에 그대로 넣는 형식)
+	from figure_cache import to_json
+	fig = build(*args, progress=progress)
+	progress(2, 3, "serializing")
+	data = to_json(fig)
+	with open(path, 'w') as f:
+		f.write(data)
+	progress(3, 3)
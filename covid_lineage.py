@@ -0,0 +1,224 @@
+# pango lineage 계층 (dotted parent + alias parent) 과 count cube 기반 subtree 집계
+#
+# BQ.1.24 -> BQ.1 -> BE.1.1.1 -> BE.1.1 -> BE.1 -> BA.5.3.1 -> BA.5.3 -> BA.5 -> B.1.1.529 -> ...
+# alias 는 pango-designation 의 alias_key.json 형식 ({"BQ": "B.1.1.529.5.3.1.1.1.1", "XBB": [...], ...}).
+# 기본값은 ALIASES (이 데이터에 나오는 일부), COVID_PANGO_ALIAS_KEY 에 alias_key.json 경로를 주면 그 파일을 씀.
+# 모르는 alias (예: CB.1) 는 그 alias 가 루트 바로 아래 노드가 되고, 재조합(X*) lineage 는 루트 바로 아래.
+#
+# 샘플이 없고 자식이 하나뿐인 중간 노드는 지우고 (B.1.1.529.5.3.1.1 같은 긴 사슬), 노드는 전위 순회 순서로
+# 두어서 subtree 가 연속 구간이 되게 한다. 필터별 노드 샘플 수 -> 누적합 -> subtree 합계를 한 번에 구해 캐시하므로
+# drill-down / depth 변경은 샘플 집계 없이 트리 조회만 한다.
+
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from covid_index import normalize_filter
+
+
+ROOT = 'All'
+
+# 이 데이터에 나오는 alias 중 일부 (pango-designation alias_key.json 값)
+ALIASES = {
+	'BA': 'B.1.1.529', 'AY': 'B.1.617.2', 'Q': 'B.1.1.7',
+	'BE': 'B.1.1.529.5.3.1', 'BF': 'B.1.1.529.5.2.1', 'BJ': 'B.1.1.529.2.10.1', 'BK': 'B.1.1.529.5.1.10',
+	'BL': 'B.1.1.529.2.75.1', 'BM': 'B.1.1.529.2.75.3', 'BN': 'B.1.1.529.2.75.5', 'BQ': 'B.1.1.529.5.3.1.1.1.1',
+	'BR': 'B.1.1.529.2.75.4', 'BS': 'B.1.1.529.2.3.2', 'BU': 'B.1.1.529.5.2.16', 'BW': 'B.1.1.529.5.6.2',
+	'BY': 'B.1.1.529.2.75.6', 'CA': 'B.1.1.529.2.75.2', 'CH': 'B.1.1.529.2.75.3.4.1.1', 'CJ': 'B.1.1.529.2.75.3.1.1.1',
+	'CK': 'B.1.1.529.5.2.24', 'CM': 'B.1.1.529.2.3.20', 'DV': 'B.1.1.529.2.75.3.4.1.1.1.1.1',
+	'EG': 'XBB.1.9.2', 'EU': 'XBB.1.5.26', 'FD': 'XBB.1.5.15', 'FE': 'XBB.1.18.1', 'FL': 'XBB.1.9.1',
+	'FP': 'XBB.1.11.1', 'FU': 'XBB.1.16.1', 'FY': 'XBB.1.22.1',
+}
+
+def load_aliases(path=None):
+	# alias_key.json 을 읽어 {alias: 전체 이름} (재조합 / A, B 처럼 문자열이 아닌 값은 뺌)
+	path = path or os.environ.get("COVID_PANGO_ALIAS_KEY")
+	if not path:
+		return dict(ALIASES)
+	with open(path) as f:
+		aliases = json.load(f)
+	return {k: v for k, v in aliases.items() if isinstance(v, str) and v}
+
+
+def expand(name, aliases):
+	# BQ.1.24 -> B.1.1.529.5.3.1.1.1.1.1.24
+	prefix, _, rest = name.partition('.')
+	if prefix in aliases:
+		return aliases[prefix] + ('.' + rest if rest else '')
+	return name
+
+def compress(full, aliases):
+	# 가장 긴 alias 로 줄인 이름 (alias 자체의 전체 이름은 그 위 alias 로: B.1.1.529.5.3.1.1.1.1 -> BE.1.1.1)
+	best = None
+	for alias, value in aliases.items():
+		if full.startswith(value + '.') and (best is None or len(value) > len(aliases[best])):
+			best = alias
+	return best + full[len(aliases[best]):] if best else full
+
+def ancestors(name, aliases):
+	# name 의 조상 이름 (가까운 순, 루트 제외)
+	full = expand(name, aliases)
+	parts = full.split('.')
+	out = []
+	for n in range(len(parts) - 1, 0, -1):
+		out.append(compress('.'.join(parts[:n]), aliases))
+	return out
+
+
+# ===== LINEAGE TREE ===== #
+class LineageTree:
+	def __init__(self, names, aliases=None):
+		# names: 데이터에 나오는 pango 이름 (노드가 됨). 조상은 자동으로 추가
+		aliases = load_aliases() if aliases is None else aliases
+		observed = set(str(n) for n in names)
+		parent = {}
+		for name in observed:
+			child = name
+			for up in ancestors(name, aliases):
+				if child in parent:
+					break
+				parent[child] = up
+				child = up
+			else:
+				parent.setdefault(child, ROOT)
+
+		# 샘플이 없고 자식이 하나인 중간 노드 제거
+		children = {}
+		for child, up in parent.items():
+			children.setdefault(up, []).append(child)
+		def keep(node):
+			return node == ROOT or node in observed or len(children.get(node, [])) != 1
+		def kept_parent(node):
+			up = parent[node]
+			while not keep(up):
+				up = parent[up]
+			return up
+
+		nodes = [n for n in parent if keep(n)]
+		tree = {ROOT: []}
+		for node in nodes:
+			tree.setdefault(kept_parent(node), []).append(node)
+
+		# 전위 순회 순서 (자식은 이름의 숫자 순)
+		self.names = []
+		self.parent = []
+		self.depth = []
+		self.end = []
+		stack = [(ROOT, -1, 0)]
+		while stack:
+			node, up, depth = stack.pop()
+			if node is None:
+				# 이 노드 subtree 의 끝
+				self.end[up] = len(self.names)
+				continue
+			i = len(self.names)
+			self.names.append(node)
+			self.parent.append(up)
+			self.depth.append(depth)
+			self.end.append(0)
+			stack.append((None, i, depth))
+			for child in sorted(tree.get(node, []), key=_sort_key, reverse=True):
+				stack.append((child, i, depth + 1))
+		self.index = {name: i for i, name in enumerate(self.names)}
+		self.parent = np.array(self.parent, dtype=np.int64)
+		self.depth = np.array(self.depth, dtype=np.int64)
+		self.end = np.array(self.end, dtype=np.int64)
+		self.observed = observed
+
+	def __len__(self):
+		return len(self.names)
+
+	def subtree_counts(self, direct):
+		# direct: 노드별 (그 lineage 로 판정된) 샘플 수 -> 노드별 subtree 샘플 수
+		cumulative = np.concatenate([[0], np.cumsum(direct)])
+		return cumulative[self.end] - cumulative[np.arange(len(self.names))]
+
+	def children(self, node):
+		# node 의 자식 노드 위치 (전위 순서라 node+1 부터 subtree 끝까지 depth+1 인 노드)
+		i = self.index[node] if isinstance(node, str) else node
+		span = np.arange(i + 1, self.end[i])
+		return span[self.depth[span] == self.depth[i] + 1]
+
+	def path(self, node):
+		# 루트부터 node 까지의 이름
+		i = self.index[node]
+		out = []
+		while i >= 0:
+			out.append(self.names[i])
+			i = self.parent[i]
+		return out[::-1]
+
+def _sort_key(name):
+	return [(0, int(p), '') if p.isdigit() else (1, 0, p) for p in name.split('.')]
+
+
+def cut(tree, counts, root=ROOT, depth=3, min_share=0.0):
+	# root 아래 depth 단계까지의 (id, label, parent, value) 데이터프레임 (sunburst 용, branchvalues='total')
+	# root subtree 의 min_share 보다 작은 자식들은 부모마다 '<부모> etc' 노드 하나로 묶음
+	# 갈라지지 않는 노드 (B -> B.1 -> B.1.1 처럼 보이는 자식이 하나) 아래 단계는 depth 에 세지 않음
+	i = tree.index.get(root, 0)
+	total = counts[i]
+	threshold = total * min_share
+	rows = [(tree.names[i], tree.names[i], '', int(total))]
+	level = [(i, depth)]
+	while level:
+		next_level = []
+		for node, remaining in level:
+			if remaining <= 0:
+				continue
+			shown = [child for child in tree.children(node) if counts[child] and counts[child] >= threshold]
+			etc = sum(counts[child] for child in tree.children(node) if counts[child] < threshold)
+			for child in shown:
+				rows.append((tree.names[child], tree.names[child], tree.names[node], int(counts[child])))
+				next_level.append((child, remaining - 1 if len(shown) > 1 else remaining))
+			if etc:
+				rows.append((tree.names[node] + ' etc', 'etc', tree.names[node], int(etc)))
+		level = next_level
+	return pd.DataFrame(rows, columns=['id', 'label', 'parent', 'value'])
+
+
+def share_cut(counts, min_share, label='etc'):
+	# 전체의 min_share 보다 적은 항목을 label 로 묶는 replace 용 dict ({'20C': 'etc', ...})
+	# counts: {이름: 샘플 수}
+	total = sum(counts.values())
+	return {name: label for name, n in counts.items() if total and n < total * min_share and name != label}
+
+
+# ===== LINEAGE INDEX ===== #
+class LineageIndex:
+	# CountCube 의 (clade, pango) 축을 lineage 트리 노드에 연결하고, 필터별 subtree 합계를 LRU 로 캐시
+	def __init__(self, cube, aliases=None, maxsize=64):
+		self.cube = cube
+		self.tree = LineageTree(cube.pair_pango, aliases)
+		self.pair_node = np.array([self.tree.index[str(p)] for p in cube.pair_pango], dtype=np.int64)
+		self.maxsize = maxsize
+		self._memo = OrderedDict()
+		self._lock = threading.Lock()
+
+	def counts(self, year, clade, cov, qc, batch):
+		# 노드별 subtree 샘플 수 (같은 필터면 캐시)
+		key = normalize_filter(year, clade, cov, qc, batch)
+		with self._lock:
+			if key in self._memo:
+				self._memo.move_to_end(key)
+				return self._memo[key]
+		direct = np.bincount(self.pair_node, weights=self.cube.pair_counts(year, clade, cov, qc, batch), minlength=len(self.tree))
+		counts = self.tree.subtree_counts(direct).astype(np.int64)
+		counts.setflags(write=False)
+		with self._lock:
+			self._memo[key] = counts
+			while len(self._memo) > self.maxsize:
+				self._memo.popitem(last=False)
+		return counts
+
+	def sunburst(self, year, clade, cov, qc, batch, root=ROOT, depth=3, min_share=0.0):
+		if root not in self.tree.index:
+			root = ROOT
+		return cut(self.tree, self.counts(year, clade, cov, qc, batch), root, depth, min_share)
+
+	def parent(self, node):
+		# drill-up 대상 (루트면 루트)
+		i = self.tree.index.get(node, 0)
+		return self.tree.names[max(self.tree.parent[i], 0)]
@@ -0,0 +1,247 @@
+# 콜백 / 레포트 읽기 단계별 소요시간, 행 수, 응답 크기 측정 (Prometheus text 형식 /metrics)
+#
+# - 요청 단위: Dash 콜백(/_dash-update-component)은 출력 id 별, 그 외 경로는 route 별로 전체 시간과 응답 byte
+# - 단계 단위: with stage('filter', rows_in=n) as s: ... s['rows_out'] = m
+#   단계는 중첩될 수 있고 기록되는 시간은 안쪽 단계를 뺀 시간 (figure 단계 안의 filter 시간은 filter 에만 기록).
+#   요청 전체에서 단계 시간을 뺀 나머지는 'dash' 단계 (Dash 응답 직렬화 등)
+# - COVID_PROFILE_SLOW_MS 를 설정하면 Dash 콜백 요청을 cProfile 로 실행해서 그보다 오래 걸린 요청의
+#   프로파일을 <cache>/profiles/ 에 .prof 로 저장 (python -m pstats 로 확인)
+# - gunicorn worker 가 여러 개면 (COVID_METRICS_DIR) worker 마다 값을 파일로 남기고 /metrics 에서 합쳐서 보여줌
+
+import os
+import sys
+import json
+import time
+import glob
+import pstats
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+HISTOGRAMS = {
+	'covid_request_seconds': (SECONDS_BUCKETS, "Wall time per request (Dash callback output or route)"),
+	'covid_response_bytes': (BYTES_BUCKETS, "Serialized response size per request"),
+	'covid_stage_seconds': (SECONDS_BUCKETS, "Wall time per stage, excluding nested stages"),
+	'covid_stage_rows': (ROWS_BUCKETS, "Rows going into / out of a stage"),
+	'covid_ingest_file_seconds': (SECONDS_BUCKETS, "Time to load one report workbook (parsed or from cache)"),
+}
+
+PROFILE_SLOW_MS = float(os.environ.get("COVID_PROFILE_SLOW_MS", "0"))
+# 비어 있으면 <cache>/profiles
+PROFILE_DIR = os.environ.get("COVID_PROFILE_DIR", "")
+PROFILE_KEEP = 50
+# worker 별 값을 이 폴더에 저장 (gunicorn.conf.py 가 설정). 비어 있으면 이 프로세스 값만
+METRICS_DIR = os.environ.get("COVID_METRICS_DIR", "")
+METRICS_DUMP_INTERVAL = 5
+
+DASH_UPDATE_PATH = '/_dash-update-component'
+SKIP_PATHS = ('/_dash-component-suites', '/_dash-layout', '/_dash-dependencies', '/_favicon', '/assets', '/metrics', '/healthz', '/readyz')
+
+
+class Metrics:
+	def __init__(self):
+		self._hist = {}
+		self._lock = threading.Lock()
+
+	def observe(self, name, value, **labels):
+		buckets = HISTOGRAMS[name][0]
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			h = self._hist.get(key)
+			if h is None:
+				h = self._hist[key] = [[0] * len(buckets), 0.0, 0]
+			for i, bound in enumerate(buckets):
+				if value <= bound:
+					h[0][i] += 1
+					break
+			h[1] += value
+			h[2] += 1
+
+	def snapshot(self):
+		with self._lock:
+			return [[name, list(labels), list(h[0]), h[1], h[2]] for (name, labels), h in self._hist.items()]
+
+	def render(self, snapshots=None, gauges=None):
+		# Prometheus text 형식. snapshots: 다른 worker 의 snapshot() 리스트 (합산)
+		merged = {}
+		for snapshot in [self.snapshot()] + list(snapshots or []):
+			for name, labels, counts, total, count in snapshot:
+				key = (name, tuple(tuple(l) for l in labels))
+				h = merged.setdefault(key, [[0] * len(counts), 0.0, 0])
+				h[0] = [a + b for a, b in zip(h[0], counts)]
+				h[1] += total
+				h[2] += count
+
+		lines = []
+		for name, (buckets, help) in HISTOGRAMS.items():
+			lines += ["# HELP %s %s" % (name, help), "# TYPE %s histogram" % name]
+			for (metric, labels), (counts, total, count) in sorted(merged.items()):
+				if metric != name:
+					continue
+				cumulative = 0
+				for bound, n in zip(buckets, counts):
+					cumulative += n
+					lines.append("%s_bucket{%s} %d" % (name, _labels(labels + (('le', repr(float(bound))),)), cumulative))
+				lines.append("%s_bucket{%s} %d" % (name, _labels(labels + (('le', '+Inf'),)), count))
+				lines.append("%s_sum{%s} %r" % (name, _labels(labels), total))
+				lines.append("%s_count{%s} %d" % (name, _labels(labels), count))
+		for name, (value, help) in (gauges or {}).items():
+			lines += ["# HELP %s %s" % (name, help), "# TYPE %s gauge" % name, "%s %r" % (name, value)]
+		return "\n".join(lines) + "\n"
+
+def _labels(labels):
+	return ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+
+metrics = Metrics()
+_local = threading.local()
+
+
+# ===== STAGES ===== #
+def current_callback():
+	return getattr(_local, 'callback', None) or 'none'
+
+@contextmanager
+def stage(name, rows_in=None, callback=None):
+	# 단계 시간 (안쪽 단계 제외) 과 행 수 기록. yield 한 dict 에 rows_out 을 넣으면 같이 기록
+	# callback 을 주지 않으면 바깥 단계의 callback, 없으면 지금 요청의 콜백
+	stack = _local.__dict__.setdefault('stack', [])
+	callback = callback or (stack[-1][2] if stack else current_callback())
+	frame = [time.perf_counter(), 0.0, callback]
+	stack.append(frame)
+	record = {'rows_out': None}
+	try:
+		yield record
+	finally:
+		stack.pop()
+		elapsed = time.perf_counter() - frame[0]
+		if stack:
+			stack[-1][1] += elapsed
+		else:
+			_local.staged = getattr(_local, 'staged', 0.0) + elapsed
+		metrics.observe('covid_stage_seconds', elapsed - frame[1], callback=callback, stage=name)
+		if rows_in is not None:
+			metrics.observe('covid_stage_rows', rows_in, callback=callback, stage=name, direction='in')
+		if record['rows_out'] is not None:
+			metrics.observe('covid_stage_rows', record['rows_out'], callback=callback, stage=name, direction='out')
+
+def timed_stage(name):
+	# 함수 전체를 stage(name) 으로 (데이터프레임 / 배열을 반환하면 그 길이를 rows_out 으로)
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			with stage(name) as record:
+				result = fn(*args, **kwargs)
+				if hasattr(result, 'shape'):
+					record['rows_out'] = len(result)
+				return result
+		return wrapper
+	return decorator
+
+
+# ===== FLASK ===== #
+def callback_name(request):
+	# Dash 콜백 요청이면 첫 번째 출력 id ("..a.figure...b.data.." -> "a"), 아니면 route
+	if request.path == DASH_UPDATE_PATH:
+		body = request.get_json(silent=True) or {}
+		output = str(body.get('output', '')).strip('.').split('...')[0]
+		return output.rsplit('.', 1)[0] or 'unknown'
+	return request.url_rule.rule if request.url_rule is not None else None
+
+def save(snapshot_dir=METRICS_DIR, force=False):
+	# 이 프로세스의 값을 snapshot_dir/<pid>.json 으로 (force 가 아니면 METRICS_DUMP_INTERVAL 초에 한 번)
+	now = time.time()
+	if not force and now - getattr(save, 'last', 0) < METRICS_DUMP_INTERVAL:
+		return
+	save.last = now
+	os.makedirs(snapshot_dir, exist_ok=True)
+	path = os.path.join(snapshot_dir, "%d.json" % os.getpid())
+	with open(path + ".tmp", 'w') as f:
+		json.dump(metrics.snapshot(), f)
+	os.replace(path + ".tmp", path)
+
+def _other_workers(snapshot_dir):
+	out = []
+	for path in glob.glob(os.path.join(snapshot_dir, "*.json")):
+		if os.path.basename(path) == "%d.json" % os.getpid():
+			continue
+		try:
+			with open(path) as f:
+				out.append(json.load(f))
+		except (OSError, ValueError):
+			pass
+	return out
+
+def _save_profile(profile, callback, seconds):
+	from covid_data import CACHE_DIR
+	profile_dir = PROFILE_DIR or os.path.join(CACHE_DIR, "profiles")
+	os.makedirs(profile_dir, exist_ok=True)
+	name = "%s-%s-%dms.prof" % (time.strftime('%Y%m%d-%H%M%S'), "".join(c if c.isalnum() or c in '-_' else '_' for c in callback), seconds * 1000)
+	path = os.path.join(profile_dir, name)
+	pstats.Stats(profile).dump_stats(path)
+	print("slow request %s (%.0f ms), profile: %s" % (callback, seconds * 1000, path), file=sys.stderr)
+	for old in sorted(glob.glob(os.path.join(profile_dir, "*.prof")))[:-PROFILE_KEEP]:
+		os.remove(old)
+
+def install(server, gauges=None):
+	# Flask server 에 요청 측정 hook 과 /metrics route 등록. gauges() -> {name: (value, help)}
+	import flask
+
+	@server.before_request
+	def start_request():
+		if flask.request.path.startswith(SKIP_PATHS):
+			return
+		_local.callback = callback_name(flask.request)
+		_local.staged = 0.0
+		_local.start = time.perf_counter()
+		_local.profile = None
+		if PROFILE_SLOW_MS > 0 and flask.request.path == DASH_UPDATE_PATH:
+			profile = cProfile.Profile()
+			try:
+				profile.enable()
+				_local.profile = profile
+			except ValueError:
+				# 다른 프로파일러가 이미 켜져 있음
+				pass
+
+	@server.after_request
+	def finish_request(response):
+		start = getattr(_local, 'start', None)
+		if start is None:
+			return response
+		seconds = time.perf_counter() - start
+		callback = _local.callback
+		profile = _local.profile
+		_local.start = _local.callback = _local.profile = None
+		if profile is not None:
+			profile.disable()
+		if callback is None:
+			return response
+
+		metrics.observe('covid_request_seconds', seconds, callback=callback, status=str(response.status_code))
+		if not response.direct_passthrough and not response.is_streamed:
+			metrics.observe('covid_response_bytes', len(response.get_data()), callback=callback)
+		metrics.observe('covid_stage_seconds', max(seconds - _local.staged, 0.0), callback=callback, stage='dash')
+		if profile is not None and seconds * 1000 >= PROFILE_SLOW_MS:
+			try:
+				_save_profile(profile, callback, seconds)
+			except OSError as e:
+				print("profile save failed:", repr(e), file=sys.stderr)
+		if METRICS_DIR:
+			try:
+				save(METRICS_DIR)
+			except OSError as e:
+				print("metrics dump failed:", repr(e), file=sys.stderr)
+		return response
+
+	@server.route('/metrics')
+	def prometheus_metrics():
+		snapshots = _other_workers(METRICS_DIR) if METRICS_DIR else []
+		text = metrics.render(snapshots, gauges() if gauges else None)
+		return flask.Response(text, mimetype='text/plain; version=0.0.4')
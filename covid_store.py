@@ -0,0 +1,230 @@
+# 모든 레포트의 샘플 실행 결과(run)를 SQLite 에 보관하는 모듈
+#
+# 메모리의 covid 데이터프레임은 샘플별로 totalreads 가 가장 큰 결과만 남기지만 (dedup_samples),
+# 여기에는 재실험 레포트를 포함한 모든 run 을 원본 파일 경로와 함께 저장한다.
+# sample / batch / clade / pango 에 인덱스가 있어서 샘플 조회, 재실험 이력, 메모리에 다 올리기 어려운
+# 이력 조회는 데이터프레임 대신 이 파일로 한다.
+#
+# python covid_store.py sync             : 레포트 폴더와 store 맞추기
+# python covid_store.py history <sample> : 샘플의 모든 run (JSON)
+#
+# 바뀐 레포트만 다시 넣는다 (files 테이블의 size / mtime 비교). 쓰기는 한 프로세스에서만
+# (단일 프로세스면 app, gunicorn 이면 snapshot 프로세스), 읽기는 여러 worker 에서 동시에 (WAL).
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import pandas as pd
+from covid_data import CACHE_DIR, INGEST_WORKERS, REPORT_ROOT, report_partitions, input_file_list, load_reports, apply_schema, run_rank, _cache_key
+
+
+# 0 이면 store 를 만들지 않음 (샘플 검색 / /api 조회도 꺼짐)
+STORE_ENABLED = os.environ.get("COVID_STORE", "1") != "0"
+# 레포트 캐시 항목과 섞이지 않도록 하위 폴더에 둠 (exports/, jobs/ 처럼)
+STORE_PATH = os.environ.get("COVID_STORE_PATH", os.path.join(CACHE_DIR, "store", "samples.sqlite"))
+# 스키마가 바뀌면 올려서 다시 만듦
+STORE_VERSION = 1
+
+RUN_COLUMNS = ['sample', 'year', 'batch', 'QC', 'pf', 'totalreads', 'mappedreads', 'coverage', 'badbases', 'depth',
+			   'length', 'clade', 'pango', 'source', 'retest']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY,
+	sample TEXT NOT NULL, year TEXT, batch INTEGER, QC TEXT, pf TEXT,
+	totalreads INTEGER, mappedreads INTEGER, coverage REAL, badbases INTEGER, depth REAL, length INTEGER,
+	clade TEXT, pango TEXT, source TEXT NOT NULL, retest INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_sample ON runs (sample);
+CREATE INDEX IF NOT EXISTS runs_batch ON runs (batch);
+CREATE INDEX IF NOT EXISTS runs_clade ON runs (clade);
+CREATE INDEX IF NOT EXISTS runs_pango ON runs (pango);
+CREATE INDEX IF NOT EXISTS runs_source ON runs (source);
+CREATE TABLE IF NOT EXISTS files (
+	path TEXT PRIMARY KEY, year TEXT, size INTEGER, mtime INTEGER, rows INTEGER
+);
+"""
+
+def is_retest(path):
+	return "재실험" in os.path.basename(path)
+
+
+class SampleStore:
+	def __init__(self, path=STORE_PATH):
+		self.path = path
+		self._lock = threading.Lock()
+
+	def connect(self, readonly=False):
+		# 스레드마다 / 요청마다 새 연결 (sqlite3 연결은 스레드 간에 공유하지 않음)
+		if readonly:
+			db = sqlite3.connect("file:%s?mode=ro" % self.path, uri=True, timeout=30)
+		else:
+			os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+			db = sqlite3.connect(self.path, timeout=30)
+		db.row_factory = sqlite3.Row
+		return db
+
+	def exists(self):
+		return os.path.exists(self.path)
+
+	def _open_for_write(self):
+		db = self.connect()
+		if db.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+			db.executescript("DROP TABLE IF EXISTS runs; DROP TABLE IF EXISTS files;")
+			db.execute("PRAGMA user_version = %d" % STORE_VERSION)
+		db.execute("PRAGMA journal_mode = WAL")
+		db.executescript(SCHEMA)
+		return db
+
+	# ===== WRITE ===== #
+	def sync(self, folders, cache_dir=CACHE_DIR, workers=INGEST_WORKERS):
+		# folders ({'2022': './input_report_files/2022/', ...}) 의 레포트와 저장된 run 을 맞춤
+		# 새 파일 / 바뀐 파일은 run 을 다시 넣고, 없어진 파일의 run 은 지움. (추가, 삭제) 파일 수 반환
+		with self._lock:
+			found = {}
+			for year, folder in folders.items():
+				for i in input_file_list(folder):
+					st = os.stat(i)
+					found[_cache_key(i)] = (year, i, st.st_size, st.st_mtime_ns)
+
+			db = self._open_for_write()
+			try:
+				known = {row['path']: (row['size'], row['mtime']) for row in db.execute("SELECT path, size, mtime FROM files")}
+				removed = [path for path in known if path not in found]
+				changed = sorted((key for key, v in found.items() if known.get(key) != v[2:]), key=lambda key: found[key][1])
+				with db:
+					for path in removed:
+						db.execute("DELETE FROM runs WHERE source = ?", (path,))
+						db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+				# 파싱 결과는 레포트 캐시에서 가져옴 (app 이 방금 읽은 파일이면 캐시 hit)
+				frames = load_reports([found[key][1] for key in changed], cache_dir, workers) if changed else []
+				for key, frame in zip(changed, frames):
+					year, i, size, mtime = found[key]
+					with db:
+						db.execute("DELETE FROM runs WHERE source = ?", (key,))
+						db.executemany("INSERT INTO runs (%s) VALUES (%s)" % (", ".join(RUN_COLUMNS), ", ".join("?" * len(RUN_COLUMNS))),
+									   _run_rows(frame, year, key))
+						db.execute("INSERT OR REPLACE INTO files (path, year, size, mtime, rows) VALUES (?, ?, ?, ?, ?)",
+								   (key, year, size, mtime, len(frame)))
+			finally:
+				db.close()
+			return len(changed), len(removed)
+
+	# ===== READ ===== #
+	def _query(self, sql, params=()):
+		if not self.exists():
+			return []
+		db = self.connect(readonly=True)
+		try:
+			return [dict(row) for row in db.execute(sql, params)]
+		finally:
+			db.close()
+
+	def history(self, sample):
+		# 샘플의 모든 run (읽은 순) + 메모리 데이터셋에 남은 run 표시 ('selected')
+		# 메모리 데이터셋 (dedup_samples) 과 같은 기준: run_rank = (totalreads, partition, batch, 파일 이름) 이 가장 큰 run
+		runs = self._query("SELECT * FROM runs WHERE sample = ? ORDER BY id", (str(sample),))
+		if runs:
+			best = max(runs, key=lambda r: run_rank(r['totalreads'], r['year'], r['batch'], r['source']))
+			for r in runs:
+				r['selected'] = r is best
+		return runs
+
+	def search(self, prefix, limit=20):
+		# sample 이 prefix 로 시작하는 샘플들의 모든 run (인덱스 범위 조회), 샘플 limit 개까지
+		prefix = str(prefix)
+		samples = self._query("SELECT DISTINCT sample FROM runs WHERE sample >= ? AND sample < ? ORDER BY sample LIMIT ?",
+							  (prefix, prefix + "\U0010ffff", limit))
+		out = []
+		for row in samples:
+			out += self.history(row['sample'])
+		return out
+
+	def runs(self, batch=None, clade=None, pango=None, sample=None, retest=None, limit=None, chunk_rows=10000):
+		# 조건에 맞는 run 을 dict 로 하나씩 (cursor 를 chunk_rows 씩 읽어서 전체를 메모리에 올리지 않음)
+		where, params = [], []
+		if batch is not None:
+			where.append("batch BETWEEN ? AND ?")
+			params += [int(batch[0]), int(batch[1])]
+		for column, value in (('clade', clade), ('pango', pango), ('sample', sample)):
+			if value is not None:
+				where.append("%s = ?" % column)
+				params.append(str(value))
+		if retest is not None:
+			where.append("retest = ?")
+			params.append(int(bool(retest)))
+		sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY batch, id"
+		if limit:
+			sql += " LIMIT %d" % int(limit)
+		if not self.exists():
+			return
+		db = self.connect(readonly=True)
+		try:
+			cursor = db.execute(sql, params)
+			while True:
+				rows = cursor.fetchmany(chunk_rows)
+				if not rows:
+					break
+				for row in rows:
+					yield dict(row)
+		finally:
+			db.close()
+
+	def stats(self):
+		rows = self._query("SELECT COUNT(*) AS runs, COUNT(DISTINCT sample) AS samples, SUM(retest) AS retest_runs, "
+						   "(SELECT COUNT(*) FROM files) AS files FROM runs")
+		return rows[0] if rows else {'runs': 0, 'samples': 0, 'retest_runs': 0, 'files': 0}
+
+
+def _run_rows(frame, year, source):
+	# read_report() 결과 한 파일을 runs 테이블 행 튜플로 (apply_schema 로 타입 / P/F 를 메모리 데이터셋과 같게)
+	df = apply_schema(frame)
+	df = df.rename(columns={'P/F': 'pf'}).assign(year=str(year), source=source, retest=int(is_retest(source)))
+	df = df[RUN_COLUMNS].astype(object)
+	df = df.where(pd.notna(df), None)
+	return [tuple(v.item() if hasattr(v, 'item') else v for v in row) for row in df.itertuples(index=False, name=None)]
+
+
+def start_sync(store, folders, **kwargs):
+	# 백그라운드 스레드에서 sync (실패하면 로그만). 쓰는 도중에 인터프리터가 끝나지 않도록 daemon 이 아닌 스레드
+	def run():
+		try:
+			store.sync(folders, **kwargs)
+		except Exception as e:
+			print("sample store sync failed:", repr(e), file=sys.stderr)
+	thread = threading.Thread(target=run, name="sample-store-sync")
+	thread.start()
+	return thread
+
+
+# ===== CLI ===== #
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="SARS-CoV sample run store")
+	parser.add_argument('command', choices=['sync', 'history'])
+	parser.add_argument('sample', nargs='?')
+	parser.add_argument('--store', default=STORE_PATH, help="SQLite file (default: %(default)s)")
+	parser.add_argument('--root', default=REPORT_ROOT, help="report folder root (default: %(default)s)")
+	parser.add_argument('--cache-dir', default=CACHE_DIR, help="report cache folder (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	store = SampleStore(args.store)
+	if args.command == 'sync':
+		start = time.perf_counter()
+		changed, removed = store.sync(report_partitions(args.root), args.cache_dir)
+		print("%d report(s) added / updated, %d removed in %.1fs: %s" % (changed, removed, time.perf_counter() - start, store.stats()))
+		return 0
+
+	if not args.sample:
+		parser.error("history needs a sample id")
+	runs = store.history(args.sample)
+	print(json.dumps(runs, ensure_ascii=False, indent=1))
+	return 0 if runs else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
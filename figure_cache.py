@@ -0,0 +1,83 @@
+# 직렬화된 plotly figure(JSON) 캐시
+# (figure id, 필터 튜플, 데이터셋 버전) 을 키로 하고, 전체 크기가 max_bytes 를 넘으면
+# 가장 오래 안 쓴 항목부터 지운다 (LRU).
+
+import json
+import threading
+import plotly
+from collections import OrderedDict
+from covid_metrics import stage
+
+
+def to_json(fig):
+	# plotly figure / dict 를 JSON 문자열로
+	if hasattr(fig, 'to_plotly_json'):
+		fig = fig.to_plotly_json()
+	return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+class FigureCache:
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, figure_id, key, version, build):
+		# 캐시에 있으면 저장된 JSON 을, 없으면 build() 로 만든 figure 를 직렬화해서 저장하고 dict 로 반환
+		key = (figure_id, key, version)
+		with self._lock:
+			data = self._entries.get(key)
+			if data is not None:
+				self._entries.move_to_end(key)
+				self.hits += 1
+			else:
+				self.misses += 1
+		if data is None:
+			fig = build()
+			with stage('serialize'):
+				data = to_json(fig)
+			self.put(key, data)
+		with stage('decode'):
+			return json.loads(data)
+
+	def lookup(self, figure_id, key, version):
+		# 캐시에 있으면 dict, 없으면 None (만들지 않음. 작업 큐에서 만든 figure 는 put 으로 넣음)
+		key = (figure_id, key, version)
+		with self._lock:
+			data = self._entries.get(key)
+			if data is None:
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+		with stage('decode'):
+			return json.loads(data)
+
+	def put(self, key, data):
+		with self._lock:
+			if key in self._entries:
+				self.bytes -= len(self._entries.pop(key))
+			# 한 항목이 전체 용량보다 크면 저장하지 않음
+			if len(data) > self.max_bytes:
+				return
+			self._entries[key] = data
+			self.bytes += len(data)
+			while self.bytes > self.max_bytes:
+				_, old = self._entries.popitem(last=False)
+				self.bytes -= len(old)
+				self.evictions += 1
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.bytes = 0
+
+	def stats(self):
+		with self._lock:
+			return {
+				'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+				'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+			}
@@ -0,0 +1,44 @@
+# gunicorn app:server -c gunicorn.conf.py
+#
+# master 에서 `covid_data.py snapshot` 프로세스를 띄워 데이터셋 snapshot 을 한 번 만들고,
+# worker 는 레포트를 다시 읽지 않고 그 snapshot 을 memory-map 으로 연다 (COVID_SHARED_DATASET).
+# COVID_POLL_INTERVAL 초마다 snapshot 프로세스가 새 레포트를 반영하고, worker 는 current 가 바뀌면 다시 연다.
+# /metrics 는 worker 와 snapshot 프로세스가 COVID_METRICS_DIR 에 남긴 값을 합쳐서 보여준다.
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+timeout = 120
+
+_snapshot_process = None
+
+
+def on_starting(server):
+	global _snapshot_process
+	from covid_data import read_snapshot_pointer, CACHE_DIR
+
+	os.environ["COVID_SHARED_DATASET"] = "1"
+	# worker / snapshot 프로세스 별 metrics 파일 (/metrics 에서 합산). 재시작하면 새로 시작
+	metrics_dir = os.environ.setdefault("COVID_METRICS_DIR", os.path.join(CACHE_DIR, "metrics"))
+	shutil.rmtree(metrics_dir, ignore_errors=True)
+	previous = read_snapshot_pointer()
+	poll = os.environ.get("COVID_POLL_INTERVAL", "30")
+	_snapshot_process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "covid_data.py"), "snapshot", "--poll", poll])
+
+	# 첫 snapshot 이 나올 때까지 worker 를 띄우지 않음
+	while read_snapshot_pointer() == previous:
+		if _snapshot_process.poll() is not None:
+			if _snapshot_process.returncode != 0:
+				raise RuntimeError("dataset snapshot failed (exit %d)" % _snapshot_process.returncode)
+			break
+		time.sleep(0.2)
+
+
+def on_exit(server):
+	if _snapshot_process is not None and _snapshot_process.poll() is None:
+		_snapshot_process.terminate()
@@ -0,0 +1,47 @@
+# 테스트 공용 fixture
+# benchmark.py 의 합성 레포트 (실제 레포트와 같은 형식) 를 임시 폴더에 써서 작은 데이터셋으로 테스트한다.
+# 캐시 / 작업 파일은 임시 폴더에 두고 SQLite store 와 폴더 확인은 끔 (covid_data 를 import 하기 전에 정해야 함)
+
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("COVID_CACHE_DIR", tempfile.mkdtemp(prefix="covid-test-cache-"))
+os.environ.setdefault("COVID_POLL_INTERVAL", "0")
+os.environ["COVID_STORE"] = "0"
+
+import benchmark
+
+# 합성 레포트 샘플 수 (년도 2 개, 파일 4 개 + 재실험 레포트)
+SAMPLES = 1200
+
+
+def write_reports(root, samples=SAMPLES, years=('2022', '2023'), seed=0):
+	# root/<year>/ 에 합성 레포트를 쓰고 {year: [경로]} 반환
+	files, _ = benchmark.generate(samples, str(root), years, seed)
+	return files
+
+
+@pytest.fixture(scope='session')
+def report_root(tmp_path_factory):
+	root = tmp_path_factory.mktemp("reports")
+	write_reports(root)
+	return str(root)
+
+
+@pytest.fixture(scope='session')
+def frame(report_root, tmp_path_factory):
+	from covid_data import LiveDataset
+	return LiveDataset(report_root, cache_dir=str(tmp_path_factory.mktemp("cache")), workers=1).load()
+
+
+@pytest.fixture(scope='session')
+def app(report_root):
+	# app 은 import 할 때 COVID_REPORT_ROOT 의 레포트를 읽음 (한 번만 import)
+	os.environ["COVID_REPORT_ROOT"] = report_root
+	import app
+	app.dataset_ready.wait()
+	return app
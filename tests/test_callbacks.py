@@ -0,0 +1,58 @@
+import json
+import numpy as np
+import pytest
+import plotly.graph_objects as go
+
+FULL = [0, 10000]
+# 샘플이 하나도 남지 않는 선택: 체크박스를 다 끄거나, 샘플이 없는 batch 범위 / year / 조합
+EMPTY = [
+	('All', [], 'All', ['All'], FULL),
+	('All', ['All'], 'All', [], FULL),
+	('All', [], 'All', [], FULL),
+	('All', ['All'], 'All', ['All'], [9000, 10000]),
+	('1999', ['All'], 'All', ['All'], FULL),
+	('All', ['recombinant'], '>=90%', ['NA'], FULL),
+]
+FIGURES = ['clade_count_figure', 'clade_percent_figure', 'pass_figure', 'sunburst_figure', 'depth_box_figure',
+		   'reads_box_figure', 'parallel_figure']
+VIEWS = [('clade_count_figure', 'clade_count_view'), ('clade_percent_figure', 'clade_percent_view'), ('pass_figure', 'pass_view')]
+
+
+def serialize(fig):
+	# 콜백 응답처럼 JSON 으로
+	return json.loads(go.Figure(fig).to_json() if isinstance(fig, go.Figure) else json.dumps(fig))
+
+
+@pytest.mark.parametrize('where', EMPTY)
+@pytest.mark.parametrize('name', FIGURES)
+def test_figure_empty_selection(app, name, where):
+	serialize(getattr(app, name)(*where))
+
+
+@pytest.mark.parametrize('where', EMPTY)
+def test_lineage_sunburst_empty_selection(app, where):
+	serialize(app.sunburst_figure(*where, mode='lineage'))
+
+
+@pytest.mark.parametrize('where', EMPTY)
+@pytest.mark.parametrize('name, view', VIEWS)
+def test_view_empty_selection(app, name, view, where):
+	# lazy_figure 처럼 전체 batch 범위 figure 에 선택을 view 로 적용
+	fig = app.cached_figure(name, getattr(app, name), where[0], ['All'], where[2], where[3], FULL)
+	getattr(app, view)(fig, [trace.get('name') for trace in fig['data']], *where)
+	serialize(fig)
+
+
+@pytest.mark.parametrize('where', EMPTY)
+def test_summary_and_table_empty_selection(app, where):
+	app.pass_summary(*where)
+	engine, rows = app.table_rows(*where, [{'column_id': 'totalreads', 'direction': 'asc'}], '{clade} = 22B')
+	assert len(rows) == 0
+
+
+def test_figures_full_selection(app):
+	where = ('All', ['All'], 'All', ['All'], FULL)
+	for name in FIGURES:
+		serialize(getattr(app, name)(*where))
+	summary = app.count_cube.summary(*where)
+	assert summary['samples'] == len(app.covid)
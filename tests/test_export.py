@@ -0,0 +1,54 @@
+import io
+import json
+import pandas as pd
+import pytest
+
+ALL = {'year': 'All', 'clade': ['All'], 'cov': 'All', 'qc': ['All'], 'batch': [0, 10000]}
+
+
+@pytest.fixture(scope='module')
+def client(app):
+	return app.server.test_client()
+
+
+def filtered_csv(client, filters):
+	return client.get('/export/filtered.csv', query_string={'q': json.dumps(filters) if not isinstance(filters, str) else filters})
+
+
+def test_filtered_csv(app, client):
+	filters = dict(ALL, qc=['good'], sort_by=[{'column_id': 'totalreads', 'direction': 'desc'}], filter_query='{clade} contains 22B')
+	response = filtered_csv(client, filters)
+	assert response.status_code == 200
+	df = pd.read_csv(io.BytesIO(response.data), dtype={'sample': str})
+	expected = app.covid[(app.covid['QC'] == 'good') & app.covid['clade'].astype(str).str.contains('22B')]
+	assert sorted(df['sample']) == sorted(expected['sample'])
+	assert df['totalreads'].is_monotonic_decreasing
+
+
+def test_filtered_csv_empty_selection(client):
+	response = filtered_csv(client, dict(ALL, qc=None))
+	assert response.status_code == 200
+	assert response.data.decode().count("\n") == 1
+
+
+@pytest.mark.parametrize('q, message', [
+	('{"year": "All"', "not valid JSON"),
+	('[1, 2]', "JSON object"),
+	(dict(ALL, page=1), "unknown filter key(s): page"),
+	({'year': 'All'}, "missing filter key(s)"),
+	(dict(ALL, clade='22B'), "clade must be a list"),
+	(dict(ALL, qc=[1]), "qc must be a list of strings"),
+	(dict(ALL, batch=[1]), "batch must be [min, max]"),
+	(dict(ALL, sort_by=[{'column_id': 'nope', 'direction': 'asc'}]), "sort_by entries"),
+])
+def test_filtered_csv_bad_query(client, q, message):
+	response = filtered_csv(client, q)
+	assert response.status_code == 400
+	assert message in response.data.decode()
+
+
+def test_full_csv(app, client):
+	response = client.get('/export/full.csv')
+	assert response.status_code == 200
+	df = pd.read_csv(io.BytesIO(response.data), dtype={'sample': str})
+	assert len(df) == len(app.covid)
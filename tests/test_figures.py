@@ -0,0 +1,30 @@
+import pytest
+from covid_jobs import parallel_coordinates_figure
+
+PARALLEL_COLUMNS = ['batch', 'totalreads', 'coverage', 'depth', 'QC', 'clade', 'P/F']
+
+
+def test_parallel_coordinates_empty_frame(frame):
+	fig = parallel_coordinates_figure(frame[PARALLEL_COLUMNS].iloc[:0], 100)
+	dimensions = {d.label: d for d in fig.data[0].dimensions}
+	assert dimensions['Total Reads'].range is None
+	assert dimensions['Coverage'].range == (0, 1)
+	fig.to_json()
+
+
+def test_parallel_coordinates_ranges(frame):
+	fig = parallel_coordinates_figure(frame[PARALLEL_COLUMNS], 100)
+	dimensions = {d.label: d for d in fig.data[0].dimensions}
+	assert dimensions['Total Reads'].range == (frame['totalreads'].min(), frame['totalreads'].max())
+	assert len(dimensions['Depth'].values) == 100
+
+
+@pytest.mark.parametrize('year, clade, cov, qc, batch', [
+	('All', ['All'], 'All', [], [0, 10000]),
+	('All', [], 'All', ['All'], [0, 10000]),
+	('All', ['All'], 'All', ['All'], [9000, 10000]),
+])
+def test_parallel_figure_empty_selection(app, year, clade, cov, qc, batch):
+	fig = app.parallel_figure(year, clade, cov, qc, batch)
+	assert len(fig.data[0].dimensions[0].values) == 0
+	fig.to_json()
@@ -0,0 +1,144 @@
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+from covid_index import FilterEngine, CountCube, box_stats, decimate
+
+CLADE_MAP = {'20C': 'etc', '21I (Delta)': 'etc', '21K': 'etc', '21L': 'etc', '22A': 'etc', '22C': 'etc', 'recombinant': 'etc'}
+YEARS = ['All', '2022', '2023']
+CLADES = [['All'], ['22B'], ['22D', 'etc'], []]
+COVS = ['All', '>=90%', '<90%']
+QCS = [['All'], ['good'], ['bad', 'mediocre', 'NA'], []]
+BATCHES = [[-np.inf, np.inf], [2, 3], [3, 3], [100, 200]]
+
+
+@pytest.fixture(scope='module')
+def covid(frame):
+	# coverage 가 빈 샘플 (P/F 는 Fail) 을 섞은 데이터
+	df = frame.copy()
+	missing = np.arange(len(df)) % 7 == 0
+	df['coverage'] = df['coverage'].mask(missing)
+	df['P/F'] = pd.Categorical(np.where(df['coverage'].fillna(0) >= 0.9, 'Pass', 'Fail'), categories=['Fail', 'Pass'])
+	return df
+
+
+def brute_force(df, year, clade, cov, qc, batch):
+	# 필터 정의 그대로 pandas 로 거른 결과
+	mask = df['batch'].between(batch[0], batch[1])
+	if year != 'All':
+		mask &= df['year'].astype(str) == year
+	if 'All' not in clade:
+		mask &= df['clade'].astype(str).replace(CLADE_MAP).isin(clade)
+	if cov == '>=90%':
+		mask &= df['P/F'] == 'Pass'
+	elif cov == '<90%':
+		mask &= df['P/F'] == 'Fail'
+	if 'All' not in qc:
+		mask &= df['QC'].astype(str).isin(qc)
+	return df[mask.to_numpy(dtype=bool)]
+
+
+def filters():
+	return itertools.product(YEARS, CLADES, COVS, QCS, BATCHES)
+
+
+def test_filter_engine_matches_pandas(covid):
+	engine = FilterEngine(covid, CLADE_MAP)
+	for year, clade, cov, qc, batch in filters():
+		got = engine.filter(year, clade, cov, qc, batch)
+		expected = brute_force(covid, year, clade, cov, qc, batch)
+		assert sorted(got['sample']) == sorted(expected['sample']), (year, clade, cov, qc, batch)
+
+
+def test_filter_engine_missing_coverage_is_fail(covid):
+	engine = FilterEngine(covid)
+	rows = engine.filter('All', ['All'], '<90%', ['All'], [-np.inf, np.inf])
+	assert rows['coverage'].isna().sum() == covid['coverage'].isna().sum() > 0
+	assert len(rows) + len(engine.filter('All', ['All'], '>=90%', ['All'], [-np.inf, np.inf])) == len(covid)
+
+
+def test_filter_engine_memo(covid):
+	engine = FilterEngine(covid, CLADE_MAP)
+	first = engine.rows('All', ['etc', '22B'], 'All', ['All'], [-np.inf, np.inf])
+	assert engine.rows('All', ['22B', 'etc'], 'All', ['All'], [-np.inf, np.inf]) is first
+
+
+def test_filter_engine_partition_order(covid):
+	engine = FilterEngine(covid.sample(frac=1, random_state=0))
+	keys = list(zip(engine.frame['year'].astype(str), engine.frame['batch']))
+	assert keys == sorted(keys)
+
+
+def test_box_stats_matches_numpy():
+	rng = np.random.default_rng(0)
+	batch = np.repeat([1, 2, 3], [40, 1, 25])
+	values = rng.gamma(2.0, 100, len(batch))
+	values[5] = np.nan
+	stats, _, _ = box_stats(batch, values)
+	for row in stats.itertuples():
+		v = values[(batch == row.batch) & ~np.isnan(values)]
+		assert np.allclose([row.q1, row.median, row.q3], np.percentile(v, [25, 50, 75]))
+		assert row.count == len(v)
+
+
+@pytest.mark.parametrize('max_outliers, shown', [(2, 2), (0, 5), (-1, 5)])
+def test_box_stats_outlier_limit(max_outliers, shown):
+	# 10, 11, 12 사이 값 60 개 + outlier 5 개
+	values = np.r_[np.tile([10.0, 11.0, 12.0], 20), np.arange(100, 105, dtype=float)]
+	batch = np.ones(len(values), dtype=np.int16)
+	_, out_batch, out_values = box_stats(batch, values, max_outliers)
+	assert len(out_values) == shown
+	assert out_values.max() == 104
+
+
+def test_decimate():
+	rows = np.arange(100)
+	assert len(decimate(rows, 10)) == 10
+	assert decimate(rows, 0) is rows
+
+
+def counts(df, columns):
+	# pandas groupby 로 센 0 이 아닌 샘플 수 {키: 수}
+	if len(df) == 0:
+		return {}
+	return {k if isinstance(k, tuple) else (k,): int(n) for k, n in df.groupby(columns, observed=True).size().items() if n}
+
+
+def cube_counts(df, columns):
+	return {tuple(row[:-1]): int(row[-1]) for row in df[columns + ['count']].itertuples(index=False, name=None) if row[-1]}
+
+
+def test_count_cube_matches_pandas(covid):
+	cube = CountCube(covid, CLADE_MAP)
+	df = covid.assign(clade=covid['clade'].astype(str).replace(CLADE_MAP), raw=covid['clade'].astype(str), pango=covid['pango'].astype(str),
+					  **{'P/F': covid['P/F'].astype(str)})
+	for year, clade, cov, qc, batch in filters():
+		expected = brute_force(df, year, clade, cov, qc, batch)
+		where = (year, clade, cov, qc, batch)
+
+		summary = cube.summary(*where)
+		assert (summary['samples'], summary['pass']) == (len(expected), int((expected['P/F'] == 'Pass').sum())), where
+		assert summary['clades'] == {k[0]: n for k, n in counts(expected, ['clade']).items()}, where
+		assert cube_counts(cube.passfail(*where), ['batch', 'P/F']) == counts(expected, ['batch', 'P/F']), where
+		# sunburst 는 묶기 전 clade
+		assert cube_counts(cube.sunburst(*where).rename(columns={'clade': 'raw'}), ['raw', 'pango']) == counts(expected, ['raw', 'pango']), where
+
+		# clade 막대는 clade 선택과 상관없이 전체 clade
+		bars = cube.clade_counts(*where)
+		assert cube_counts(bars, ['batch', 'clade']) == counts(brute_force(df, year, ['All'], cov, qc, batch), ['batch', 'clade']), where
+		assert np.allclose(bars.groupby('batch')['percent'].sum(), 100)
+
+
+def test_count_cube_incremental(covid):
+	# 일부 행을 빼고 만든 cube 에 add / 빼기로 맞춘 결과가 처음부터 만든 cube 와 같음
+	df = covid.reset_index(drop=True)
+	added = df.iloc[1::7]
+	base = df.drop(added.index)
+	removed = base.iloc[::5]
+	cube = CountCube(base, CLADE_MAP).copy()
+	cube.add(added)
+	cube.add(removed, -1)
+	expected = CountCube(df.drop(removed.index), CLADE_MAP)
+	where = ('All', ['All'], 'All', ['All'], [-np.inf, np.inf])
+	assert cube.summary(*where) == expected.summary(*where)
+	assert cube_counts(cube.passfail(*where), ['batch', 'P/F']) == cube_counts(expected.passfail(*where), ['batch', 'P/F'])
@@ -0,0 +1,86 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from covid_data import LiveDataset, concat_typed, dedup_samples
+from covid_index import CountCube
+
+WHERE = ('All', ['All'], 'All', ['All'], [-np.inf, np.inf])
+
+
+def key(frame):
+	# 행 순서와 상관없이 비교
+	return frame.sort_values('sample').reset_index(drop=True).astype(str)
+
+
+def copy_reports(src, dst, names):
+	# 복사한 파일은 settle 시간보다 오래된 것으로
+	for year, name in names:
+		os.makedirs(os.path.join(dst, year), exist_ok=True)
+		path = os.path.join(dst, year, name)
+		shutil.copy(os.path.join(src, year, name), path)
+		os.utime(path, (0, 0))
+
+
+@pytest.fixture
+def live(report_root, tmp_path):
+	# 2022 의 처음 레포트만 있는 폴더에서 시작
+	names = [(year, name) for year in sorted(os.listdir(report_root)) if os.path.isdir(os.path.join(report_root, year))
+			 for name in sorted(os.listdir(os.path.join(report_root, year)))]
+	root = str(tmp_path / "reports")
+	copy_reports(report_root, root, names[:2])
+	dataset = LiveDataset(root, cache_dir=str(tmp_path / "cache"), workers=1, settle=0)
+	events = []
+	dataset.on_change(lambda frame, batches, added, removed: events.append((batches, added, removed)))
+	dataset.load()
+	return dataset, root, names, events
+
+
+def reload(dataset):
+	return LiveDataset(dataset.root, cache_dir=dataset.cache_dir, workers=1).load()
+
+
+def test_poll_matches_full_reload(report_root, live):
+	dataset, root, names, events = live
+	cube = CountCube(dataset.frame)
+	# 재실험 레포트와 새 년도 폴더를 포함해서 나머지를 두 번에 나눠 추가
+	for chunk in (names[2:5], names[5:]):
+		copy_reports(report_root, root, chunk)
+		batches = dataset.poll()
+		assert batches
+		_, added, removed = events[-1]
+		cube = cube.copy()
+		cube.add(removed, -1)
+		cube.add(added)
+		full = reload(dataset)
+		assert key(dataset.frame).equals(key(full))
+		assert cube.summary(*WHERE) == CountCube(full).summary(*WHERE)
+	assert set(dataset.frame['year']) == {'2022', '2023'}
+	assert dataset.poll() == set()
+
+
+def test_poll_reloads_on_removed_file(live):
+	dataset, root, names, events = live
+	year, name = names[0]
+	os.remove(os.path.join(root, year, name))
+	assert dataset.poll() is None
+	assert events[-1] == (None, None, None)
+	assert key(dataset.frame).equals(key(reload(dataset)))
+
+
+def test_merge_missing_totalreads(live):
+	# totalreads 가 빈 재실험: 새 NA 샘플 / NA 를 값으로 재실험 / NA 를 다시 NA 로 / 값이 있는 샘플을 NA 로
+	dataset, root, names, events = live
+	base = dataset.frame
+	rows = base.head(4).copy()
+	first = rows.assign(sample=['NA-0', 'NA-1', rows['sample'].iloc[2], rows['sample'].iloc[3]], totalreads=pd.NA)
+	first['totalreads'] = first['totalreads'].astype('Int32')
+	dataset.merge(first)
+	second = rows.iloc[:2].assign(sample=['NA-0', 'NA-1'], batch=np.int16(999))
+	second['totalreads'] = pd.array([12345, pd.NA], dtype='Int32')
+	dataset.merge(second)
+	expected = dedup_samples(concat_typed([base, first, second]))
+	assert key(dataset.frame).equals(key(expected))
+	assert not dataset.frame['sample'].duplicated().any()
+	assert dataset.frame.set_index('sample').loc['NA-0', 'totalreads'] == 12345
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import write_reports
+from covid_data import LiveDataset, report_partitions
+from covid_index import FilterEngine, CountCube
+
+
+@pytest.fixture(scope='module')
+def mixed(tmp_path_factory):
+	# 숫자 partition 폴더 하나 + 숫자가 아닌 폴더 하나
+	root = tmp_path_factory.mktemp("mixed")
+	write_reports(root, 800, years=('2022', 'pilot'))
+	dataset = LiveDataset(str(root), cache_dir=str(tmp_path_factory.mktemp("mixed-cache")), workers=1)
+	return dataset.load()
+
+
+def test_partition_folders(mixed):
+	assert isinstance(mixed['year'].dtype, pd.CategoricalDtype)
+	assert sorted(mixed['year'].unique()) == ['2022', 'pilot']
+	assert set(mixed['year'].cat.categories) == {'2022', 'pilot'}
+
+
+def test_partition_filters(mixed):
+	engine = FilterEngine(mixed)
+	assert [p['name'] for p in engine.partitions] == ['2022', 'pilot']
+	assert sum(p['rows'] for p in engine.partitions) == len(mixed)
+	cube = CountCube(mixed)
+	for year in ('2022', 'pilot'):
+		rows = engine.filter(year, ['All'], 'All', ['All'], [-np.inf, np.inf])
+		expected = mixed[mixed['year'] == year]
+		assert sorted(rows['sample']) == sorted(expected['sample'])
+		assert cube.summary(year, ['All'], 'All', ['All'], [-np.inf, np.inf])['samples'] == len(expected)
+
+
+def test_app_filter_options(app, mixed):
+	# 다른 테스트가 쓰는 app 데이터셋은 끝나고 되돌림
+	original = app.covid
+	try:
+		app.refresh_dataset(mixed, None, None, None)
+		years = app.filter_options()[0]
+		assert years == ['All', '2022', 'pilot']
+		assert app.client_payload()['year']['labels'] == ['2022', 'pilot']
+	finally:
+		app.refresh_dataset(original, None, None, None)
+
+
+def test_report_partitions_skips_files(tmp_path):
+	(tmp_path / "2022").mkdir()
+	(tmp_path / "pilot").mkdir()
+	(tmp_path / ".hidden").mkdir()
+	(tmp_path / "notes.txt").write_text("")
+	assert list(report_partitions(str(tmp_path))) == ['2022', 'pilot']
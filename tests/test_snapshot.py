@@ -0,0 +1,32 @@
+import os
+import pandas as pd
+from covid_data import write_snapshot, open_snapshot, SharedDataset
+from covid_index import partition_order
+
+
+def test_snapshot_round_trip(frame, tmp_path):
+	version = write_snapshot(frame, str(tmp_path), "abc")
+	shared, opened_version, fingerprint = open_snapshot(str(tmp_path))
+	assert (opened_version, fingerprint) == (version, "abc")
+	# partition 순으로 저장되므로 다시 정렬하지 않음
+	assert partition_order(shared) is None
+	assert dict(shared.dtypes.astype(str)) == dict(frame.dtypes.astype(str))
+	expected = frame.iloc[partition_order(frame)] if partition_order(frame) is not None else frame
+	pd.testing.assert_frame_equal(shared, expected, check_categorical=False)
+
+
+def test_shared_dataset_follows_current(frame, tmp_path):
+	cache_dir = str(tmp_path)
+	write_snapshot(frame, cache_dir, "one")
+	dataset = SharedDataset(cache_dir)
+	events = []
+	dataset.on_change(lambda *changes: events.append(changes))
+	dataset.load()
+	assert dataset.poll() == set()
+	write_snapshot(frame.iloc[:10], cache_dir, "two")
+	write_snapshot(frame.iloc[:20], cache_dir, "three")
+	assert dataset.poll() is None
+	assert (len(dataset.frame), dataset.fingerprint, len(events)) == (20, "three", 2)
+	# 현재와 바로 전 snapshot 만 남김
+	assert len([name for name in os.listdir(os.path.join(cache_dir, "snapshot")) if name != "current"]) == 2
+
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+import benchmark
+from covid_data import LiveDataset, report_partitions, run_rank
+from covid_store import SampleStore
+
+YEAR = '2022'
+
+
+def report_rows(samples, batch, seed):
+	return benchmark._report_rows(np.random.default_rng(seed), YEAR, [batch], np.array(samples), 1, "2022.01.01")
+
+
+@pytest.fixture
+def reports(tmp_path):
+	# 샘플 20 개 레포트 + 그중 두 샘플의 재실험 (totalreads 같음: 하나는 같은 batch, 하나는 다음 batch)
+	folder = tmp_path / "reports" / YEAR
+	folder.mkdir(parents=True)
+	first = report_rows(range(100, 120), 5, 0)
+	benchmark.write_report(str(folder / "b.xlsx"), first)
+	retest = report_rows([100, 101], 5, 1)
+	retest[6] = first[6][:2].values
+	retest.loc[1, 0] = retest.loc[1, 0].replace("_005_", "_006_")
+	retest[3] = ['bad', 'mediocre']
+	return tmp_path, folder, first, retest
+
+
+def load(tmp_path):
+	return LiveDataset(str(tmp_path / "reports"), cache_dir=str(tmp_path / "cache"), workers=1, settle=0)
+
+
+def selected(frame, sample):
+	return frame.set_index('sample').loc[str(sample)]
+
+
+@pytest.mark.parametrize('name', ["c.xlsx", "a.xlsx"])
+def test_tie_break(reports, name):
+	tmp_path, folder, first, retest = reports
+	dataset = load(tmp_path)
+	dataset.load()
+	benchmark.write_report(str(folder / name), retest)
+	old = os.path.getmtime(folder / name) - 60
+	os.utime(folder / name, (old, old))
+	# 같은 batch / totalreads 인 run 은 파일 이름으로 갈리므로 전체 reload (None)
+	assert dataset.poll() is None
+	full = load(tmp_path).load()
+
+	# 재실험 파일이 나중 이름이면 같은 batch 에서도 재실험 결과, 앞 이름이면 처음 결과
+	assert selected(full, 100)['QC'] == ('bad' if name > "b.xlsx" else first[3][0])
+	assert selected(full, 101)['QC'] == 'mediocre'
+	assert selected(full, 101)['batch'] == 6
+	key = lambda f: f.sort_values('sample').reset_index(drop=True).astype(str)
+	assert key(dataset.frame).equals(key(full))
+
+	store = SampleStore(str(tmp_path / "store.sqlite"))
+	store.sync(report_partitions(str(tmp_path / "reports")), cache_dir=str(tmp_path / "cache"), workers=1)
+	for sample in ('100', '101', '110'):
+		runs = store.history(sample)
+		best = [r for r in runs if r['selected']]
+		assert len(best) == 1
+		row = selected(full, sample)
+		assert (best[0]['QC'], best[0]['batch'], best[0]['totalreads']) == (row['QC'], row['batch'], row['totalreads'])
+
+
+def test_run_rank():
+	assert run_rank(None, '2023', 9, 'z.xlsx') < run_rank(0, '2022', 1, 'a.xlsx')
+	assert run_rank(10, '2022', 1, '/x/b.xlsx') > run_rank(10, '2022', 1, '/y/a.xlsx')
+	assert run_rank(10, 'pilot', 1, 'a.xlsx') > run_rank(10, '2023', 2, 'a.xlsx')